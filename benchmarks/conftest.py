@@ -0,0 +1,51 @@
+import shutil
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from damnit.backend.db import DamnitDB
+
+from .synthetic import make_database
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("damnit-benchmarks")
+    group.addoption("--bench-runs", type=int, default=500,
+                    help="Number of runs in the synthetic database")
+    group.addoption("--bench-vars", type=int, default=100,
+                    help="Number of variables per run in the synthetic database")
+    group.addoption("--bench-files", type=int, default=5,
+                    help="Number of runs to create HDF5 files for")
+
+
+@pytest.fixture(scope="session")
+def bench_size(request):
+    opt = request.config.getoption
+    return opt("--bench-runs"), opt("--bench-vars"), opt("--bench-files")
+
+
+@pytest.fixture(scope="session")
+def _synthetic_db_dir(tmp_path_factory, bench_size):
+    n_runs, n_vars, n_files = bench_size
+    db_dir = tmp_path_factory.mktemp("synthetic_db")
+    make_database(db_dir, n_runs, n_vars, n_files).close()
+    return db_dir
+
+
+@pytest.fixture
+def synthetic_db(_synthetic_db_dir, tmp_path):
+    """A fresh copy of the synthetic database, which benchmarks may modify"""
+    db_dir = tmp_path / "db"
+    shutil.copytree(_synthetic_db_dir, db_dir)
+    db = DamnitDB.from_dir(db_dir)
+    yield db_dir, db
+    db.close()
+
+
+@pytest.fixture
+def synthetic_db_readonly(_synthetic_db_dir):
+    """The shared synthetic database, for benchmarks that don't modify it"""
+    db = DamnitDB.from_dir(_synthetic_db_dir)
+    yield _synthetic_db_dir, db
+    db.close()
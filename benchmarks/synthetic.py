@@ -0,0 +1,119 @@
+"""Generate synthetic databases & HDF5 files for benchmarking"""
+import json
+from functools import lru_cache
+
+import numpy as np
+import xarray as xr
+
+from damnit.backend.db import DamnitDB, ReducedData
+from damnit.backend.extract_data import manifest_from_file
+from damnit.context import Results
+# damnit.context puts these modules on sys.path
+from ctxrunner import generate_thumbnail
+from damnit_ctx import Cell
+
+PROPOSAL = 1234
+
+
+@lru_cache
+def thumbnail_png():
+    return generate_thumbnail(np.random.default_rng(0).random((64, 64))).data
+
+
+def variable_kind(i):
+    """Decide what kind of data the i'th variable holds"""
+    if i % 10 == 9:
+        return "image"
+    elif i % 10 == 8:
+        return "array"
+    elif i % 10 == 7:
+        return "string"
+    return "scalar"
+
+
+def reduced_value(kind, rng):
+    if kind == "image":
+        return thumbnail_png()
+    elif kind == "string":
+        return f"{kind}: {rng.integers(1000)}"
+    elif kind == "array":
+        return "float64: (100, 100)"
+    return float(rng.normal())
+
+
+def make_reduced_data(n_vars, rng):
+    """Make a dict of ReducedData objects for one run, as passed to add_to_db()"""
+    reduced = {}
+    for i in range(n_vars):
+        kind = variable_kind(i)
+        reduced[f"var_{i:04}"] = ReducedData(
+            reduced_value(kind, rng),
+            max_diff=float(rng.random()) if kind == "scalar" else None,
+            attributes={"bold": True} if i == 0 else None,
+        )
+    return reduced
+
+
+def make_results(n_vars, rng, array_shape=(100, 100)):
+    """Make a Results object for one run, like ctxrunner would"""
+    cells = {}
+    for i in range(n_vars):
+        kind = variable_kind(i)
+        name = f"var_{i:04}"
+        if kind == "image":
+            cells[name] = Cell(rng.random(array_shape))
+        elif kind == "array":
+            cells[name] = Cell(xr.DataArray(rng.random(array_shape), dims=["x", "y"]))
+        elif kind == "string":
+            cells[name] = Cell(f"run data {i}")
+        else:
+            cells[name] = Cell(np.asarray(rng.normal()))
+    return Results(cells, ctx=None)
+
+
+def make_database(db_dir, n_runs, n_vars, n_files, seed=0):
+    """Create a database with n_runs x n_vars values
+
+    HDF5 files in extracted_data/ are only created for the first n_files runs,
+    because writing them is much slower than filling the database.
+    """
+    rng = np.random.default_rng(seed)
+    db = DamnitDB.from_dir(db_dir)
+    db.metameta["proposal"] = PROPOSAL
+    var_names = [f"var_{i:04}" for i in range(n_vars)]
+
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO variables (name, type, title, description, attributes) "
+            "VALUES (?, NULL, ?, NULL, NULL)",
+            [(name, f"Variable {i}") for i, name in enumerate(var_names)]
+        )
+        db.conn.executemany(
+            "INSERT INTO run_info (proposal, run, start_time, added_at) VALUES (?, ?, ?, ?)",
+            [(PROPOSAL, run, 1.7e9 + run * 60, 1.7e9 + run * 60)
+             for run in range(1, n_runs + 1)]
+        )
+
+        rows = []
+        for run in range(1, n_runs + 1):
+            for name, reduced in make_reduced_data(n_vars, rng).items():
+                attrs = json.dumps(reduced.attributes) if reduced.attributes else None
+                rows.append((PROPOSAL, run, name, 1, reduced.value, 1.7e9,
+                             reduced.max_diff, "context.py", "", attrs))
+        db.conn.executemany("""
+            INSERT INTO run_variables (proposal, run, name, version, value, timestamp,
+                                       max_diff, provenance, summary_method, attributes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+    db.update_views()
+
+    data_dir = db_dir / "extracted_data"
+    data_dir.mkdir(exist_ok=True)
+    for run in range(1, n_files + 1):
+        make_results(n_vars, rng).save_hdf5(data_dir / f"p{PROPOSAL}_r{run}.h5")
+        db.add_to_manifest(PROPOSAL, run, manifest_from_file(
+            data_dir / f"p{PROPOSAL}_r{run}.h5"
+        ))
+
+    return db
@@ -0,0 +1,32 @@
+from damnit import Damnit, RunVariables
+
+
+def test_table(benchmark, synthetic_db_readonly):
+    db_dir, _ = synthetic_db_readonly
+    damnit = Damnit(db_dir)
+    benchmark(damnit.table)
+
+
+def test_run_variables_keys(benchmark, synthetic_db_readonly):
+    db_dir, _ = synthetic_db_readonly
+    benchmark(lambda: RunVariables(db_dir, 1).keys())
+
+
+def test_variable_lookup(benchmark, synthetic_db_readonly):
+    db_dir, _ = synthetic_db_readonly
+    run_vars = RunVariables(db_dir, 1)
+    # Look up by title, which has to search through all the variables
+    benchmark(lambda: run_vars["Variable 0"])
+
+
+def test_variable_read(benchmark, synthetic_db_readonly):
+    db_dir, _ = synthetic_db_readonly
+    run_vars = RunVariables(db_dir, 1)
+    # var_0008 is an xarray DataArray
+    benchmark(run_vars["var_0008"].read)
+
+
+def test_variable_slice(benchmark, synthetic_db_readonly):
+    db_dir, _ = synthetic_db_readonly
+    var = RunVariables(db_dir, 1)["var_0008"]
+    benchmark(lambda: var[:10, :10])
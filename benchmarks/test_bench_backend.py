@@ -0,0 +1,68 @@
+import pickle
+from itertools import count
+
+import numpy as np
+import pytest
+
+from damnit.backend import wire_format
+from damnit.backend.extract_data import add_to_db, run_values_msg
+
+from .synthetic import PROPOSAL, make_reduced_data, make_results
+
+
+def test_add_to_db(benchmark, synthetic_db, bench_size):
+    _, n_vars, _ = bench_size
+    db_dir, db = synthetic_db
+    reduced = make_reduced_data(n_vars, np.random.default_rng(1))
+    new_runs = count(100_000)
+
+    benchmark(lambda: add_to_db(reduced, db, PROPOSAL, next(new_runs)))
+
+
+def test_update_views(benchmark, synthetic_db):
+    db_dir, db = synthetic_db
+    benchmark(db.update_views)
+
+
+def test_save_hdf5(benchmark, bench_size, tmp_path):
+    _, n_vars, _ = bench_size
+    results = make_results(n_vars, np.random.default_rng(1))
+    path = tmp_path / "p1234_r1.h5"
+
+    # Saving again to the same file replaces the variables, like reprocessing
+    benchmark(results.save_hdf5, path)
+
+
+# Encoding of Kafka update messages, compared with pickle which was used before
+CODECS = {
+    "wire_format": (wire_format.encode, wire_format.decode),
+    "pickle": (pickle.dumps, pickle.loads),
+}
+
+
+@pytest.fixture(params=["scalars", "image"])
+def update_message(request, bench_size):
+    # Like Extractor, send images separately from the other values
+    _, n_vars, _ = bench_size
+    reduced = make_reduced_data(n_vars, np.random.default_rng(1))
+    images = {k: r for k, r in reduced.items() if isinstance(r.value, bytes)}
+    if request.param == "image":
+        name = next(iter(images))
+        return run_values_msg(PROPOSAL, 1, {name: images[name]})
+    return run_values_msg(PROPOSAL, 1, {
+        k: r for k, r in reduced.items() if k not in images
+    })
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_encode_message(benchmark, update_message, codec):
+    encode, _ = CODECS[codec]
+    benchmark.extra_info["bytes"] = len(encode(update_message))
+    benchmark(encode, update_message)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_decode_message(benchmark, update_message, codec):
+    encode, decode = CODECS[codec]
+    data = encode(update_message)
+    benchmark(decode, data)
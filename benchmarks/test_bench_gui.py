@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from PyQt5.QtCore import Qt
+
+from damnit.gui.table import DamnitTableModel, RunTableProxyModel
+
+
+def test_table_model(benchmark, synthetic_db_readonly, qtbot):
+    _, db = synthetic_db_readonly
+
+    def make_model():
+        model = DamnitTableModel(db, {}, None, load_in_background=False)
+        model.deleteLater()
+        return model
+
+    benchmark(make_model)
+
+
+def test_numbers_for_plotting(benchmark, synthetic_db_readonly, qtbot):
+    _, db = synthetic_db_readonly
+    model = DamnitTableModel(db, {}, None, load_in_background=False)
+    benchmark(model.numbers_for_plotting, "Variable 0", "Variable 1")
+
+
+def test_sort_table(benchmark, synthetic_db_readonly, qtbot):
+    _, db = synthetic_db_readonly
+    model = DamnitTableModel(db, {}, None, load_in_background=False)
+    proxy = RunTableProxyModel()
+    proxy.setSourceModel(model)
+    col = model.find_column("Variable 0", by_title=True)
+
+    def sort():
+        # Clear the cached order so this measures sorting the column values
+        model._sort_orders.clear()
+        proxy.sort(col, Qt.AscendingOrder)
+        proxy.sort(col, Qt.DescendingOrder)
+
+    benchmark(sort)
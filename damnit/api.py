@@ -35,6 +35,22 @@ def find_proposal(propno):
     raise FileNotFoundError("Couldn't find proposal dir for {!r}".format(propno))
 
 
+class LazyDataset(h5py.Dataset):
+    """An `h5py.Dataset` which keeps its file open until it is closed.
+
+    Returned by `VariableData.read(lazy=True)` for arrays. Call `close()` or
+    use it in a `with` block when you're done with it.
+    """
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class VariableData:
     """Represents a variable for a single run.
 
@@ -89,6 +105,13 @@ class VariableData:
 
         one of ``DataType`` or None.
         """
+        # The run manifest records type hints, which saves opening the file
+        row = self._db.conn.execute("""
+            SELECT type_hint FROM run_manifest WHERE proposal=? AND run=? AND name=?
+        """, (self.proposal, self.run, self.name)).fetchone()
+        if row is not None:
+            return DataType(row[0]) if row[0] else None
+
         with self._open_h5_group() as group:
             return self._type_hint(group)
 
@@ -104,21 +127,30 @@ class VariableData:
             return DataType(hint_s)
         return None
 
-    def _read_netcdf(self, one_array=False):
+    def _read_netcdf(self, one_array=False, lazy=False):
         import xarray as xr
-        load = xr.load_dataarray if one_array else xr.load_dataset
+        if lazy:
+            load = xr.open_dataarray if one_array else xr.open_dataset
+        else:
+            load = xr.load_dataarray if one_array else xr.load_dataset
         obj = load(self._h5_path, group=self.name, engine="h5netcdf")
         # Remove internal attributes from loaded object
         obj.attrs = {k: v for (k, v) in obj.attrs.items()
                      if not k.startswith('_damnit_')}
         return obj
 
-    def read(self, deserialize_plotly=True):
+    def read(self, deserialize_plotly=True, lazy=False):
         """Read the data for the variable.
 
         Args:
             deserialize_plotly (bool): Whether to deserialize Plotly figures
                 into `Figure` objects. If this is `False` the JSON string will be returned.
+            lazy (bool): Don't load array data into memory. Arrays are returned
+                as a [LazyDataset][damnit.api.LazyDataset], and xarray objects
+                are opened with `xarray.open_dataarray()`/`open_dataset()`, so
+                only the parts you select are read from disk. The file stays
+                open until you call `.close()` on the returned object, or use
+                it in a `with` block. Other types are always read.
         """
         if self._db_only:
             return self.summary()
@@ -126,12 +158,16 @@ class VariableData:
         with self._open_h5_group() as group:
             type_hint = self._type_hint(group)
             if type_hint is DataType.Dataset:
-                return self._read_netcdf()
+                return self._read_netcdf(lazy=lazy)
             elif type_hint is DataType.DataArray:
-                return self._read_netcdf(one_array=True)
+                return self._read_netcdf(one_array=True, lazy=lazy)
 
             dset = group["data"]
-            if type_hint is DataType.PlotlyFigure:
+            if lazy and self._is_array(dset, type_hint):
+                # Reopen the file so it isn't closed when we return
+                f = h5py.File(self._h5_path, 'r')
+                return LazyDataset(f[self.name]["data"].id)
+            elif type_hint is DataType.PlotlyFigure:
                 import plotly.io as pio
                 # plotly figures are json serialized and saved as uint8 arrays
                 # to enable compression in HDF5
@@ -150,6 +186,32 @@ class VariableData:
                 # Otherwise, return a Numpy array
                 return group["data"][()]
 
+    def __getitem__(self, key):
+        """Read part of an array variable, e.g. `myvar[:100, 20:30]`.
+
+        Only the selected part is read from disk. This works for arrays and
+        DataArrays (returning a DataArray), using positional indexing.
+        """
+        if self._db_only:
+            raise TypeError(f"Variable '{self.name}' is not an array, it cannot be sliced")
+
+        with self._open_h5_group() as group:
+            type_hint = self._type_hint(group)
+            if type_hint is not DataType.DataArray:
+                if type_hint is DataType.Dataset or not self._is_array(group["data"], type_hint):
+                    raise TypeError(f"Variable '{self.name}' is not an array, it cannot be sliced")
+                return group["data"][key]
+
+        with self._read_netcdf(one_array=True, lazy=True) as arr:
+            return arr[key].load()
+
+    @staticmethod
+    def _is_array(dset, type_hint):
+        # Plotly figures & strings are also stored as arrays, but can't be
+        # read in pieces.
+        return (dset.ndim > 0 and type_hint is not DataType.PlotlyFigure
+                and h5py.check_string_dtype(dset.dtype) is None)
+
     def summary(self):
         """Read the summary data for a variable.
 
@@ -211,7 +273,7 @@ class RunVariables:
 
     def __getitem__(self, name):
         key_locs = self._key_locations()
-        names_to_titles = self._var_titles()
+        names_to_titles = self._var_titles(key_locs)
         titles_to_names = { title: name for name, title in names_to_titles.items() }
 
         if name not in key_locs and name not in titles_to_names:
@@ -226,23 +288,30 @@ class RunVariables:
                             self._db, key_locs[name])
 
     def _key_locations(self):
-        # Read keys from the HDF5 file
-        with h5py.File(self.file) as f:
-            all_keys = { name: False for name in f.keys() }
-        del all_keys[".reduced"]
-
-        # And the keys from the database
-        user_vars = list(self._db.get_user_variables().keys())
-        user_vars.append("comment")
-
-        for var_name in user_vars:
-            result = self._db.conn.execute("""
+        # Map variable names to whether they're only stored in the database.
+        # The manifest lists the variables in the HDF5 file, and user-editable
+        # variables are in run_variables.
+        rows = self._db.conn.execute("""
+            SELECT name, 0 FROM run_manifest WHERE proposal=:proposal AND run=:run
+            UNION ALL
+            SELECT name, 1 FROM (
                 SELECT name, value, max(version) FROM run_variables
-                WHERE proposal=? AND run=? AND name=?
-            """, (self.proposal, self.run, var_name)).fetchone()
-            if result is not None and result[1] is not None:
-                all_keys[var_name] = True
-
+                WHERE proposal=:proposal AND run=:run AND (
+                    name='comment' OR
+                    name IN (SELECT name FROM variables WHERE type IS NOT NULL)
+                )
+                GROUP BY name
+            ) WHERE value IS NOT NULL
+        """, {"proposal": self.proposal, "run": self.run}).fetchall()
+
+        all_keys = {}
+        if not any(not db_only for _, db_only in rows) and self.file.is_file():
+            # Runs processed before the manifest was added: read the keys from
+            # the HDF5 file instead.
+            with h5py.File(self.file) as f:
+                all_keys = { name: False for name in f.keys() if name != ".reduced" }
+
+        all_keys.update((name, bool(db_only)) for name, db_only in rows)
         return all_keys
 
     def keys(self) -> list:
@@ -253,9 +322,10 @@ class RunVariables:
         """
         return sorted(self._key_locations().keys())
 
-    def _var_titles(self):
+    def _var_titles(self, available_vars=None):
+        if available_vars is None:
+            available_vars = self._key_locations()
         result = self._db.conn.execute("SELECT name, title FROM variables").fetchall()
-        available_vars = self.keys()
         titles = { row[0]: row[1] if row[1] is not None else row[0] for row in result
                    if row[0] in available_vars }
 
@@ -405,5 +475,106 @@ class Damnit:
 
         return df
 
+    def stack(self, name, runs=None) -> "xr.DataArray":
+        """Read an array variable for many runs, stacked along a `run` dimension.
+
+        If the database is set up to save consolidated per-variable files
+        (`amore-proto db-config --num consolidate_arrays 1`), the data is read
+        from these in one go. Otherwise, or for runs missing from them, each
+        run's file is read separately. The arrays must have the same shape
+        for every run.
+
+        Args:
+            name (str): The variable name or title.
+            runs (list): Run numbers to read, defaults to all runs which have
+                the variable.
+        """
+        import numpy as np
+        import xarray as xr
+
+        row = self._db.conn.execute(
+            "SELECT name FROM variables WHERE name=? OR title=?", (name, name)
+        ).fetchone()
+        if row is not None:
+            name = row[0]
+
+        if runs is None:
+            runs = [r[0] for r in self._db.conn.execute("""
+                SELECT run FROM run_variables
+                WHERE proposal=? AND name=? AND value IS NOT NULL ORDER BY run
+            """, (self.proposal, name))]
+
+        arrays = {}
+        dims = None
+        store = self._db_dir / "extracted_data" / "by_variable" / f"{name}.h5"
+        if store.is_file():
+            with h5py.File(store, "r") as f:
+                stored_runs = f["runs"][()]
+                ixs = np.nonzero((stored_runs[:, 0] == self.proposal) &
+                                 np.isin(stored_runs[:, 1], runs))[0]
+                if ixs.size:
+                    data = f["data"][ixs]
+                    arrays = dict(zip(stored_runs[ixs, 1].tolist(), data))
+                    dims = list(f["data"].attrs["dims"])
+
+        for run in runs:
+            if run not in arrays:
+                obj = RunVariables(self._db_dir, run)[name].read()
+                if isinstance(obj, xr.DataArray):
+                    dims = list(obj.dims)
+                arrays[run] = np.asarray(obj)
+
+        arrays = [arrays[r] for r in runs]
+        if len({a.shape for a in arrays}) > 1:
+            raise ValueError(f"Cannot stack '{name}', the shape differs between runs")
+        stacked = np.stack(arrays) if arrays else np.empty((0,))
+        if dims is None:
+            dims = [f"dim_{i}" for i in range(stacked.ndim - 1)]
+
+        return xr.DataArray(stacked, dims=["run", *dims], coords={"run": runs}, name=name)
+
+    def jobs(self) -> "pd.DataFrame":
+        """Retrieve the extraction jobs as a [DataFrame][pandas.DataFrame].
+
+        There is one row per Slurm job launched to process a run, with its
+        `status` (pending, running, finished or failed), submission, start and
+        finish times, `exit_code`, `runtime` in seconds and peak memory usage
+        (`peak_mem`) in bytes. Jobs which haven't started or finished yet
+        will have missing values for these.
+        """
+        import pandas as pd
+
+        df = pd.read_sql_query("""
+            SELECT job_id, cluster, proposal, run, run_data, status, submitted_at,
+                   started_at, finished_at, exit_code, runtime, peak_mem
+            FROM jobs ORDER BY submitted_at
+        """, self._db.conn)
+
+        for col in ["submitted_at", "started_at", "finished_at"]:
+            df[col] = pd.to_datetime(df[col], unit="s", utc=True).dt.tz_convert("Europe/Berlin")
+
+        return df
+
+    def changes_since(self, seq=0) -> "pd.DataFrame":
+        """Find which run variables changed after a given change number.
+
+        Each change has a number `seq`, which always increases, and the
+        `proposal`, `run` & variable `name` which changed, with a `timestamp`.
+        Only the latest change to each variable in each run is included. Rows
+        without a run mean that the variable was deleted. To check for new
+        changes later, pass the highest `seq` seen so far.
+
+        Args:
+            seq (int): Get changes after this number, or all changes for 0.
+        """
+        import pandas as pd
+
+        df = pd.DataFrame(
+            [tuple(r) for r in self._db.changes_since(seq)],
+            columns=["seq", "proposal", "run", "name", "timestamp"],
+        )
+        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s", utc=True).dt.tz_convert("Europe/Berlin")
+        return df
+
     def __repr__(self):
         return f"<Damnit database for p{self.proposal}>"
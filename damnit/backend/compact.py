@@ -0,0 +1,211 @@
+"""Reclaim space in the HDF5 files in extracted_data/
+
+Reprocessing a run deletes & recreates groups in its HDF5 file, but HDF5
+doesn't reuse or release the space the old data took up, so files grow each
+time. Copying the live objects to a new file and swapping it in drops the
+unused space. This is used by the 'amore-proto compact' subcommand.
+"""
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+import h5py
+
+from .db import DamnitDB
+
+log = logging.getLogger(__name__)
+
+RUN_FILE_RE = re.compile(r"p(\d+)_r(\d+)\.h5$")
+
+# Jobs submitted longer ago than this are assumed to have died, if they're
+# still marked as pending or running.
+JOB_MAX_AGE = 24 * 60 * 60
+
+
+@dataclass
+class FileUsage:
+    path: Path
+    file_size: int
+    live_size: int  # Storage used by datasets
+
+    @property
+    def unused(self):
+        return max(self.file_size - self.live_size, 0)
+
+    @property
+    def unused_ratio(self):
+        return self.unused / self.file_size if self.file_size else 0.
+
+
+def file_usage(path) -> FileUsage:
+    """Measure how much of an HDF5 file is taken up by its datasets
+
+    HDF5 only tracks free space while a file is open, so this adds up the
+    storage of the datasets instead. The rest is metadata & unused space.
+    """
+    live_size = 0
+
+    def visit(name, obj):
+        nonlocal live_size
+        if isinstance(obj, h5py.Dataset):
+            live_size += obj.id.get_storage_size()
+
+    with h5py.File(path, 'r') as f:
+        f.visititems(visit)
+    return FileUsage(Path(path), os.stat(path).st_size, live_size)
+
+
+def _dimension_scales(f):
+    """Get {dataset name: [[scale names] for each dim]} for attached scales
+
+    This also checks for object references other than dimension scales,
+    which copying doesn't update.
+    """
+    res = {}
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            if h5py.check_dtype(ref=obj.dtype) is not None:
+                raise RuntimeError(f"Can't copy dataset of references {obj.name}")
+            if 'DIMENSION_LIST' in obj.attrs:
+                res[obj.name] = [[s.name for s in dim.values()] for dim in obj.dims]
+
+        for attr_name in obj.attrs:
+            if attr_name in ('DIMENSION_LIST', 'REFERENCE_LIST'):
+                continue
+            if h5py.check_dtype(ref=obj.attrs.get_id(attr_name).dtype) is not None:
+                raise RuntimeError(f"Can't copy reference attribute {attr_name} on {obj.name}")
+
+    f.visititems(visit)
+    return res
+
+
+def _reattach_scales(dst, dim_scales):
+    """Attach dimension scales in a copied file to the copied datasets
+
+    Copying objects copies the references between datasets & their dimension
+    scales (used by netCDF/xarray) as they are, so they still point to
+    locations in the original file.
+    """
+    scale_names = {s for dims in dim_scales.values() for names in dims for s in names}
+    for name in scale_names:
+        if 'REFERENCE_LIST' in dst[name].attrs:
+            del dst[name].attrs['REFERENCE_LIST']
+
+    for ds_name, dims in dim_scales.items():
+        ds = dst[ds_name]
+        del ds.attrs['DIMENSION_LIST']
+        for dim, names in zip(ds.dims, dims):
+            for name in names:
+                dim.attach_scale(dst[name])
+
+
+def repack_file(path):
+    """Copy the objects in an HDF5 file to a new file and replace it
+
+    The original file is held open for writing while it's copied, so
+    processing jobs can't write to it (they wait & retry when it's locked),
+    and the new file is moved into place before it's released. Copying keeps
+    attributes (like _damnit_objtype), compression and chunking, and
+    dimension scales are attached again in the new file.
+
+    Returns the new size of the file.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.compact-{os.getpid()}")
+    try:
+        with h5py.File(path, 'a') as src:
+            dim_scales = _dimension_scales(src)
+            with h5py.File(tmp_path, 'w') as dst:
+                dst.attrs.update(src.attrs)
+                for name in src:
+                    src.copy(src[name], dst, name=name)
+                _reattach_scales(dst, dim_scales)
+
+            with h5py.File(tmp_path, 'r') as dst:
+                src_names, dst_names = [], []
+                src.visit(src_names.append)
+                dst.visit(dst_names.append)
+                if src_names != dst_names or _dimension_scales(dst) != dim_scales:
+                    raise RuntimeError(f"Copy of {path} doesn't match the original")
+
+            os.chmod(tmp_path, os.stat(path).st_mode)
+            os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    return os.stat(path).st_size
+
+
+def _usage_or_none(path):
+    try:
+        return file_usage(path)
+    except OSError as e:
+        log.warning("Could not read %s: %s", path, e)
+        return None
+
+
+def _repack_or_none(path):
+    try:
+        return repack_file(path)
+    except (OSError, RuntimeError) as e:
+        log.warning("Could not compact %s (it may be in use): %s", path, e)
+        return None
+
+
+def _map(func, items, workers):
+    """map() in a pool of processes, or in this process if workers is 1"""
+    if workers == 1:
+        return list(map(func, items))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(func, items, chunksize=8))
+
+
+def find_fragmented(db_dir, min_ratio=0.25, min_unused=2**20, workers=None):
+    """Find the files in extracted_data/ with a lot of unused space
+
+    Files are selected if at least *min_ratio* of the file and *min_unused*
+    bytes are not used by datasets.
+    """
+    paths = sorted(Path(db_dir, "extracted_data").glob("*.h5"))
+    usages = [u for u in _map(_usage_or_none, paths, workers) if u]
+    return [u for u in usages
+            if u.unused_ratio >= min_ratio and u.unused >= min_unused]
+
+
+def compact(db: DamnitDB, min_ratio=0.25, min_unused=2**20, workers=None,
+            dry_run=False):
+    """Repack fragmented files for a database, in parallel
+
+    Files for runs with pending or running extraction jobs are left alone.
+    Returns (files compacted, bytes saved).
+    """
+    db_dir = db.path.parent
+    fragmented = find_fragmented(db_dir, min_ratio, min_unused, workers)
+
+    busy_runs = db.runs_with_active_jobs(JOB_MAX_AGE)
+    to_compact = []
+    for usage in fragmented:
+        if (m := RUN_FILE_RE.search(usage.path.name)) and \
+                (int(m[1]), int(m[2])) in busy_runs:
+            log.info("Skipping %s, which has an extraction job running", usage.path.name)
+        else:
+            to_compact.append(usage)
+
+    log.info("Found %d files to compact, with %.1f MB unused", len(to_compact),
+             sum(u.unused for u in to_compact) / 1e6)
+    if dry_run or not to_compact:
+        return 0, 0
+
+    new_sizes = _map(_repack_or_none, [u.path for u in to_compact], workers)
+
+    n_files = saved = 0
+    for usage, new_size in zip(to_compact, new_sizes):
+        if new_size is not None:
+            n_files += 1
+            saved += usage.file_size - new_size
+    log.info("Compacted %d files, saving %.1f MB", n_files, saved / 1e6)
+    return n_files, saved
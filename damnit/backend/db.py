@@ -33,6 +33,27 @@ CREATE VIEW IF NOT EXISTS max_diffs AS SELECT proposal, run FROM run_info;
 CREATE TABLE IF NOT EXISTS metameta(key PRIMARY KEY NOT NULL, value);
 CREATE TABLE IF NOT EXISTS variables(name TEXT PRIMARY KEY NOT NULL, type TEXT, title TEXT, description TEXT, attributes TEXT);
 CREATE TABLE IF NOT EXISTS time_comments(timestamp, comment);
+
+-- Extraction jobs submitted to Slurm, so we can avoid launching duplicates
+CREATE TABLE IF NOT EXISTS jobs(job_id, cluster, proposal, run, run_data, cluster_job, match, variables, status, submitted_at, started_at, finished_at, exit_code, runtime, peak_mem);
+CREATE INDEX IF NOT EXISTS jobs_run ON jobs (proposal, run);
+
+-- Which variables have data saved in extracted_data/ for each run, and their type
+CREATE TABLE IF NOT EXISTS run_manifest(proposal, run, name, type_hint);
+CREATE UNIQUE INDEX IF NOT EXISTS manifest_variable ON run_manifest (proposal, run, name);
+
+-- How long each variable took to compute for each run, and memory & output size
+CREATE TABLE IF NOT EXISTS variable_timings(proposal, run, name, wall_time, cpu_time, peak_rss_delta, output_size, timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS variable_timing ON variable_timings (proposal, run, name);
+
+-- The latest change to each variable for each run, numbered by seq, so clients
+-- can find what changed since they loaded data (see DamnitDB.changes_since).
+-- A deleted variable has one row with proposal & run NULL.
+CREATE TABLE IF NOT EXISTS change_log(seq INTEGER PRIMARY KEY AUTOINCREMENT, proposal, run, name, timestamp);
+CREATE UNIQUE INDEX IF NOT EXISTS change_log_variable ON change_log (proposal, run, name);
+
+-- Messages for GUIs, when the 'local' update transport is used (see updates.py)
+CREATE TABLE IF NOT EXISTS update_messages(seq INTEGER PRIMARY KEY AUTOINCREMENT, timestamp, data);
 """
 
 
@@ -44,6 +65,13 @@ class SummaryType(Enum):
     timestamp = "timestamp"
 
 
+class JobStatus(Enum):
+    pending = "pending"
+    running = "running"
+    finished = "finished"
+    failed = "failed"
+
+
 @dataclass
 class ReducedData:
     """
@@ -53,6 +81,10 @@ class ReducedData:
     max_diff: float = None
     summary_method: str = ''
     attributes: Optional[dict] = None
+    # Resources used to compute the variable, see extract_data.TIMING_ATTRS
+    timing: Optional[dict] = None
+    # The type of the full data in the HDF5 file (a DataType value), if known
+    type_hint: Optional[str] = None
 
 
 class BlobTypes(Enum):
@@ -288,8 +320,43 @@ class DamnitDB:
             """)
 
     def set_variable(self, proposal: int, run: int, name: str, reduced):
+        self.set_variables([(proposal, run, name, reduced)])
+
+    def set_variables(self, items):
+        """Set many variables in one transaction
+
+        *items* is an iterable of (proposal, run, name, reduced) tuples.
+        """
         timestamp = datetime.now(tz=timezone.utc).timestamp()
+        rows = [self._variable_row(proposal, run, name, reduced, timestamp)
+                for (proposal, run, name, reduced) in items]
+        if not rows:
+            return
 
+        # These columns should match those in the run_variables table
+        cols = ["proposal", "run", "name", "version", "value", "timestamp", "max_diff", "provenance", "summary_method", "attributes"]
+        col_list = ", ".join(cols)
+        col_values = ", ".join([f":{col}" for col in cols])
+        col_updates = ", ".join([f"{col} = :{col}" for col in cols])
+
+        with self.conn:
+            existing_variables = set(self.variable_names())
+
+            self.conn.executemany(f"""
+                INSERT INTO run_variables ({col_list})
+                VALUES ({col_values})
+                ON CONFLICT (proposal, run, name, version) DO UPDATE SET {col_updates}
+            """, rows)
+            self.conn.executemany("""
+                INSERT OR REPLACE INTO change_log (proposal, run, name, timestamp)
+                VALUES (:proposal, :run, :name, :timestamp)
+            """, rows)
+
+            if {row["name"] for row in rows} - existing_variables:
+                self.update_views()
+
+    @staticmethod
+    def _variable_row(proposal, run, name, reduced, timestamp):
         variable = asdict(reduced)
 
         # If the value is None that implies that the variable should be
@@ -314,25 +381,52 @@ class DamnitDB:
         #     WHERE proposal=? AND run=? AND name=?
         # """, (proposal, run, name)).fetchone()[0]
         variable["version"] = 1 # if latest_version is None else latest_version + 1
+        return variable
 
-        # These columns should match those in the run_variables table
-        cols = ["proposal", "run", "name", "version", "value", "timestamp", "max_diff", "provenance", "summary_method", "attributes"]
-        col_list = ", ".join(cols)
-        col_values = ", ".join([f":{col}" for col in cols])
-        col_updates = ", ".join([f"{col} = :{col}" for col in cols])
+    def add_to_manifest(self, proposal: int, run: int, type_hints: dict):
+        """Record variables saved in the HDF5 file for a run
 
+        *type_hints* maps variable names to DataType values or None.
+        """
         with self.conn:
-            existing_variables = self.variable_names()
-            is_new = name not in existing_variables
-
-            self.conn.execute(f"""
-                INSERT INTO run_variables ({col_list})
-                VALUES ({col_values})
-                ON CONFLICT (proposal, run, name, version) DO UPDATE SET {col_updates}
-            """, variable)
+            self.conn.executemany("""
+                INSERT INTO run_manifest VALUES (?, ?, ?, ?)
+                ON CONFLICT (proposal, run, name) DO UPDATE SET type_hint=excluded.type_hint
+            """, [(proposal, run, name, hint) for name, hint in type_hints.items()])
+
+    def run_manifest(self, proposal: int, run: int):
+        """Get a dict of variables saved in the HDF5 file for a run to their types"""
+        return dict(self.conn.execute(
+            "SELECT name, type_hint FROM run_manifest WHERE proposal=? AND run=?",
+            (proposal, run)
+        ).fetchall())
+
+    def set_variable_timings(self, proposal: int, run: int, timings: dict):
+        """Record the resources used computing variables for one run
+
+        *timings* maps variable names to dicts with wall_time, cpu_time
+        (seconds), peak_rss_delta (peak RSS while computing the variable, minus
+        the RSS before it started) and output_size (bytes).
+        """
+        timestamp = datetime.now(tz=timezone.utc).timestamp()
+        rows = []
+        for name, t in timings.items():
+            output_size = t.get('output_size')
+            if output_size is not None and output_size < 0:
+                output_size = None  # Size not known, e.g. for figures
+            rows.append((proposal, run, name, t.get('wall_time'), t.get('cpu_time'),
+                         t.get('peak_rss_delta'), output_size, timestamp))
 
-            if is_new:
-                self.update_views()
+        with self.conn:
+            self.conn.executemany("""
+                INSERT INTO variable_timings VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (proposal, run, name) DO UPDATE SET
+                    wall_time=excluded.wall_time,
+                    cpu_time=excluded.cpu_time,
+                    peak_rss_delta=excluded.peak_rss_delta,
+                    output_size=excluded.output_size,
+                    timestamp=excluded.timestamp
+            """, rows)
 
     def delete_variable(self, name: str):
         with self.conn:
@@ -348,8 +442,124 @@ class DamnitDB:
             WHERE name = ?
             """, (name, ))
 
+            self.conn.execute("DELETE FROM run_manifest WHERE name = ?", (name,))
+
+            self.conn.execute("DELETE FROM change_log WHERE name = ?", (name,))
+            self._log_change(None, None, name, datetime.now(tz=timezone.utc).timestamp())
+
             self.update_views()
 
+    def _log_change(self, proposal, run, name, timestamp):
+        # Replacing the previous change for this variable gives it a new seq
+        self.conn.execute("""
+            INSERT OR REPLACE INTO change_log (proposal, run, name, timestamp)
+            VALUES (?, ?, ?, ?)
+        """, (proposal, run, name, timestamp))
+
+    def changes_since(self, seq: int):
+        """Get changes to run variables after change number *seq*
+
+        Returns rows with seq, proposal, run, name & timestamp, oldest first.
+        Only the latest change to each variable in each run is kept. A deleted
+        variable has one row with proposal & run set to None. Pass 0 to get
+        all changes, or last_change_seq() to get changes from now on.
+        """
+        return self.conn.execute("""
+            SELECT seq, proposal, run, name, timestamp FROM change_log
+            WHERE seq > ? ORDER BY seq
+        """, (seq,)).fetchall()
+
+    def last_change_seq(self) -> int:
+        """The number of the latest change, or 0 if there are none"""
+        return self.conn.execute(
+            "SELECT coalesce(max(seq), 0) FROM change_log"
+        ).fetchone()[0]
+
+    def add_job(self, job_id: str, cluster: str, proposal: int, run: int,
+                run_data: str, cluster_job=False, match=(), variables=()):
+        """Record a newly submitted extraction job"""
+        submitted_at = datetime.now(tz=timezone.utc).timestamp()
+        with self.conn:
+            self.conn.execute("""
+                INSERT INTO jobs (job_id, cluster, proposal, run, run_data,
+                                  cluster_job, match, variables, status, submitted_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (job_id, cluster, proposal, run, run_data, int(cluster_job),
+                  json.dumps(list(match)), json.dumps(list(variables)),
+                  JobStatus.pending.value, submitted_at))
+
+    def _update_job(self, job_id: str, cluster: Optional[str], sql_updates: str, **values):
+        # The cluster name isn't always known inside the job
+        where = "job_id=:job_id" + ("" if cluster is None else " AND cluster=:cluster")
+        with self.conn:
+            self.conn.execute(
+                f"UPDATE jobs SET {sql_updates} WHERE {where}",
+                values | {'job_id': job_id, 'cluster': cluster}
+            )
+
+    def job_started(self, job_id: str, cluster: Optional[str]):
+        """Called from inside a job when it starts running"""
+        self._update_job(
+            job_id, cluster, "status=:status, started_at=:started_at",
+            status=JobStatus.running.value,
+            started_at=datetime.now(tz=timezone.utc).timestamp(),
+        )
+
+    def job_finished(self, job_id: str, cluster: Optional[str], exit_code: int,
+                     peak_mem: Optional[int] = None):
+        """Called from inside a job when it's done, successfully or not
+
+        The runtime is counted from when the job started, or from when it was
+        submitted if it failed before recording its start.
+        """
+        status = JobStatus.finished if exit_code == 0 else JobStatus.failed
+        self._update_job(
+            job_id, cluster,
+            "status=:status, finished_at=:finished_at, exit_code=:exit_code, "
+            "runtime=:finished_at - coalesce(started_at, submitted_at), "
+            "peak_mem=:peak_mem",
+            status=status.value, exit_code=exit_code, peak_mem=peak_mem,
+            finished_at=datetime.now(tz=timezone.utc).timestamp(),
+        )
+
+    def latest_jobs(self):
+        """Get the most recently submitted job for each run"""
+        return self.conn.execute("""
+            SELECT * FROM jobs WHERE rowid IN (
+                SELECT max(rowid) FROM jobs GROUP BY proposal, run
+            )
+        """).fetchall()
+
+    def has_pending_job(self, proposal: int, run: int, run_data: str, max_age: float):
+        """Check for a pending job extracting everything for a run
+
+        A job for 'all' run data covers both 'raw' and 'proc'. Running jobs
+        don't count, as they may have opened the run before new data arrived.
+        Jobs submitted more than *max_age* seconds ago are ignored, in case
+        they died without updating their status.
+        """
+        since = datetime.now(tz=timezone.utc).timestamp() - max_age
+        row = self.conn.execute("""
+            SELECT 1 FROM jobs
+            WHERE proposal=? AND run=? AND run_data IN (?, 'all') AND cluster_job=0
+              AND match='[]' AND variables='[]'
+              AND status=? AND submitted_at > ?
+        """, (proposal, run, run_data, JobStatus.pending.value, since)).fetchone()
+        return row is not None
+
+    def runs_with_active_jobs(self, max_age: float):
+        """Get (proposal, run) for runs with any pending or running jobs
+
+        Jobs submitted more than *max_age* seconds ago are ignored.
+        """
+        since = datetime.now(tz=timezone.utc).timestamp() - max_age
+        rows = self.conn.execute("""
+            SELECT DISTINCT proposal, run FROM jobs
+            WHERE status IN (?, ?) AND submitted_at > ?
+        """, (JobStatus.pending.value, JobStatus.running.value, since))
+        return {(proposal, run) for proposal, run in rows}
+
+
 class MetametaMapping(MutableMapping):
     def __init__(self, conn):
         self.conn = conn
@@ -428,6 +638,7 @@ class MsgKind(Enum):
     variable_set = 'variable_set'
     #variable_deleted = 'variable_deleted'
     run_values_updated = 'run_values_updated'
+    job_updated = 'job_updated'
     #run_deleted = 'run_deleted'
     #standalone_comment_set = 'standalone_comment_set'
     #standalone_comment_deleted = 'standalone_comment_deleted'
@@ -6,42 +6,49 @@ file (see ctxrunner.py).
 """
 import argparse
 import copy
+import json
 import os
 import logging
 import pickle
 import re
+import resource
+import select
 import socket
 import subprocess
 import sys
+import threading
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import h5py
 import numpy as np
 
-from kafka import KafkaProducer
-
 from ..context import ContextFile, RunData
-from ..definitions import UPDATE_BROKERS
 from .db import DamnitDB, ReducedData, BlobTypes, MsgKind, msg_dict
 from .extraction_control import ExtractionRequest, ExtractionSubmitter
+from .updates import open_update_transport
 
 log = logging.getLogger(__name__)
 
 
-def run_in_subprocess(args, **kwargs):
+def ctxrunner_env():
+    """Environment variables to run ctxrunner in another Python"""
     env = os.environ.copy()
     ctxsupport_dir = str(Path(__file__).parents[1] / 'ctxsupport')
     env['PYTHONPATH'] = ctxsupport_dir + (
         os.pathsep + env['PYTHONPATH'] if 'PYTHONPATH' in env else ''
     )
+    return env
 
-    return subprocess.run(args, env=env, **kwargs)
+
+def run_in_subprocess(args, **kwargs):
+    return subprocess.run(args, env=ctxrunner_env(), **kwargs)
 
 
 def extract_in_subprocess(
         proposal, run, out_path, cluster=False, run_data=RunData.ALL, match=(),
-        variables=(), python_exe=None, mock=False
+        variables=(), python_exe=None, mock=False, profile_dir=None,
+        consolidate_dir=None,
 ):
     if not python_exe:
         python_exe = sys.executable
@@ -52,6 +59,10 @@ def extract_in_subprocess(
         args.append('--cluster-job')
     if mock:
         args.append("--mock")
+    if profile_dir is not None:
+        args.extend(['--profile-dir', str(profile_dir)])
+    if consolidate_dir is not None:
+        args.extend(['--consolidate-dir', str(consolidate_dir)])
     if variables:
         for v in variables:
             args.extend(['--var', v])
@@ -104,6 +115,92 @@ def get_context_file(ctx_path: Path, context_python=None):
 
                 return ctx, error_info
 
+class ContextValidator:
+    """Check context files in a long-running process using context_python
+
+    Starting a new process for each check means importing numpy, xarray,
+    extra_data etc. every time, which takes several seconds. This keeps one
+    process running, and sends it the code to check. It's started on the
+    first check, and restarted if it dies.
+
+    The process runs in the database directory *db_dir*, like processing
+    does, so context files can import modules from there. Modules imported by
+    the context file stay loaded, so changes to them aren't seen until the
+    validator is closed.
+    """
+    def __init__(self, context_python, db_dir):
+        self.context_python = context_python
+        self.db_dir = Path(db_dir)
+        self._proc = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __repr__(self):
+        return f"ContextValidator({self.context_python!r}, '{self.db_dir}')"
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+            [self.context_python, "-m", "ctxrunner", "check-server"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            cwd=self.db_dir, env=ctxrunner_env(),
+        )
+
+    def _request(self, code, timeout):
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+
+        self._proc.stdin.write(json.dumps([code, str(self.db_dir)]) + "\n")
+        self._proc.stdin.flush()
+
+        readable, _, _ = select.select([self._proc.stdout], [], [], timeout)
+        if not readable:
+            self._kill()
+            raise TimeoutError(f"Checking the context file took over {timeout} s")
+
+        reply = self._proc.stdout.readline()
+        if not reply:
+            raise EOFError("Context validator process exited")
+        return json.loads(reply)
+
+    def check(self, code, timeout=60):
+        """Evaluate a context file, returning error info or None
+
+        The error info is a tuple from ctxrunner.extract_error_info().
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Context validator is closed")
+            try:
+                error_info = self._request(code, timeout)
+            except (BrokenPipeError, EOFError):
+                if self._closed:
+                    raise
+                # The process died (maybe since the last check); start a new one
+                log.warning("Context validator process died, restarting it")
+                self._kill()
+                error_info = self._request(code, timeout)
+
+        return None if error_info is None else tuple(error_info)
+
+    def _kill(self):
+        if self._proc is not None:
+            # Leaving the with block closes the pipes & waits for the process
+            with self._proc:
+                self._proc.kill()
+            self._proc = None
+
+    def close(self):
+        """Stop the validator process, interrupting any check in progress"""
+        self._closed = True
+        if (proc := self._proc) is not None:
+            proc.kill()
+        with self._lock:
+            self._kill()
+
+
+# Attributes on .reduced datasets recording how a variable was computed
+TIMING_ATTRS = ('wall_time', 'cpu_time', 'peak_rss_delta', 'output_size')
+
 def load_reduced_data(h5_path):
     def get_dset_value(ds):
         # If it's a string, extract the string
@@ -121,7 +218,7 @@ def load_reduced_data(h5_path):
     def get_attrs(ds):
         d = {}
         for name, value in ds.attrs.items():
-            if name in {"max_diff", "summary_method"}:
+            if name in {"max_diff", "summary_method", "_damnit_objtype", *TIMING_ATTRS}:
                 continue  # These are stored separately
 
             if isinstance(value, np.ndarray):
@@ -138,10 +235,35 @@ def load_reduced_data(h5_path):
                 max_diff=dset.attrs.get("max_diff", np.array(None)).item(),
                 summary_method=dset.attrs.get("summary_method", ""),
                 attributes=get_attrs(dset),
+                timing={k: dset.attrs[k].item() for k in TIMING_ATTRS
+                        if k in dset.attrs} or None,
+                type_hint=dset.attrs.get("_damnit_objtype"),
             )
             for name, dset in f['.reduced'].items()
         }
 
+def run_values_msg(proposal, run, reduced_data):
+    """Make a run_values_updated message for the GUI
+
+    This includes what the GUI needs to format the values, so it doesn't have
+    to query the database for every update.
+    """
+    return msg_dict(MsgKind.run_values_updated, {
+        'run': run, 'proposal': proposal,
+        'values': {name: reduced.value for name, reduced in reduced_data.items()},
+        'max_diffs': {name: reduced.max_diff for name, reduced in reduced_data.items()},
+        'attributes': {name: reduced.attributes or {}
+                       for name, reduced in reduced_data.items()},
+    })
+
+def manifest_from_file(h5_path):
+    """Get variable names & type hints from a run's HDF5 file"""
+    with h5py.File(h5_path, 'r') as f:
+        return {
+            name: grp.attrs.get('_damnit_objtype')
+            for name, grp in f.items() if name != '.reduced'
+        }
+
 def add_to_db(reduced_data, db: DamnitDB, proposal, run):
     db.ensure_run(proposal, run)
     log.info("Adding p%d r%d to database, with %d columns",
@@ -172,7 +294,13 @@ def add_to_db(reduced_data, db: DamnitDB, proposal, run):
         if not isinstance(reduced.value, (int, float, str, bytes)):
             raise TypeError(f"Unsupported type for database: {type(reduced.value)}")
 
-        db.set_variable(proposal, run, name, reduced)
+    db.set_variables((proposal, run, name, reduced)
+                     for name, reduced in reduced_data.items())
+
+    timings = {name: reduced.timing for name, reduced in reduced_data.items()
+               if reduced.timing}
+    if timings:
+        db.set_variable_timings(proposal, run, timings)
 
 
 class Extractor:
@@ -180,10 +308,7 @@ class Extractor:
 
     def __init__(self):
         self.db = DamnitDB()
-        self.kafka_prd = KafkaProducer(
-            bootstrap_servers=UPDATE_BROKERS,
-            value_serializer=lambda d: pickle.dumps(d),
-        )
+        self.updates = open_update_transport(self.db)
         context_python = self.db.metameta.get("context_python")
         self.ctx_whole, error_info = get_context_file(Path('context.py'), context_python=context_python)
         assert error_info is None, error_info
@@ -192,13 +317,14 @@ class Extractor:
         updates = self.db.update_computed_variables(self.ctx_whole.vars_to_dict())
 
         for name, var in updates.items():
-            self.kafka_prd.send(self.db.kafka_topic, msg_dict(
+            self.updates.send(msg_dict(
                 MsgKind.variable_set, {'name': name} | var
             ))
-        self.kafka_prd.flush()
+        self.updates.flush()
 
     def extract_and_ingest(self, proposal, run, cluster=False,
-                           run_data=RunData.ALL, match=(), variables=(), mock=False):
+                           run_data=RunData.ALL, match=(), variables=(), mock=False,
+                           profile=False):
         if proposal is None:
             proposal = self.db.metameta['proposal']
 
@@ -208,28 +334,38 @@ class Extractor:
             os.chmod(out_path.parent, 0o777)
 
         python_exe = self.db.metameta.get('context_python', '')
+        profile_dir = Path('profiles', f'p{proposal}_r{run}') if profile else None
+        consolidate_dir = None
+        if self.db.metameta.get('consolidate_arrays', False):
+            consolidate_dir = out_path.parent / 'by_variable'
         reduced_data = extract_in_subprocess(
             proposal, run, out_path, cluster=cluster, run_data=run_data,
             match=match, variables=variables, python_exe=python_exe, mock=mock,
+            profile_dir=profile_dir, consolidate_dir=consolidate_dir,
         )
         log.info("Reduced data has %d fields", len(reduced_data))
+        if out_path.is_file():
+            # List everything in the file, not only the variables just
+            # computed, so the manifest is complete after processing a subset.
+            self.db.add_to_manifest(proposal, run, manifest_from_file(out_path))
         add_to_db(reduced_data, self.db, proposal, run)
 
         # Send all the updates for scalars
         image_values = { name: reduced for name, reduced in reduced_data.items()
                          if isinstance(reduced.value, bytes) }
-        update_msg = msg_dict(MsgKind.run_values_updated, {
-            'run': run, 'proposal': proposal, 'values': { name: reduced.value for name, reduced in reduced_data.items()
-                                                          if name not in image_values }})
-        self.kafka_prd.send(self.db.kafka_topic, update_msg).get(timeout=30)
+        update_msg = run_values_msg(proposal, run, {
+            name: reduced for name, reduced in reduced_data.items()
+            if name not in image_values
+        })
+        self.updates.send(update_msg)
 
         # And each image update separately so we don't hit any size limits
         for name, reduced in image_values.items():
-            update_msg = msg_dict(MsgKind.run_values_updated, {
-                'run': run, 'proposal': proposal, 'values': { name: reduced.value }})
-            self.kafka_prd.send(self.db.kafka_topic, update_msg).get(timeout=30)
+            update_msg = run_values_msg(proposal, run, {name: reduced})
+            self.updates.send(update_msg)
 
-        log.info("Sent Kafka updates to topic %r", self.db.kafka_topic)
+        self.updates.flush()
+        log.info("Sent updates via %r", self.updates)
 
         # Launch a Slurm job if there are any 'cluster' variables to evaluate
         if not cluster:
@@ -240,7 +376,7 @@ class Extractor:
             if set(ctx_slurm.vars) > set(ctx_no_slurm.vars):
                 submitter = ExtractionSubmitter(Path.cwd(), self.db)
                 cluster_req = ExtractionRequest(
-                    run, proposal, mock=mock,
+                    run, proposal, mock=mock, profile=profile,
                     run_data=run_data, cluster=True, match=match, variables=variables
                 )
                 submitter.submit(cluster_req)
@@ -259,6 +395,7 @@ def main(argv=None):
     ap.add_argument('--var',  action="append", default=[])
     ap.add_argument('--mock', action='store_true')
     ap.add_argument('--update-vars', action='store_true')
+    ap.add_argument('--profile', action='store_true')
     args = ap.parse_args(argv)
     logging.basicConfig(level=logging.INFO,
                         format="%(asctime)s %(levelname)s %(name)s: %(message)s")
@@ -273,16 +410,67 @@ def main(argv=None):
         log.info("Extracting cluster variables in Slurm job %s on %s",
                  os.environ.get('SLURM_JOB_ID', '?'), socket.gethostname())
 
-    extr = Extractor()
-    if args.update_vars:
-        extr.update_db_vars()
-
-    extr.extract_and_ingest(args.proposal, args.run,
-                            cluster=args.cluster_job,
-                            run_data=RunData(args.run_data),
-                            match=args.match,
-                            variables=args.var,
-                            mock=args.mock)
+    # Record the progress of this job in the database, so the listener & GUI
+    # can see it without asking Slurm.
+    job_id = os.environ.get('SLURM_JOB_ID')
+    job_cluster = os.environ.get('SLURM_CLUSTER_NAME')
+    if job_id is not None:
+        DamnitDB().job_started(job_id, job_cluster)
+        send_job_updated(job_id, args.proposal, args.run)
+
+    exit_code = 1
+    try:
+        extr = Extractor()
+        if args.update_vars:
+            extr.update_db_vars()
+
+        extr.extract_and_ingest(args.proposal, args.run,
+                                cluster=args.cluster_job,
+                                run_data=RunData(args.run_data),
+                                match=args.match,
+                                variables=args.var,
+                                mock=args.mock,
+                                profile=args.profile)
+        exit_code = 0
+    except subprocess.CalledProcessError as e:
+        exit_code = e.returncode
+        raise
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+        raise
+    finally:
+        if job_id is not None:
+            DamnitDB().job_finished(job_id, job_cluster, exit_code, peak_memory())
+            send_job_updated(job_id, args.proposal, args.run)
+
+
+def send_job_updated(job_id, proposal, run):
+    """Tell GUIs to check the status of a job in the database
+
+    The job is still recorded if this fails, so errors are only logged.
+    """
+    try:
+        db = DamnitDB()
+        updates = open_update_transport(db)
+        try:
+            updates.send(msg_dict(MsgKind.job_updated, {
+                'job_id': job_id,
+                'proposal': proposal if proposal is not None else db.metameta['proposal'],
+                'run': run,
+            }))
+            updates.flush()
+        finally:
+            updates.close()
+    except Exception:
+        log.warning("Could not send update for job %s", job_id, exc_info=True)
+
+
+def peak_memory():
+    """Peak resident memory (bytes) of this process or any of its children"""
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    ) * 1024  # ru_maxrss is in kB on Linux
 
 
 if __name__ == '__main__':
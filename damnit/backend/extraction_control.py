@@ -86,6 +86,7 @@ class ExtractionRequest:
     variables: tuple = ()   # Overrides match if present
     mock: bool = False
     update_vars: bool = True
+    profile: bool = False
 
     def python_cmd(self):
         """Creates the command for a process to do this extraction"""
@@ -105,6 +106,8 @@ class ExtractionRequest:
             cmd.append('--mock')
         if self.update_vars:
             cmd.append('--update-vars')
+        if self.profile:
+            cmd.append('--profile')
         return cmd
 
 
@@ -135,6 +138,9 @@ class ExtractionSubmitter:
         job_id = job_id.strip()
         cluster = cluster.strip() or 'maxwell'
         log.info("Launched Slurm (%s) job %s to run context file", cluster, job_id)
+        self.db.add_job(job_id, cluster, req.proposal, req.run, req.run_data.value,
+                        cluster_job=req.cluster, match=req.match,
+                        variables=req.variables)
         return job_id, cluster
 
     def sbatch_cmd(self, req: ExtractionRequest):
@@ -216,7 +222,8 @@ class ExtractionSubmitter:
         return opts
 
 
-def reprocess(runs, proposal=None, match=(), mock=False, watch=False, direct=False):
+def reprocess(runs, proposal=None, match=(), mock=False, watch=False, direct=False,
+              profile=False):
     """Called by the 'amore-proto reprocess' subcommand"""
     submitter = ExtractionSubmitter(Path.cwd())
     if proposal is None:
@@ -266,7 +273,8 @@ def reprocess(runs, proposal=None, match=(), mock=False, watch=False, direct=Fal
         props_runs = [(proposal, r) for r in sorted(runs & available_runs)]
 
     reqs = [
-        ExtractionRequest(run, prop, RunData.ALL, match=match, mock=mock)
+        ExtractionRequest(run, prop, RunData.ALL, match=match, mock=mock,
+                          profile=profile)
         for prop, run in props_runs
     ]
     # To reduce DB write contention, only update the computed variables in the
@@ -275,7 +283,8 @@ def reprocess(runs, proposal=None, match=(), mock=False, watch=False, direct=Fal
         req.update_vars = False
 
     for prop, run in props_runs:
-        req = ExtractionRequest(run, prop, RunData.ALL, match=match, mock=mock)
+        req = ExtractionRequest(run, prop, RunData.ALL, match=match, mock=mock,
+                                profile=profile)
         if direct:
             submitter.execute_direct(req)
         elif watch:
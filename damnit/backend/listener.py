@@ -3,6 +3,7 @@ import json
 import logging
 import os
 import platform
+import time
 from pathlib import Path
 from socket import gethostname
 
@@ -32,6 +33,14 @@ log = logging.getLogger(__name__)
 
 
 class EventProcessor:
+    # Events for the same run arriving within this many seconds are merged
+    # into a single extraction job.
+    coalesce_window = 10
+    # Minimum number of seconds between submitting jobs
+    submit_interval = 1
+    # Don't trust a pending/running job record older than this (seconds), in
+    # case the job died without updating it.
+    job_max_age = 6 * 3600
 
     def __init__(self, context_dir=Path('.')):
         self.context_dir = context_dir
@@ -52,10 +61,13 @@ class EventProcessor:
         self.kafka_cns = KafkaConsumer(*kafka_conf['topics'],
                                        bootstrap_servers=kafka_conf['brokers'],
                                        group_id=consumer_id,
-                                       consumer_timeout_ms=600_000,
                                        )
         self.events = kafka_conf['events']
 
+        # (proposal, run) -> (RunData, time of first event)
+        self.pending = {}
+        self._last_submit = 0.
+
 
     def __enter__(self):
         return self
@@ -66,17 +78,24 @@ class EventProcessor:
         return False
 
     def run(self):
+        last_event = time.monotonic()
         while True:
-            for record in self.kafka_cns:
+            records = self.kafka_cns.poll(timeout_ms=1000)
+            for record in (r for part in records.values() for r in part):
+                last_event = time.monotonic()
                 try:
                     self._process_kafka_event(record)
                 except Exception:
                     log.error("Unepected error handling Kafka event.", exc_info=True)
 
+            self.submit_pending()
+
             # After 10 minutes with no messages, check if the listener should stop
-            if self.db.metameta.get('no_listener', 0):
-                log.info("Found no_listener flag in database, shutting down.")
-                return
+            if (time.monotonic() - last_event) > 600 and not self.pending:
+                last_event = time.monotonic()
+                if self.db.metameta.get('no_listener', 0):
+                    log.info("Found no_listener flag in database, shutting down.")
+                    return
 
     def _process_kafka_event(self, record):
         msg = json.loads(record.value.decode())
@@ -109,8 +128,44 @@ class EventProcessor:
         self.db.ensure_run(proposal, run, record.timestamp / 1000)
         log.info(f"Added p%d r%d ({run_data.value} data) to database", proposal, run)
 
-        req = ExtractionRequest(run, proposal, run_data)
-        self.submitter.submit(req)
+        key = (proposal, run)
+        if key in self.pending:
+            prev_data, first_seen = self.pending[key]
+            if prev_data != run_data:
+                # e.g. raw & proc events close together: process both at once
+                run_data = RunData.ALL
+            self.pending[key] = (run_data, first_seen)
+        else:
+            self.pending[key] = (run_data, time.monotonic())
+
+    def submit_pending(self, force=False):
+        """Submit jobs for runs whose coalescing window has passed
+
+        With force=True, everything pending is submitted right away.
+        """
+        for (proposal, run), (run_data, first_seen) in list(self.pending.items()):
+            now = time.monotonic()
+            if not force:
+                if now - first_seen < self.coalesce_window:
+                    continue
+                if now - self._last_submit < self.submit_interval:
+                    break  # Rate limited, try again on the next loop
+
+            del self.pending[proposal, run]
+            if self.db.has_pending_job(proposal, run, run_data.value, self.job_max_age):
+                log.info("Skipping p%d r%d (%s data), a job for it is already "
+                         "pending", proposal, run, run_data.value)
+                continue
+
+            req = ExtractionRequest(run, proposal, run_data)
+            try:
+                self.submitter.submit(req)
+            except Exception:
+                log.error("Error submitting job for p%d r%d, will retry",
+                          proposal, run, exc_info=True)
+                # Try again after another coalescing window
+                self.pending[proposal, run] = (run_data, now)
+            self._last_submit = now
 
 
 def listen():
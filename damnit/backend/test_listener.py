@@ -49,6 +49,8 @@ class TestEventProcessor(EventProcessor):
                 elif run_data == RunData.ALL:
                     self.handle_migration_complete(record, msg)
                     self.handle_run_corrections_complete(record, msg)
+
+                self.submit_pending(force=True)
             except EOFError:
                 break  # Allow Ctrl-D to close it
             except Exception:
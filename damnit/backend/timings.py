@@ -0,0 +1,86 @@
+"""Summarise the per-variable timings recorded during extraction
+
+This is used by the 'amore-proto profile' subcommand.
+"""
+import numpy as np
+
+from .db import DamnitDB
+
+SORT_KEYS = {
+    'p50': 'p50 (s)',
+    'p95': 'p95 (s)',
+    'max': 'max (s)',
+    'total': 'total (s)',
+    'memory': 'mem (MB)',
+}
+
+
+def timing_stats(db: DamnitDB, proposal=None):
+    """Aggregate the recorded timings for each variable
+
+    Returns a list of dicts, one per variable.
+    """
+    query = """
+        SELECT name, wall_time, cpu_time, peak_rss_delta, output_size
+        FROM variable_timings
+    """
+    params = ()
+    if proposal is not None:
+        query += " WHERE proposal=?"
+        params = (proposal,)
+
+    by_name = {}
+    for name, *values in db.conn.execute(query + " ORDER BY name", params):
+        by_name.setdefault(name, []).append(values)
+
+    stats = []
+    for name, rows in by_name.items():
+        # None -> NaN so we can use the nan* functions for missing values
+        wall, cpu, rss, size = np.array(rows, dtype=np.float64).T
+        stats.append({
+            'variable': name,
+            'runs': len(rows),
+            'p50 (s)': np.nanpercentile(wall, 50),
+            'p95 (s)': np.nanpercentile(wall, 95),
+            'max (s)': np.nanmax(wall),
+            'total (s)': np.nansum(wall),
+            'cpu/wall': np.nansum(cpu) / max(np.nansum(wall), 1e-9),
+            'mem (MB)': np.nanmax(rss) / 1e6 if not np.isnan(rss).all() else np.nan,
+            'output (MB)': np.nanmean(size) / 1e6 if not np.isnan(size).all() else np.nan,
+        })
+    return stats
+
+
+def print_profile_report(db: DamnitDB, sort='p95', limit=20, proposal=None):
+    stats = timing_stats(db, proposal)
+    if not stats:
+        print("No variable timings recorded yet. They are saved when runs are processed.")
+        return
+
+    stats.sort(key=lambda s: np.nan_to_num(s[SORT_KEYS[sort]], nan=-1), reverse=True)
+    n_total = len(stats)
+    if limit:
+        stats = stats[:limit]
+
+    columns = list(stats[0])
+    cells = [[_fmt(s[c]) for c in columns] for s in stats]
+    widths = [max(len(c), *(len(row[i]) for row in cells))
+              for i, c in enumerate(columns)]
+
+    print(f"Slowest variables by {SORT_KEYS[sort]}, "
+          f"showing {len(stats)} of {n_total}:\n")
+    print("  ".join(c.ljust(w) if i == 0 else c.rjust(w)
+                    for i, (c, w) in enumerate(zip(columns, widths))))
+    for row in cells:
+        print("  ".join(v.ljust(w) if i == 0 else v.rjust(w)
+                        for i, (v, w) in enumerate(zip(row, widths))))
+
+
+def _fmt(value):
+    if isinstance(value, str):
+        return value
+    elif isinstance(value, int):
+        return str(value)
+    elif np.isnan(value):
+        return "-"
+    return f"{value:.3g}" if abs(value) < 1000 else f"{value:.0f}"
@@ -0,0 +1,224 @@
+"""Ways of sending update messages to GUIs
+
+Processes which change the database send messages (see db.msg_dict) so GUIs
+showing it can update without reloading. The transport is chosen per database
+by the 'update_transport' config key:
+
+- 'kafka' (the default) sends them via the Kafka brokers in UPDATE_BROKERS.
+- 'local' stores them in a table in the database itself, which GUIs check for
+  new messages. This needs no broker.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+from kafka import KafkaConsumer, KafkaProducer
+
+from ..definitions import UPDATE_BROKERS
+from . import wire_format
+
+log = logging.getLogger(__name__)
+
+TRANSPORTS = ('kafka', 'local')
+
+
+class UpdateTransport:
+    """Base class for sending & receiving update messages
+
+    To receive messages, call subscribe() and then poll(). close() can be
+    called from another thread while poll() is waiting, and makes it return
+    soon (within a couple of seconds for Kafka).
+    """
+    def send(self, msg: dict):
+        raise NotImplementedError
+
+    def flush(self, timeout=30):
+        """Wait until the messages sent so far are delivered"""
+        pass
+
+    def subscribe(self):
+        """Start receiving messages sent after this call"""
+        raise NotImplementedError
+
+    def poll(self, timeout: float) -> list:
+        """Wait up to timeout seconds for messages, and return them in order
+
+        Returns an empty list on timeout, or if the transport is closed.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def open_update_transport(db) -> UpdateTransport:
+    """Make the update transport configured for a DamnitDB"""
+    kind = db.metameta.get('update_transport', 'kafka')
+    if kind == 'kafka':
+        return KafkaTransport(db.kafka_topic)
+    elif kind == 'local':
+        return LocalTransport(db.path)
+    raise ValueError(f"Unknown update_transport {kind!r} (expected one of {TRANSPORTS})")
+
+
+# How long the broker holds a fetch request open waiting for new messages. It
+# replies as soon as there are any, so this only limits how often an idle
+# consumer wakes up.
+FETCH_WAIT_MS = 5000
+# poll() waits on the consumer in slices this long, checking in between
+# whether close() has been called. kafka-python has no public way to interrupt
+# a poll from another thread, so this is a trade-off: an idle GUI wakes up this
+# often (without network traffic), and closing it waits up to this long for
+# the listening thread to finish.
+POLL_SLICE_MS = 2000
+
+
+class KafkaTransport(UpdateTransport):
+    def __init__(self, topic, brokers=UPDATE_BROKERS):
+        self.topic = topic
+        self.brokers = brokers
+        self.producer = KafkaProducer(
+            bootstrap_servers=brokers, value_serializer=wire_format.encode
+        )
+        self.consumer = None
+        self._closing = threading.Event()
+        # KafkaConsumer isn't thread-safe, so only one thread uses it at a time
+        self._consumer_lock = threading.Lock()
+        self._send_error = None
+
+    def __repr__(self):
+        return f"KafkaTransport({self.topic!r})"
+
+    def send(self, msg):
+        # The producer sends messages in the background
+        self.producer.send(self.topic, msg).add_errback(self._send_failed)
+
+    def _send_failed(self, exc):
+        log.error("Error sending update message: %s", exc)
+        self._send_error = exc
+
+    def flush(self, timeout=30):
+        self.producer.flush(timeout=timeout)
+        if self._send_error is not None:
+            exc, self._send_error = self._send_error, None
+            raise exc
+
+    def subscribe(self):
+        self.consumer = KafkaConsumer(
+            self.topic, bootstrap_servers=self.brokers,
+            fetch_max_wait_ms=FETCH_WAIT_MS,
+        )
+
+    def poll(self, timeout):
+        deadline = time.monotonic() + timeout
+        topic_messages = {}
+        with self._consumer_lock:
+            while not self._closing.is_set():
+                remaining_ms = (deadline - time.monotonic()) * 1000
+                topic_messages = self.consumer.poll(
+                    timeout_ms=max(min(remaining_ms, POLL_SLICE_MS), 0)
+                )
+                if topic_messages or remaining_ms <= POLL_SLICE_MS:
+                    break
+
+            if self._closing.is_set():
+                # close() was called while polling, and left the consumer to
+                # be closed in this thread.
+                self._close_consumer()
+
+        records = [r for part in topic_messages.values() for r in part]
+        return wire_format.decode_batch([r.value for r in records])
+
+    def _close_consumer(self):
+        if self.consumer is not None:
+            self.consumer.close()
+            self.consumer = None
+
+    def close(self):
+        self._closing.set()
+        # If poll() is running in another thread, don't wait for it: it closes
+        # the consumer when its current slice ends.
+        if self._consumer_lock.acquire(blocking=False):
+            try:
+                self._close_consumer()
+            finally:
+                self._consumer_lock.release()
+        self.producer.close(timeout=10)
+
+
+class LocalTransport(UpdateTransport):
+    """Send messages through the update_messages table in the database
+
+    Receivers check for new messages every check_interval seconds. The check
+    is cheap unless another connection has written to the database since the
+    last one.
+    """
+    check_interval = 0.25
+    # Messages older than this (seconds) are deleted when sending new ones
+    max_age = 600
+
+    def __init__(self, db_path):
+        # The GUI sends messages from a different thread to the one receiving
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._last_seq = None
+        self._data_version = None
+
+    def __repr__(self):
+        return f"LocalTransport('{self.db_path}')"
+
+    def send(self, msg):
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM update_messages WHERE timestamp < ?", (now - self.max_age,)
+            )
+            self.conn.execute(
+                "INSERT INTO update_messages (timestamp, data) VALUES (?, ?)",
+                (now, wire_format.encode(msg))
+            )
+            # data_version doesn't change for our own writes, so make sure the
+            # next poll() looks for messages.
+            self._data_version = None
+
+    def subscribe(self):
+        with self._lock:
+            self._last_seq = self.conn.execute(
+                "SELECT coalesce(max(seq), 0) FROM update_messages"
+            ).fetchone()[0]
+
+    def poll(self, timeout):
+        deadline = time.monotonic() + timeout
+        while not self._closed.is_set():
+            with self._lock:
+                if self._closed.is_set():
+                    break
+                rows = self._new_messages()
+            if rows:
+                self._last_seq = rows[-1][0]
+                return wire_format.decode_batch([data for (_, data) in rows])
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._closed.wait(min(self.check_interval, remaining))
+        return []
+
+    def _new_messages(self):
+        # data_version changes when another connection modifies the database
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return []
+        self._data_version = data_version
+        return self.conn.execute(
+            "SELECT seq, data FROM update_messages WHERE seq > ? ORDER BY seq",
+            (self._last_seq,)
+        ).fetchall()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self.conn.close()
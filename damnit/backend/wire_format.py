@@ -0,0 +1,117 @@
+"""Binary encoding for the update messages sent to GUIs
+
+Messages are dicts as made by ``msg_dict()``, encoded with msgpack after a
+short header with a version number. NumPy arrays & scalars and complex numbers
+are encoded as msgpack extension types, so they come back with the same types.
+Unlike pickle, decoding a message can't run arbitrary code, and the sender &
+receiver don't need the same classes available.
+"""
+import logging
+import struct
+from enum import IntEnum
+from functools import lru_cache
+
+import msgpack
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"DAMNIT"
+FORMAT_VERSION = 1
+HEADER = MAGIC + bytes([FORMAT_VERSION])
+
+
+class ExtType(IntEnum):
+    # uint8 length + dtype string, uint8 ndim + int64 dims, raw data.
+    # NumPy scalars have ndim 0.
+    ndarray = 1
+    complex = 2  # real & imaginary parts as little-endian doubles
+
+
+def _encode_default(obj):
+    if isinstance(obj, (np.ndarray, np.generic)):
+        arr = np.asarray(obj)
+        if arr.dtype.hasobject:
+            raise TypeError("Can't encode NumPy arrays with object dtype")
+        dtype = arr.dtype.str.encode()
+        payload = b"".join([
+            bytes([len(dtype)]), dtype,
+            struct.pack(f"<B{arr.ndim}q", arr.ndim, *arr.shape),
+            np.ascontiguousarray(arr).tobytes(),
+        ])
+        return msgpack.ExtType(ExtType.ndarray, payload)
+    elif isinstance(obj, complex):
+        return msgpack.ExtType(ExtType.complex, struct.pack("<dd", obj.real, obj.imag))
+    # strict_types means subclasses of these come here
+    elif isinstance(obj, tuple):
+        return list(obj)
+    elif isinstance(obj, str):
+        return str(obj)
+    elif isinstance(obj, bool):
+        return bool(obj)
+    elif isinstance(obj, int):
+        return int(obj)
+    elif isinstance(obj, float):
+        return float(obj)
+    elif isinstance(obj, dict):
+        return dict(obj)
+    raise TypeError(f"Can't encode object of type {type(obj).__name__}")
+
+
+@lru_cache(maxsize=64)
+def _parse_dtype(dtype_str: bytes):
+    dtype = np.dtype(dtype_str.decode())
+    if dtype.hasobject:
+        raise ValueError("NumPy arrays with object dtype are not allowed")
+    return dtype
+
+
+def _decode_ext(code, data):
+    if code == ExtType.ndarray:
+        end = 1 + data[0]
+        dtype = _parse_dtype(data[1:end])
+        ndim = data[end]
+        shape = struct.unpack_from(f"<{ndim}q", data, end + 1)
+        arr = np.frombuffer(data, dtype=dtype, offset=end + 1 + 8 * ndim)
+        if ndim == 0:
+            return arr[0]  # A NumPy scalar (a copy)
+        return arr.reshape(shape).copy()
+    elif code == ExtType.complex:
+        return complex(*struct.unpack("<dd", data))
+    return msgpack.ExtType(code, data)
+
+
+def encode(msg) -> bytes:
+    """Encode a message to send"""
+    # strict_types stops NumPy scalars being packed as plain floats
+    return HEADER + msgpack.packb(
+        msg, default=_encode_default, use_bin_type=True, strict_types=True
+    )
+
+
+def decode(data: bytes):
+    """Decode a received message
+
+    Raises ValueError if the data is not in this format, or from a newer
+    version of it.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a DAMNIT update message")
+    version = data[len(MAGIC)]
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Message format version {version} is newer than "
+                         f"supported ({FORMAT_VERSION}), please update DAMNIT")
+    return msgpack.unpackb(
+        data[len(HEADER):], ext_hook=_decode_ext, raw=False, strict_map_key=False
+    )
+
+
+def decode_batch(values) -> list:
+    """Decode several received messages, skipping (& logging) invalid ones"""
+    messages = []
+    for data in values:
+        try:
+            messages.append(decode(data))
+        except Exception:
+            log.error("Could not decode update message", exc_info=True)
+    return messages
@@ -108,12 +108,46 @@ def main(argv=None):
         '--direct', action='store_true',
         help="Run processing in subprocesses on this node, instead of via Slurm"
     )
+    reprocess_ap.add_argument(
+        '--profile', action='store_true',
+        help="Save a cProfile dump for each variable in profiles/, e.g. to view with snakeviz"
+    )
     reprocess_ap.add_argument(
         'run', nargs='+',
         help="Run number, e.g. 96. Multiple runs can be specified at once, "
              "or pass 'all' to reprocess all runs in the database."
     )
 
+    profile_ap = subparsers.add_parser(
+        'profile',
+        help="Show which variables are slowest to compute, from timings recorded during processing"
+    )
+    profile_ap.add_argument(
+        '--sort', choices=('p50', 'p95', 'max', 'total', 'memory'), default='p95',
+        help="Statistic to sort variables by (default: p95 wall time)"
+    )
+    profile_ap.add_argument(
+        '-n', '--limit', type=int, default=20,
+        help="Number of variables to show, 0 to show all"
+    )
+
+    compact_ap = subparsers.add_parser(
+        'compact',
+        help="Reclaim unused space in the HDF5 files in extracted_data/"
+    )
+    compact_ap.add_argument(
+        '--min-ratio', type=float, default=0.25,
+        help="Compact files where at least this fraction is unused (default 0.25)"
+    )
+    compact_ap.add_argument(
+        '-j', '--jobs', type=int,
+        help="Number of files to process in parallel (default: number of CPUs)"
+    )
+    compact_ap.add_argument(
+        '--dry-run', action='store_true',
+        help="Only show how many files would be compacted"
+    )
+
     readctx_ap = subparsers.add_parser(
         'read-context',
         help="Re-read the context file and update variables in the database"
@@ -165,6 +199,10 @@ def main(argv=None):
     migrate_ap.add_argument(
         "--dry-run", action="store_true"
     )
+    migrate_ap.add_argument(
+        '-j', '--jobs', type=int,
+        help="Number of HDF5 files to process in parallel (default: number of CPUs)"
+    )
     migrate_subparsers = migrate_ap.add_subparsers(dest="migrate_subcmd")
     migrate_subparsers.add_parser(
         "v0-to-v1",
@@ -225,9 +263,23 @@ def main(argv=None):
 
         from .backend.extraction_control import reprocess
         reprocess(
-            args.run, args.proposal, args.match, args.mock, args.watch, args.direct
+            args.run, args.proposal, args.match, args.mock, args.watch, args.direct,
+            args.profile
         )
 
+    elif args.subcmd == 'profile':
+        from .backend.db import DamnitDB
+        from .backend.timings import print_profile_report
+
+        print_profile_report(DamnitDB(), sort=args.sort, limit=args.limit)
+
+    elif args.subcmd == 'compact':
+        from .backend.compact import compact
+        from .backend.db import DamnitDB
+
+        compact(DamnitDB(), min_ratio=args.min_ratio, workers=args.jobs,
+                dry_run=args.dry_run)
+
     elif args.subcmd == 'read-context':
         from .backend.extract_data import Extractor
         Extractor().update_db_vars()
@@ -287,9 +339,9 @@ def main(argv=None):
         db = DamnitDB(allow_old=True)
 
         if args.migrate_subcmd == "v0-to-v1":
-            migrate_v0_to_v1(db, Path.cwd(), args.dry_run)
+            migrate_v0_to_v1(db, Path.cwd(), args.dry_run, workers=args.jobs)
         elif args.migrate_subcmd == "intermediate-v1":
-            migrate_intermediate_v1(db, Path.cwd(), args.dry_run)
+            migrate_intermediate_v1(db, Path.cwd(), args.dry_run, workers=args.jobs)
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -6,13 +6,16 @@ possibly running in a different Python interpreter. It will run a context file
 """
 
 import argparse
+import cProfile
 import functools
 import inspect
 import io
+import json
 import logging
 import os
 import pickle
 import sys
+import threading
 import time
 import traceback
 from datetime import timezone
@@ -34,6 +37,8 @@ log = logging.getLogger(__name__)
 
 THUMBNAIL_SIZE = 300 # px
 COMPRESSION_OPTS = {'compression': 'gzip', 'compression_opts': 1, 'shuffle': True}
+# Larger arrays aren't copied into the per-variable consolidated files
+CONSOLIDATE_MAX_BYTES = 10 * 1024**2
 
 # More specific Python types beyond what HDF5/NetCDF4 know about, so we can
 # reconstruct Python objects when reading values back in.
@@ -263,12 +268,17 @@ class ContextFile:
 
         return ContextFile(new_vars, self.code)
 
-    def execute(self, run_data, run_number, proposal, input_vars) -> 'Results':
+    def execute(self, run_data, run_number, proposal, input_vars,
+                profile_dir=None) -> 'Results':
         res = {'start_time': Cell(np.asarray(get_start_time(run_data)))}
+        timings = {}
         mymdc = None
+        rss_monitor = PeakRSSMonitor()
 
         for name in self.ordered_vars():
             t0 = time.perf_counter()
+            cpu_t0 = time.process_time()
+            rss0 = rss_monitor.reset()
             var = self.vars[name]
 
             try:
@@ -326,7 +336,14 @@ class ContextFile:
 
                 func = functools.partial(var.func, **kwargs)
 
-                if (data := func(run_data)) is None:
+                if profile_dir is not None:
+                    profiler = cProfile.Profile()
+                    data = profiler.runcall(func, run_data)
+                    profiler.dump_stats(Path(profile_dir, f"{name}.prof"))
+                else:
+                    data = func(run_data)
+
+                if data is None:
                     continue
 
                 if not isinstance(data, Cell):
@@ -340,7 +357,73 @@ class ContextFile:
                 t1 = time.perf_counter()
                 log.info("Computed %s in %.03f s", name, t1 - t0)
                 res[name] = data
-        return Results(res, self)
+                timings[name] = {
+                    'wall_time': t1 - t0,
+                    'cpu_time': time.process_time() - cpu_t0,
+                    'peak_rss_delta': rss_monitor.peak() - rss0 if rss0 else None,
+                    'output_size': data_nbytes(data.data),
+                }
+
+        rss_monitor.stop()
+        return Results(res, self, timings)
+
+
+def current_rss():
+    """Resident memory of this process now, in bytes, or 0 if we can't tell"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0  # Not on Linux
+
+
+class PeakRSSMonitor:
+    """Track the peak resident memory while computing each variable
+
+    The peak RSS the kernel records (ru_maxrss) is for the whole process and
+    never goes down, so it can't tell us about a variable computed after a
+    more memory hungry one. Instead, a thread samples the current RSS every
+    *interval* seconds. Short spikes between samples can be missed.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._peak = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.interval):
+            rss = current_rss()
+            with self._lock:
+                self._peak = max(self._peak, rss)
+
+    def reset(self):
+        """Start a new measurement, returning the current RSS (0 if unknown)"""
+        rss = current_rss()
+        with self._lock:
+            self._peak = rss
+        return rss
+
+    def peak(self):
+        """Peak RSS in bytes since the last reset()"""
+        rss = current_rss()
+        with self._lock:
+            return max(self._peak, rss)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def data_nbytes(data):
+    """Size in memory of a variable's data, or -1 if we can't tell"""
+    if isinstance(data, str):
+        return len(data.encode())
+    elif isinstance(data, (np.ndarray, xr.DataArray, xr.Dataset)):
+        return data.nbytes
+    return -1
 
 
 def get_start_time(xd_run):
@@ -436,6 +519,27 @@ def extract_error_info(exc_type, e, tb):
     return (stacktrace, lineno, offset)
 
 
+def serve_context_checks(requests, replies):
+    """Evaluate context files sent by the GUI, and reply with any errors
+
+    Each request is a line of JSON with the code and the directory to run it
+    in. The reply is the error info (see extract_error_info()) or null. This
+    runs until *requests* is closed, so modules which the context files import
+    are only loaded once.
+    """
+    for line in requests:
+        code, cwd = json.loads(line)
+        error_info = None
+        try:
+            os.chdir(cwd)
+            ContextFile.from_str(code)
+        except:
+            error_info = extract_error_info(*sys.exc_info())
+
+        replies.write(json.dumps(error_info) + "\n")
+        replies.flush()
+
+
 def get_proposal_path(xd_run):
     files = [f.filename for f in xd_run.files]
     p = Path(files[0])
@@ -459,6 +563,19 @@ def add_to_h5_file(path) -> h5py.File:
     raise ex
 
 
+def data_type_hint(obj):
+    """The DataType to record for a variable's data, or None for plain arrays"""
+    if isinstance(obj, xr.DataArray):
+        return DataType.DataArray
+    elif isinstance(obj, xr.Dataset):
+        return DataType.Dataset
+    elif isinstance_no_import(obj, 'matplotlib.figure', 'Figure'):
+        return DataType.Image
+    elif isinstance_no_import(obj, 'plotly.graph_objs', 'Figure'):
+        return DataType.PlotlyFigure
+    return None
+
+
 def _set_encoding(data_array: xr.DataArray) -> xr.DataArray:
     """Add default compression options to DataArray"""
     encoding = COMPRESSION_OPTS.copy()
@@ -468,9 +585,11 @@ def _set_encoding(data_array: xr.DataArray) -> xr.DataArray:
 
 
 class Results:
-    def __init__(self, cells, ctx):
+    def __init__(self, cells, ctx, timings=None):
         self.cells = cells
         self.ctx = ctx
+        # Name -> {wall_time, cpu_time, peak_rss_delta, output_size}
+        self.timings = timings or {}
         self._reduced = None
 
     @property
@@ -523,24 +642,26 @@ class Results:
 
         for name, cell in self.cells.items():
             summary_val = self.summarise(name)
-            dsets.append((f'.reduced/{name}', summary_val, cell.summary_attrs()))
+            attrs = cell.summary_attrs() | self.timings.get(name, {})
+            obj = cell.data
+            if (hint := data_type_hint(obj)) is not None:
+                # Also store the type with the summary, so it can be found
+                # without opening the full data.
+                attrs['_damnit_objtype'] = hint.value
+            dsets.append((f'.reduced/{name}', summary_val, attrs))
             if not reduced_only:
-                obj = cell.data
+                if hint is not None:
+                    obj_type_hints[name] = hint
+
                 if isinstance(obj, (xr.DataArray, xr.Dataset)):
                     xarray_dsets.append((name, obj))
-                    obj_type_hints[name] = (
-                        DataType.DataArray if isinstance(obj, xr.DataArray)
-                        else DataType.Dataset
-                    )
                 else:
-                    if isinstance_no_import(obj, 'matplotlib.figure', 'Figure'):
+                    if hint is DataType.Image:
                         value = figure2array(obj)
-                        obj_type_hints[name] = DataType.Image
-                    elif isinstance_no_import(obj, 'plotly.graph_objs', 'Figure'):
+                    elif hint is DataType.PlotlyFigure:
                         # we want to compresss plotly figures in HDF5 files
                         # so we need to convert the data to array of uint8
                         value = np.frombuffer(obj.to_json().encode('utf-8'), dtype=np.uint8)
-                        obj_type_hints[name] = DataType.PlotlyFigure
                     elif isinstance(obj, str):
                         value = obj
                     else:
@@ -614,6 +735,102 @@ class Results:
         if os.stat(hdf5_path).st_uid == os.getuid():
             os.chmod(hdf5_path, 0o666)
 
+    def save_consolidated(self, store_dir, proposal, run):
+        """Add array variables to per-variable files covering all runs
+
+        Each file holds a 'data' dataset stacking one array per run, and a
+        'runs' dataset of (proposal, run) pairs. Reading a variable for many
+        runs from these is much faster than opening every run's file.
+
+        If a variable can't be stored for this run (e.g. it's no longer an
+        array, or its shape changed), any entry from processing the run
+        before is removed, so it's read from the run's file instead. This is
+        only an optimisation, so errors are logged and not raised.
+        """
+        store_dir = Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+
+        for name, cell in self.cells.items():
+            path = store_dir / f"{name}.h5"
+            try:
+                if not _add_consolidated(path, name, cell.data, proposal, run) \
+                        and path.is_file():
+                    _remove_consolidated(path, proposal, run)
+            except Exception:
+                log.warning("Could not update consolidated file for %s", name,
+                            exc_info=True)
+                continue
+
+            if path.is_file() and os.stat(path).st_uid == os.getuid():
+                os.chmod(path, 0o666)
+
+
+def _consolidated_ix(runs, proposal, run):
+    stored = runs[()]
+    match = np.nonzero((stored[:, 0] == proposal) & (stored[:, 1] == run))[0]
+    return match[0] if match.size else None
+
+
+def _add_consolidated(path, name, obj, proposal, run):
+    """Store one run's array in a per-variable file
+
+    Returns False if the object can't be stored there.
+    """
+    if isinstance(obj, xr.DataArray):
+        values, dims = obj.values, [str(d) for d in obj.dims]
+    elif isinstance(obj, np.ndarray):
+        values, dims = obj, [f"dim_{i}" for i in range(obj.ndim)]
+    else:
+        return False
+
+    if (values.ndim == 0 or values.nbytes > CONSOLIDATE_MAX_BYTES
+            or not (np.issubdtype(values.dtype, np.number) or
+                    np.issubdtype(values.dtype, np.bool_))):
+        return False
+
+    with add_to_h5_file(path) as f:
+        if 'data' not in f:
+            f.create_dataset('data', shape=(0, *values.shape), dtype=values.dtype,
+                             maxshape=(None, *values.shape), chunks=True,
+                             **COMPRESSION_OPTS)
+            f['data'].attrs['dims'] = dims
+            f.create_dataset('runs', shape=(0, 2), dtype=np.int64,
+                             maxshape=(None, 2), chunks=True)
+        data, runs = f['data'], f['runs']
+
+        if data.shape[1:] != values.shape or data.dtype != values.dtype:
+            log.info("Not adding %s to consolidated file, shape/dtype "
+                     "doesn't match earlier runs", name)
+            return False
+
+        ix = _consolidated_ix(runs, proposal, run)
+        if ix is None:
+            ix = len(runs)
+            data.resize(ix + 1, axis=0)
+            runs.resize(ix + 1, axis=0)
+            runs[ix] = (proposal, run)
+        # If reprocessing, this replaces the existing entry
+        data[ix] = values
+
+    return True
+
+
+def _remove_consolidated(path, proposal, run):
+    """Remove a run's entry from a per-variable file, if it's there"""
+    with add_to_h5_file(path) as f:
+        data, runs = f['data'], f['runs']
+        ix = _consolidated_ix(runs, proposal, run)
+        if ix is None:
+            return
+
+        # Move the last entry into this one's place, and shrink the datasets
+        last = len(runs) - 1
+        if ix != last:
+            data[ix] = data[last]
+            runs[ix] = runs[last]
+        data.resize(last, axis=0)
+        runs.resize(last, axis=0)
+
 
 def mock_run():
     run = MagicMock()
@@ -648,11 +865,19 @@ def main(argv=None):
     exec_ap.add_argument('--var', action="append", default=[])
     exec_ap.add_argument('--save', action='append', default=[])
     exec_ap.add_argument('--save-reduced', action='append', default=[])
+    exec_ap.add_argument('--consolidate-dir', type=Path,
+                         help="Also add arrays to per-variable files in this directory")
+    exec_ap.add_argument('--profile-dir', type=Path,
+                         help="Save a cProfile dump for each variable in this directory")
 
     ctx_ap = subparsers.add_parser("ctx", help="Evaluate context file and pickle it to a file")
     ctx_ap.add_argument("context_file", type=Path)
     ctx_ap.add_argument("out_file", type=Path)
 
+    subparsers.add_parser(
+        "check-server", help="Evaluate context files sent on stdin, replying with any errors"
+    )
+
     args = ap.parse_args(argv)
     logging.basicConfig(level=logging.INFO)
 
@@ -695,12 +920,18 @@ def main(argv=None):
             actual_run_data = RunData.ALL if run_data == RunData.PROC else run_data
             run_dc = extra_data.open_run(args.proposal, args.run, data=actual_run_data.value)
 
-        res = ctx.execute(run_dc, args.run, args.proposal, input_vars={})
+        if args.profile_dir is not None:
+            args.profile_dir.mkdir(parents=True, exist_ok=True)
+
+        res = ctx.execute(run_dc, args.run, args.proposal, input_vars={},
+                          profile_dir=args.profile_dir)
 
         for path in args.save:
             res.save_hdf5(path)
         for path in args.save_reduced:
             res.save_hdf5(path, reduced_only=True)
+        if args.consolidate_dir is not None:
+            res.save_consolidated(args.consolidate_dir, args.proposal, args.run)
     elif args.subcmd == "ctx":
         error_info = None
 
@@ -716,6 +947,12 @@ def main(argv=None):
             error_info = extract_error_info(*sys.exc_info())
 
         args.out_file.write_bytes(pickle.dumps((ctx, error_info)))
+    elif args.subcmd == "check-server":
+        # Keep the real stdout for replies, and send anything the context
+        # file prints to stderr instead.
+        replies = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        serve_context_checks(sys.stdin, replies)
 
 
 if __name__ == '__main__':
@@ -1,8 +1,6 @@
 import sys
 from enum import Enum
 from io import StringIO
-from pathlib import Path
-from tempfile import NamedTemporaryFile
 
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QColor, QFont
@@ -11,7 +9,7 @@ from PyQt5.Qsci import QsciScintilla, QsciLexerPython, QsciCommand
 from pyflakes.reporter import Reporter
 from pyflakes.api import check as pyflakes_check
 
-from ..backend.extract_data import get_context_file
+from ..backend.extract_data import ContextValidator
 from ..ctxsupport.ctxrunner import extract_error_info
 from ..context import ContextFile
 
@@ -26,32 +24,29 @@ class ContextFileCheckerThread(QThread):
     # ContextTestResult, traceback, lineno, offset, checked_code
     check_result = pyqtSignal(object, str, int, int, str)
 
-    def __init__(self, code, db_dir, context_python, parent=None):
+    def __init__(self, code, validator=None, parent=None):
         super().__init__(parent)
         self.code = code
-        self.db_dir = db_dir
-        self.context_python = context_python
+        self.validator = validator
 
     def run(self):
         error_info = None
 
         # If a different environment is not specified, we can evaluate the
         # context file directly.
-        if self.context_python is None:
+        if self.validator is None:
             try:
                 ContextFile.from_str(self.code)
             except:
                 # Extract the error information
                 error_info = extract_error_info(*sys.exc_info())
 
-        # Otherwise, write it to a temporary file to evaluate it from another
-        # process.
+        # Otherwise, send it to a process running in that environment.
         else:
-            with NamedTemporaryFile(prefix=".tmp_ctx", dir=self.db_dir) as ctx_file:
-                ctx_path = Path(ctx_file.name)
-                ctx_path.write_text(self.code)
-
-                ctx, error_info = get_context_file(ctx_path, self.context_python)
+            try:
+                error_info = self.validator.check(self.code)
+            except Exception:
+                error_info = extract_error_info(*sys.exc_info())
 
         if error_info is not None:
             stacktrace, lineno, offset = error_info
@@ -108,9 +103,27 @@ class Editor(QsciScintilla):
         line_del = commands.find(QsciCommand.LineDelete)
         line_del.setKey(Qt.ControlModifier | Qt.Key_D)
 
+        # A ContextValidator for each (context_python, db_dir) used, see validator()
+        self._validators = {}
+
+    def validator(self, context_python, db_dir):
+        """Get the validator process for an environment, creating it if needed"""
+        key = (context_python, db_dir)
+        if key not in self._validators:
+            self._validators[key] = ContextValidator(context_python, db_dir)
+        return self._validators[key]
+
+    def close_validators(self):
+        for validator in self._validators.values():
+            validator.close()
+        self._validators.clear()
+
     def launch_test_context(self, db):
         context_python = db.metameta.get("context_python")
-        thread = ContextFileCheckerThread(self.text(), db.path.parent, context_python, parent=self)
+        validator = None
+        if context_python is not None:
+            validator = self.validator(context_python, db.path.parent)
+        thread = ContextFileCheckerThread(self.text(), validator, parent=self)
         thread.check_result.connect(self.on_test_result)
         thread.finished.connect(thread.deleteLater)
         thread.start()
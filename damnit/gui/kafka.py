@@ -1,46 +1,36 @@
-import pickle
 import logging
 
-from kafka import KafkaConsumer, KafkaProducer
 from PyQt5 import QtCore
 
 from ..backend.db import MsgKind, msg_dict
-from ..definitions import UPDATE_BROKERS, UPDATE_TOPIC
+from ..backend.updates import UpdateTransport
 
 log = logging.getLogger(__name__)
 
+# Seconds to wait in each poll. Transports return as soon as there are
+# messages, or when they're closed, so this just has to be long.
+POLL_TIMEOUT = 10
+
 
 class UpdateAgent(QtCore.QObject):
-    message = QtCore.pyqtSignal(object)
+    # All the messages received from one poll, in order
+    messages = QtCore.pyqtSignal(list)
 
-    def __init__(self, db_id: str) -> None:
+    def __init__(self, transport: UpdateTransport) -> None:
         QtCore.QObject.__init__(self)
-        self.update_topic = UPDATE_TOPIC.format(db_id)
-
-        self.kafka_cns = KafkaConsumer(
-            self.update_topic, bootstrap_servers=UPDATE_BROKERS
-        )
-        self.kafka_prd = KafkaProducer(bootstrap_servers=UPDATE_BROKERS,
-                                       value_serializer=lambda d: pickle.dumps(d))
+        self.transport = transport
+        self.transport.subscribe()
         self.running = False
 
     def listen_loop(self) -> None:
         self.running = True
 
         while self.running:
-            # Note: this doesn't throw an exception on timeout, it just returns
-            # an empty dict.
-            topic_messages = self.kafka_cns.poll(timeout_ms=100)
-
-            for topic, messages in topic_messages.items():
-                for msg in messages:
-                    try:
-                        unpickled_msg = pickle.loads(msg.value)
-                    except Exception:
-                        log.error("Kafka event could not be un-pickled.", exc_info=True)
-                        continue
-
-                    self.message.emit(unpickled_msg)
+            # This blocks until there are messages, or stop() closes the
+            # transport.
+            messages = self.transport.poll(timeout=POLL_TIMEOUT)
+            if messages:
+                self.messages.emit(messages)
 
     def run_values_updated(self, proposal, run, name, value):
         message = msg_dict(MsgKind.run_values_updated,
@@ -49,13 +39,15 @@ class UpdateAgent(QtCore.QObject):
                                "run": run,
                                "values": {
                                    name: value
-                               }
+                               },
+                               # User-editable values don't have these
+                               "max_diffs": {},
+                               "attributes": {},
                            })
 
-        # Note: the send() function returns a future that we don't await
-        # immediately, but we call kafka_prd.flush() in stop() which will ensure
-        # that all messages are sent.
-        self.kafka_prd.send(self.update_topic, message)
+        # Note: this may not be delivered immediately, but stop() closes the
+        # transport, which will ensure that all messages are sent.
+        self.transport.send(message)
 
     def variable_set(self, name, title, description, variable_type):
         message = msg_dict(MsgKind.variable_set,
@@ -65,15 +57,24 @@ class UpdateAgent(QtCore.QObject):
                                "attributes": None,
                                "type": variable_type
                            })
-        self.kafka_prd.send(self.update_topic, message)
+        self.transport.send(message)
 
     def stop(self):
+        """Stop listen_loop() & send any queued messages
+
+        Call this from another thread; listen_loop() returns soon after.
+        """
         self.running = False
-        self.kafka_prd.flush(timeout=10)
+        self.transport.close()
 
 
 if __name__ == "__main__":
-    monitor = UpdateAgent("tcp://localhost:5556")
-
-    for record in monitor.kafka_cns:
-        print(record.value.decode())
+    import sys
+    from ..backend.db import DamnitDB
+    from ..backend.updates import open_update_transport
+
+    transport = open_update_transport(DamnitDB.from_dir(sys.argv[1]))
+    transport.subscribe()
+    while True:
+        for msg in transport.poll(POLL_TIMEOUT):
+            print(msg)
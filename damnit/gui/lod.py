@@ -0,0 +1,205 @@
+"""Level-of-detail reduction for plotting large arrays
+
+Matplotlib draws every point it's given, which gets slow with millions of
+points. These reduce data to roughly what can be seen at the current view
+limits & size in pixels, or the chosen number of histogram bins. Plot windows
+recompute them when the view changes, always from the full data.
+"""
+import warnings
+from contextlib import contextmanager
+
+import numpy as np
+from matplotlib.colors import LinearSegmentedColormap, to_rgb
+from matplotlib.image import AxesImage
+
+
+def is_sorted(x):
+    """True if x is 1D and never decreases, e.g. a line over time"""
+    x = np.asarray(x)
+    return x.ndim == 1 and bool(np.all(x[1:] >= x[:-1]))
+
+
+def minmax_indices(x, y, xlim, n_bins):
+    """Pick points to draw a line with sorted x in n_bins columns
+
+    Keeps the first, the minimum & the maximum y points in each bin of x
+    within xlim, plus one point either side so the line continues past the
+    edges. This looks the same as drawing every point when each bin is about
+    one pixel wide.
+    """
+    lo = max(np.searchsorted(x, xlim[0], side='left') - 1, 0)
+    hi = min(np.searchsorted(x, xlim[1], side='right') + 1, len(x))
+    if hi - lo <= 3 * n_bins:
+        return np.arange(lo, hi)
+
+    xv, yv = x[lo:hi], y[lo:hi]
+    bin_ids = _bin_index(xv, xv[0], xv[-1], n_bins)
+    # x is sorted, so each bin is a contiguous slice
+    starts = _first_of_runs(bin_ids)
+    counts = np.diff(np.append(starts, len(bin_ids)))
+
+    picked = [starts]
+    for fill, reduce in [(np.inf, np.minimum), (-np.inf, np.maximum)]:
+        vals = np.where(np.isnan(yv), fill, yv)
+        extreme = np.repeat(reduce.reduceat(vals, starts), counts)
+        hits = np.flatnonzero(vals == extreme)
+        picked.append(hits[_first_of_runs(bin_ids[hits])])
+
+    picked.append([0, len(xv) - 1])
+    return lo + np.unique(np.concatenate(picked))
+
+
+def _bin_index(v, start, stop, n_bins):
+    if stop <= start:
+        return np.zeros(len(v), dtype=np.int64)
+    ix = ((v - start) * (n_bins / (stop - start))).astype(np.int64)
+    return np.clip(ix, 0, n_bins - 1)
+
+
+def _first_of_runs(sorted_ids):
+    """Indexes where each run of equal values in a sorted array starts"""
+    return np.flatnonzero(np.diff(sorted_ids, prepend=sorted_ids[0] - 1))
+
+
+def density(x, y, xlim, ylim, shape):
+    """Count points in a grid of (rows, cols) covering xlim & ylim"""
+    (x0, x1), (y0, y1) = sorted(xlim), sorted(ylim)
+    rows, cols = shape
+    inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+    flat_ix = (_bin_index(y[inside], y0, y1, rows) * cols
+               + _bin_index(x[inside], x0, x1, cols))
+    return np.bincount(flat_ix, minlength=rows * cols).reshape(shape)
+
+
+def downsample2(image):
+    """Halve the size of an image by averaging 2x2 blocks"""
+    h, w = image.shape[0] // 2, image.shape[1] // 2
+    image = image[:h * 2, :w * 2]
+    if image.dtype.kind == 'f' and np.isnan(image).any():
+        blocks = image.reshape(h, 2, w, 2, *image.shape[2:])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN blocks
+            small = np.nanmean(blocks, axis=(1, 3))
+    else:
+        small = (image[0::2, 0::2].astype(np.float64) + image[1::2, 0::2]
+                 + image[0::2, 1::2] + image[1::2, 1::2]) / 4
+    if image.ndim == 3:
+        # Colour images must stay in their original range (e.g. 0-255)
+        small = small.astype(image.dtype)
+    return small
+
+
+@contextmanager
+def no_autoscale(ax):
+    """Stop matplotlib changing the view limits, e.g. when moving an image"""
+    x_on, y_on = ax.get_autoscalex_on(), ax.get_autoscaley_on()
+    ax.set_autoscale_on(False)
+    try:
+        yield
+    finally:
+        ax.set_autoscalex_on(x_on)
+        ax.set_autoscaley_on(y_on)
+
+
+class ImagePyramid:
+    """An image with copies downsampled by factors of 2
+
+    view() picks the smallest copy which still has about one pixel per screen
+    pixel in the view, and crops it to the view.
+    """
+    def __init__(self, image, min_size=512):
+        self.levels = [np.asarray(image)]
+        while max(self.levels[-1].shape[:2]) > min_size:
+            self.levels.append(downsample2(self.levels[-1]))
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    def view(self, xlim, ylim, width_px, height_px):
+        """Get (data, extent) to draw for the view, with the origin at the top"""
+        h, w = self.shape[:2]
+        x0, x1 = np.clip(sorted(xlim), -0.5, w - 0.5) + 0.5
+        y0, y1 = np.clip(sorted(ylim), -0.5, h - 0.5) + 0.5
+        ratio = min((x1 - x0) / max(width_px, 1), (y1 - y0) / max(height_px, 1))
+        level = int(np.clip(np.floor(np.log2(max(ratio, 1))), 0, len(self.levels) - 1))
+
+        f = 2 ** level
+        data = self.levels[level]
+        r0 = min(int(y0 // f), data.shape[0] - 1)
+        c0 = min(int(x0 // f), data.shape[1] - 1)
+        r1 = max(int(np.ceil(y1 / f)), r0 + 1)
+        c1 = max(int(np.ceil(x1 / f)), c0 + 1)
+        data = data[r0:r1, c0:c1]
+        r1, c1 = r0 + data.shape[0], c0 + data.shape[1]
+        extent = (c0 * f - 0.5, c1 * f - 0.5, r1 * f - 0.5, r0 * f - 0.5)
+        return data, extent
+
+
+class DecimatedLine:
+    """A Line2D showing a min/max decimated view of a series with sorted x"""
+    def __init__(self, line, x, y):
+        self.line = line
+        self.x, self.y = x, y
+
+    def update(self, xlim, ylim, width_px, height_px):
+        ix = minmax_indices(self.x, self.y, xlim, max(int(width_px), 1))
+        self.line.set_data(self.x[ix], self.y[ix])
+
+
+class DensityImage:
+    """A 2D histogram image standing in for a dense scatter plot
+
+    The image is transparent where there are no points, and the colour gets
+    more opaque with the log of the number of points in each pixel.
+    """
+    bin_px = 2  # Size of histogram bins in screen pixels
+
+    def __init__(self, ax, x, y, color, alpha=0.8):
+        finite = np.isfinite(x) & np.isfinite(y)
+        self.x, self.y = x[finite], y[finite]
+        self.ax = ax
+        rgb = to_rgb(color)
+        cmap = LinearSegmentedColormap.from_list("", [(*rgb, 0), (*rgb, alpha)])
+        self.image = AxesImage(
+            ax, cmap=cmap, origin='lower', interpolation='nearest'
+        )
+        self.image.set_data(np.zeros((1, 1)))  # Until update() is called
+        ax.add_image(self.image)
+
+    def update(self, xlim, ylim, width_px, height_px):
+        shape = (max(int(height_px / self.bin_px), 1), max(int(width_px / self.bin_px), 1))
+        counts = np.log1p(density(self.x, self.y, xlim, ylim, shape))
+        self.image.set_data(counts)
+        self.image.set_clim(0, max(counts.max(), 1))
+        with no_autoscale(self.ax):
+            self.image.set_extent((*sorted(xlim), *sorted(ylim)))
+
+    def remove(self):
+        self.image.remove()
+
+
+class SortedHistogram:
+    """Data for a histogram which can be rebinned quickly
+
+    The finite values are sorted once, then the counts for any bins are found
+    by binary search for the bin edges, without going through every value.
+    """
+    def __init__(self, data):
+        data = np.asarray(data, dtype=np.float64).ravel()
+        self.sorted = np.sort(data[np.isfinite(data)])
+
+    def __len__(self):
+        return len(self.sorted)
+
+    def density(self, n_bins):
+        """Get (values, edges) like np.histogram(data, n_bins, density=True)"""
+        if len(self.sorted) == 0:
+            return np.zeros(n_bins), np.linspace(0, 1, n_bins + 1)
+        lo, hi = self.sorted[0], self.sorted[-1]
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        edges = np.linspace(lo, hi, n_bins + 1)
+        ix = np.searchsorted(self.sorted, edges, side='left')
+        ix[-1] = len(self.sorted)  # The last bin includes its right edge
+        return np.diff(ix) / (len(self.sorted) * np.diff(edges)), edges
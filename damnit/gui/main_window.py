@@ -3,10 +3,12 @@ import shelve
 import sys
 import time
 from argparse import ArgumentParser
+from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
 from socket import gethostname
+from typing import Optional
 
 import h5py
 import numpy as np
@@ -22,10 +24,11 @@ from PyQt5.QtWebEngineWidgets import QWebEngineProfile
 from PyQt5.QtWidgets import QFileDialog, QMessageBox, QTabWidget
 from PyQt5.QtQuick import QQuickWindow, QSGRendererInterface
 
-from ..api import DataType, RunVariables
+from ..api import DataType, RunVariables, VariableData
 from ..backend import backend_is_running, initialize_and_start_backend
 from ..backend.db import BlobTypes, DamnitDB, MsgKind, ReducedData, db_path
 from ..backend.extraction_control import process_log_path, ExtractionSubmitter
+from ..backend.updates import open_update_transport
 from ..backend.user_variables import UserEditableVariable
 from ..definitions import UPDATE_BROKERS
 from ..util import StatusbarStylesheet, fix_data_for_plotting, icon_path
@@ -38,6 +41,7 @@ from .process import ProcessingDialog
 from .table import DamnitTableModel, TableView, prettify_notation
 from .user_variables import AddUserVariableDialog
 from .web_viewer import PlotlyPlot, UrlSchemeHandler
+from .widgets import QtWaitingSpinner
 from .widgets import CollapsibleWidget
 from .zulip_messenger import ZulipMessenger
 
@@ -53,8 +57,14 @@ class MainWindow(QtWidgets.QMainWindow):
 
     db = None
     db_id = None
+    table = None
     _columns_dialog = None
 
+    # How often to check the database for changes which live updates may have
+    # missed (ms), with & without a connection for live updates.
+    sync_interval = 60_000
+    sync_interval_offline = 10_000
+
     def __init__(self, context_dir: Path = None, connect_to_kafka: bool = True):
         super().__init__()
 
@@ -75,6 +85,12 @@ class MainWindow(QtWidgets.QMainWindow):
         self._view_widget = QtWidgets.QWidget(self)
         self._editor = Editor()
         self._error_widget = QsciScintilla()
+        # Owned by the window, so it can't fire after the widgets are deleted
+        self._error_text_timer = QtCore.QTimer(self)
+        self._error_text_timer.setSingleShot(True)
+        self._error_text_timer.setInterval(100)
+        self._error_text = ""
+        self._error_text_timer.timeout.connect(self._show_error_text)
         self._editor_parent_widget = QtWidgets.QSplitter(Qt.Vertical)
 
         self._tab_widget = QTabWidget()
@@ -89,7 +105,9 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setCentralWidget(self._tab_widget)
 
         self.table = None
-        
+        self._sync_timer = QtCore.QTimer(self)
+        self._sync_timer.timeout.connect(self.sync_table)
+
         self.zulip_messenger = None
 
         self._create_view()
@@ -101,6 +119,13 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self._canvas_inspect = []
 
+        # Variables are read in a thread when double-clicked. Only the latest
+        # request is shown, so an ID identifies the current one.
+        self._inspect_pool = QtCore.QThreadPool(self)
+        self._inspect_request_id = 0
+        self._inspect_current = None
+        self._inspect_spinner = QtWaitingSpinner(self, centerOnParent=True)
+
     def on_tab_changed(self, index):
         if index == 0:
             self._status_bar.showMessage("Double-click on a cell to inspect results.")
@@ -120,8 +145,27 @@ class MainWindow(QtWidgets.QMainWindow):
                 return
 
         self.stop_update_listener_thread()
+        self._sync_timer.stop()
+        if self.table is not None:
+            self.table.stop_loading()
+        self.cancel_inspect_data()
+        self.table_view.stop_cleanup()
+        self._editor.close_validators()
         super().closeEvent(event)
 
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        # Catch up when the user comes back to the window, e.g. after the
+        # computer was asleep. The timer is only running while a table is
+        # open, and the sync is deferred until we're out of event handling.
+        if (event.type() == QtCore.QEvent.ActivationChange and self.isActiveWindow()
+                and self._sync_timer.isActive()):
+            QtCore.QTimer.singleShot(0, self.sync_table)
+
+    def sync_table(self):
+        if self.table is not None:
+            self.table.sync_changes()
+
     def stop_update_listener_thread(self):
         if self._updates_thread is not None:
             self.update_agent.stop()
@@ -148,7 +192,9 @@ class MainWindow(QtWidgets.QMainWindow):
     def _create_status_bar(self) -> None:
         self._status_bar = QtWidgets.QStatusBar()
 
-        self._status_bar.messageChanged.connect(lambda m: self.show_default_status_message() if m == "" else m)
+        # A method rather than a lambda, so the connection goes away safely
+        # when the window is deleted.
+        self._status_bar.messageChanged.connect(self._status_message_changed)
 
         self._status_bar.setStyleSheet("QStatusBar::item {border: None;}")
         self._status_bar.showMessage("Autoconfigure AMORE.")
@@ -157,6 +203,17 @@ class MainWindow(QtWidgets.QMainWindow):
         self._status_bar_connection_status = QtWidgets.QLabel()
         self._status_bar.addPermanentWidget(self._status_bar_connection_status)
 
+        self._status_bar_load_progress = QtWidgets.QProgressBar()
+        self._status_bar_load_progress.setFormat("Loading runs: %v/%m")
+        self._status_bar_load_progress.setMaximumWidth(250)
+        self._status_bar_load_progress.hide()
+        self._status_bar.addPermanentWidget(self._status_bar_load_progress)
+
+        self._status_bar_inspect_cancel = QtWidgets.QPushButton("Cancel loading")
+        self._status_bar_inspect_cancel.clicked.connect(self.cancel_inspect_data)
+        self._status_bar_inspect_cancel.hide()
+        self._status_bar.addPermanentWidget(self._status_bar_inspect_cancel)
+
     def show_status_message(self, message, timeout = 0, stylesheet = ''):
         if isinstance(stylesheet, StatusbarStylesheet):
             stylesheet = stylesheet.value
@@ -164,6 +221,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self._status_bar.showMessage(message, timeout)
         self._status_bar.setStyleSheet(stylesheet)
 
+    def _status_message_changed(self, message):
+        if message == "":
+            self.show_default_status_message()
+
     def show_default_status_message(self):
         self._status_bar.showMessage("Double-click on a cell to inspect results.")
         self._status_bar.setStyleSheet('QStatusBar {}')
@@ -237,9 +298,14 @@ da-dev@xfel.eu"""
                     col_settings = db[key][Settings.COLUMNS.value]
 
         if self.table is not None:
+            self.table.stop_loading()
             self.table.deleteLater()
         self.table = self._create_table_model(self.db, col_settings)
         self.table_view.setModel(self.table)
+        self._sync_timer.start(
+            self.sync_interval if self._updates_thread is not None
+            else self.sync_interval_offline
+        )
         self.table_view.sortByColumn(self.table.find_column("Timestamp", by_title=True),
                                      Qt.SortOrder.AscendingOrder)
 
@@ -373,12 +439,18 @@ da-dev@xfel.eu"""
         action_columns.triggered.connect(self.open_column_dialog)
         self.action_autoscroll = QtWidgets.QAction('Scroll to newly added runs', self)
         self.action_autoscroll.setCheckable(True)
+        self.action_inspect_preview = QtWidgets.QAction(
+            'Preview large images while loading', self
+        )
+        self.action_inspect_preview.setCheckable(True)
+        self.action_inspect_preview.setChecked(True)
         action_precreate_runs = QtWidgets.QAction("Pre-create new runs", self)
         action_precreate_runs.triggered.connect(self.precreate_runs_dialog)
         tableMenu = menu_bar.addMenu("Table")
         
         tableMenu.addAction(action_columns)
         tableMenu.addAction(self.action_autoscroll)
+        tableMenu.addAction(self.action_inspect_preview)
         tableMenu.addAction(action_precreate_runs)
         
         #jump to run 
@@ -421,8 +493,14 @@ da-dev@xfel.eu"""
         self.table_view.scrollTo(index)
         self.table_view.selectRow(index.row())
 
+    def on_table_load_progress(self, n_loaded, n_total):
+        self._status_bar_load_progress.setMaximum(n_total)
+        self._status_bar_load_progress.setValue(n_loaded)
+        self._status_bar_load_progress.setVisible(n_loaded < n_total)
+
     def on_rows_inserted(self, _modelix, first, _last):
-        if self.action_autoscroll.isChecked():
+        # Don't jump around while older runs are still being loaded
+        if self.action_autoscroll.isChecked() and not self.table.loading:
             self.scroll_to_row(first)
 
     def export_table(self):
@@ -456,6 +534,10 @@ da-dev@xfel.eu"""
             self.show_status_message(f"Unrecognized file extension: {extension}",
                                      stylesheet=StatusbarStylesheet.ERROR)
 
+    def handle_updates(self, messages):
+        for message in messages:
+            self.handle_update(message)
+
     def handle_update(self, message):
         if not self._received_update:
             self._received_update = True
@@ -485,17 +567,25 @@ da-dev@xfel.eu"""
         data = message['data']
         if msg_kind == MsgKind.run_values_updated:
             self.handle_run_values_updated(
-                data['proposal'], data['run'], data['values']
+                data['proposal'], data['run'], data['values'],
+                data.get('max_diffs'), data.get('attributes')
             )
         elif msg_kind == MsgKind.variable_set:
             self.table.handle_variable_set(data)
+        elif msg_kind == MsgKind.job_updated:
+            self.table.update_job_statuses()
 
-    def handle_run_values_updated(self, proposal, run, values: dict):
-        self.table.handle_run_values_changed(proposal, run, values)
+    def handle_run_values_updated(self, proposal, run, values: dict,
+                                  max_diffs=None, attrs=None):
+        self.table.handle_run_values_changed(proposal, run, values, max_diffs, attrs)
 
+    def on_runs_updated(self, column_ids, new_columns):
         # update plots and plotting controls
-        self.plot.update_columns()
-        self.plot.update()
+        if new_columns:
+            self.plot.update_columns()
+        self.plot.schedule_update({
+            self.table.column_title(self.table.find_column(c)) for c in column_ids
+        })
 
 
     def _updates_thread_launcher(self) -> None:
@@ -505,18 +595,20 @@ da-dev@xfel.eu"""
         assert self.db_id is not None
 
         try:
-            self.update_agent = UpdateAgent(self.db_id)
+            self.update_agent = UpdateAgent(open_update_transport(self.db))
         except NoBrokersAvailable:
             QtWidgets.QMessageBox.warning(self, "Broker connection failed",
                                           f"Could not connect to any Kafka brokers at: {' '.join(UPDATE_BROKERS)}\n\n" +
-                                          "DAMNIT can operate offline, but it will not receive any updates from new or reprocessed runs.")
+                                          "DAMNIT can operate offline, but it will not receive any updates from new or reprocessed runs.\n\n" +
+                                          "To send updates through the database instead of Kafka, run "
+                                          "'amore-proto db-config update_transport local' in the database directory.")
             return
 
         self._updates_thread = QtCore.QThread()
         self.update_agent.moveToThread(self._updates_thread)
 
         self._updates_thread.started.connect(self.update_agent.listen_loop)
-        self.update_agent.message.connect(self.handle_update)
+        self.update_agent.messages.connect(self.handle_updates)
         QtCore.QTimer.singleShot(0, self._updates_thread.start)
 
     def _set_comment_date(self):
@@ -569,7 +661,7 @@ da-dev@xfel.eu"""
         )
 
         cell_data = self.table.get_value_at(index)
-        is_image = self.table.itemFromIndex(index).data(Qt.DecorationRole) is not None
+        is_image = self.table.data(index, Qt.DecorationRole) is not None
 
         try:
             variable = RunVariables(self._context_path.parent, run)[quantity]
@@ -584,34 +676,83 @@ da-dev@xfel.eu"""
                                      stylesheet=StatusbarStylesheet.ERROR)
             return
 
-        if not (is_image or variable.type_hint() or isinstance(cell_data, (int, float))):
+        # Look up the type once, this may need to open the file
+        type_hint = variable.type_hint()
+
+        if not (is_image or type_hint or isinstance(cell_data, (int, float))):
             QMessageBox.warning(self, "Can't inspect variable",
                                 f"'{quantity}' has type '{type(cell_data).__name__}', cannot inspect.")
             return
 
-        if variable.type_hint() is DataType.PlotlyFigure:
+        if type_hint is DataType.PlotlyFigure:
             pp = PlotlyPlot(variable, self)
             self._canvas_inspect.append(pp)
             pp.show()
             return
 
-        if variable.type_hint() is DataType.Dataset:
+        if type_hint is DataType.Dataset:
             QMessageBox.warning(self, "Can't inspect variable",
                                 f"'{quantity}' is a Xarray Dataset (not supported).")
+            return
 
-        try:
-            data = variable.read()
-        except KeyError:
-            log.warning(f'"{quantity}" not found in {variable.file}...')
+        # Read the data in a thread, and show it when it arrives
+        self.cancel_inspect_data()
+        self._inspect_request_id += 1
+        reader = VariableReader(
+            self._inspect_request_id, self._context_path.parent, run, variable.name,
+            type_hint, preview=self.action_inspect_preview.isChecked()
+        )
+        reader.signals.data_read.connect(self._inspect_data_read)
+        reader.signals.failed.connect(self._inspect_data_failed)
+        self._inspect_current = InspectRequest(self._inspect_request_id, variable, run)
+        self._inspect_pool.start(reader)
+
+        self._inspect_spinner.start()
+        self._status_bar_inspect_cancel.show()
+        self.show_status_message(f"Loading {variable.title} (run {run})...")
+
+    def cancel_inspect_data(self):
+        """Stop waiting for data being read for inspect_data()
+
+        The read itself can't be interrupted, but its result is ignored.
+        """
+        self._inspect_current = None
+        self._inspect_spinner.stop()
+        self._status_bar_inspect_cancel.hide()
+
+    def wait_for_inspect_data(self, msecs=-1):
+        """Block until inspected data is read & shown (mainly for testing)"""
+        self._inspect_pool.waitForDone(msecs)
+        QtCore.QCoreApplication.sendPostedEvents()
+
+    def _inspect_data_failed(self, request_id, message):
+        if self._inspect_current is None or request_id != self._inspect_current.id:
+            return
+        self.cancel_inspect_data()
+        self.show_status_message(message, timeout=7000,
+                                 stylesheet=StatusbarStylesheet.ERROR)
+
+    def _inspect_data_read(self, request_id, data, is_preview):
+        request = self._inspect_current
+        if request is None or request_id != request.id:
+            return  # Cancelled, or another variable was requested since
+        if not is_preview:
+            self.cancel_inspect_data()
+            self.show_default_status_message()
+
+        title = f'{request.variable.title} (run {request.run})'
+        if request.canvas is not None:
+            # Replace the preview with the full data
+            request.canvas.update_canvas(data.squeeze())
+            request.canvas.setWindowTitle(title)
             return
 
         if not isinstance(data, (np.ndarray, xr.DataArray)):
             log.error("Only array objects are expected here, not %r", type(data))
             return
 
-        title = f'{variable.title} (run {run})'
-
         data = data.squeeze()
+        variable, run = request.variable, request.run
 
         if data.ndim == 1:
             if isinstance(data, xr.DataArray):
@@ -633,13 +774,17 @@ da-dev@xfel.eu"""
         elif data.ndim == 0:
             # If this is a scalar value, then we can't plot it
             QMessageBox.warning(self, "Can't inspect variable",
-                                f"'{quantity}' is a scalar, there's nothing more to plot.")
+                                f"'{variable.name}' is a scalar, there's nothing more to plot.")
             return
         else:
             QMessageBox.warning(self, "Can't inspect variable",
-                                f"'{quantity}' with {data.ndim} dimensions (not supported).")
+                                f"'{variable.name}' with {data.ndim} dimensions (not supported).")
             return
 
+        if is_preview:
+            request.canvas = canvas
+            canvas.setWindowTitle(f"{title} (preview, loading full data...)")
+
         self._canvas_inspect.append(canvas)
         canvas.show()
 
@@ -660,6 +805,9 @@ da-dev@xfel.eu"""
         table.time_comment_changed.connect(self.save_time_comment)
         table.run_visibility_changed.connect(lambda row, state: self.plot.update())
         table.rowsInserted.connect(self.on_rows_inserted)
+        table.load_progress.connect(self.on_table_load_progress)
+        table.load_finished.connect(self._status_bar_load_progress.hide)
+        table.runs_updated.connect(self.on_runs_updated)
         return table
 
     def _create_view(self) -> None:
@@ -674,6 +822,7 @@ da-dev@xfel.eu"""
         self.table_view.zulip_action.triggered.connect(self.export_selection_to_zulip)
         self.table_view.process_action.triggered.connect(self.process_runs)
         self.table_view.log_view_requested.connect(self.show_run_logs)
+        self.table_view.status_message.connect(self.show_status_message)
 
         vertical_layout.addWidget(self.table_view)
 
@@ -847,7 +996,11 @@ da-dev@xfel.eu"""
         # Clear the widget and wait for a bit to visually indicate to the
         # user that something happened.
         self._error_widget.setText("")
-        QtCore.QTimer.singleShot(100, lambda: self._error_widget.setText(text))
+        self._error_text = text
+        self._error_text_timer.start()
+
+    def _show_error_text(self):
+        self._error_widget.setText(self._error_text)
 
     def save_context(self):
         self._context_code_to_save = self._editor.text()
@@ -939,6 +1092,7 @@ da-dev@xfel.eu"""
                 self.show_status_message(
                     f"Launched processing for {len(reqs)} runs", 10_000
                 )
+            self.table.update_job_statuses()
 
     adeqt_window = None
 
@@ -995,6 +1149,77 @@ class LogViewWindow(QtWidgets.QMainWindow):
         self.resize(1000, 800)
 
 
+@dataclass
+class InspectRequest:
+    id: int
+    variable: VariableData
+    run: int
+    canvas: Optional[QtWidgets.QWidget] = None  # Window showing a preview
+
+
+class VariableReaderSignals(QtCore.QObject):
+    data_read = QtCore.pyqtSignal(int, object, bool)  # ID, data, is preview
+    failed = QtCore.pyqtSignal(int, str)
+
+
+class VariableReader(QtCore.QRunnable):
+    """Read a variable's data in a QThreadPool
+
+    With preview=True, large images are first read with a stride along each
+    axis, so they can be shown quickly before the full data arrives.
+
+    The variable is looked up again in the pool thread, because the database
+    connection can only be used from the thread which opened it.
+    """
+    preview_size = 1024  # Max. preview length along each axis
+
+    def __init__(self, request_id, db_dir, run, name, type_hint, preview=False):
+        super().__init__()
+        self.request_id = request_id
+        self.db_dir = db_dir
+        self.run_no = run
+        self.name = name
+        self.type_hint = type_hint
+        self.preview = preview
+        # QRunnable isn't a QObject, so the signals live on a separate object
+        self.signals = VariableReaderSignals()
+
+    def run(self):
+        try:
+            variable = RunVariables(self.db_dir, self.run_no)[self.name]
+            if self.preview and self.type_hint is None:
+                self._read_preview(variable)
+            data = variable.read()
+        except KeyError:
+            log.warning(f'"{self.name}" not found for run {self.run_no}...')
+            self.signals.failed.emit(
+                self.request_id, f"Couldn't find data for '{self.name}'"
+            )
+        except Exception as e:
+            log.warning(f"Error reading {self.name}", exc_info=True)
+            self.signals.failed.emit(
+                self.request_id, f"Error reading '{self.name}': {e}"
+            )
+        else:
+            self.signals.data_read.emit(self.request_id, data, False)
+
+    def _read_preview(self, variable):
+        dset = variable.read(lazy=True)
+        if not isinstance(dset, h5py.Dataset):
+            return
+        try:
+            # Only images (2D, or 3D colour images) can be refined later
+            shape = [n for n in dset.shape if n != 1]
+            is_image = len(shape) == 2 or (len(shape) == 3 and shape[-1] in (3, 4))
+            if is_image and max(shape) > self.preview_size:
+                strided = tuple(
+                    slice(None, None, -(-n // self.preview_size)) for n in dset.shape
+                )
+                self.signals.data_read.emit(self.request_id, dset[strided], True)
+        finally:
+            dset.file.close()
+
+
 def prompt_setup_db_and_backend(context_dir: Path, prop_no=None, parent=None):
     if not db_path(context_dir).is_file():
 
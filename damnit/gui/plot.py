@@ -1,4 +1,5 @@
 import logging
+import threading
 import numpy as np
 import pandas as pd
 import tempfile
@@ -18,7 +19,10 @@ from matplotlib.figure import Figure
 from mpl_pan_zoom import zoom_factory, PanManager, MouseButton
 
 from ..api import RunVariables
-from ..util import fix_data_for_plotting
+from .lod import (
+    DecimatedLine, DensityImage, ImagePyramid, SortedHistogram, is_sorted, no_autoscale
+)
+from ..util import LRUCache, fix_data_for_plotting
 
 log = logging.getLogger(__name__)
 
@@ -113,6 +117,16 @@ class PlotWindow(QtWidgets.QDialog):
         self._scroll_zoom = None
         self._panmanager = PanManager(self.figure, MouseButton.LEFT)
 
+        # Reduced data for large plots is recomputed when the view changes.
+        # Panning & zooming change the limits many times, so wait briefly.
+        self._lod_timer = QtCore.QTimer(self)
+        self._lod_timer.setSingleShot(True)
+        self._lod_timer.setInterval(50)
+        self._lod_timer.timeout.connect(self._update_lod)
+        self._axis.callbacks.connect('xlim_changed', lambda _: self._lod_timer.start())
+        self._axis.callbacks.connect('ylim_changed', lambda _: self._lod_timer.start())
+        self._canvas.mpl_connect('resize_event', lambda _: self._lod_timer.start())
+
         self.figure.tight_layout()
 
     _autoscale_checkbox = None
@@ -123,6 +137,13 @@ class PlotWindow(QtWidgets.QDialog):
     def _make_cursors(self):
         return []  # Overridden in subclasses
 
+    def _view_size_px(self):
+        bbox = self._axis.get_window_extent()
+        return bbox.width, bbox.height
+
+    def _update_lod(self):
+        pass  # Overridden in subclasses
+
     def _setup_scroll_zoom(self):
         # This needs to be redone when plotting changes the axes limits, so it
         # zooms on the correct position.
@@ -192,8 +213,9 @@ class HistogramPlotWindow(PlotWindow):
             parent, xlabel=xlabel, ylabel="Probability density", title=title, **kwargs
         )
 
+        # One SortedHistogram & stairs artist per series, None for all-NaN data
+        self._histograms = []
         self._hist_objects = []
-        self._hist_kwargs = []
 
         self.n_bins = 5
         self._probability_density_bins = QtWidgets.QSpinBox(self)
@@ -211,53 +233,48 @@ class HistogramPlotWindow(PlotWindow):
 
     def _clear_data(self):
         for o in self._hist_objects:
-            o.remove()
+            if o is not None:
+                o.remove()
         self._hist_objects = []
+        self._histograms = []
 
-    def probability_density_bins_changed(self):
-        self.n_bins = self._probability_density_bins.value()
-
-        # Regenerate the histograms
-        self._clear_data()
-        self._nan_warning_label.hide()
-
+    def _rebin(self):
+        """Recompute the histograms for self.n_bins, returning all the edges & values"""
         xs, ys = [], []
-        for i, data in enumerate(self.data_x):
-            # Don't try to update histograms of NaN arrays
-            if np.all(np.isnan(data)):
-                self._nan_warning_label.show()
+        for hist, stairs in zip(self._histograms, self._hist_objects):
+            if stairs is None:
                 continue
+            values, edges = hist.density(self.n_bins)
+            stairs.set_data(values, edges)
+            xs.append(edges)
+            ys.append(values)
+        return xs, ys
 
-            y, x, patches = self._axis.hist(
-                data, bins=self.n_bins, **self._hist_kwargs[i]
-            )
-            self._hist_objects.append(patches)
+    def probability_density_bins_changed(self):
+        self.n_bins = self._probability_density_bins.value()
 
-            xs.append(x)
-            ys.append(y)
-        self.figure.canvas.draw()
+        # Rebinning uses the sorted data, and updates the existing artists
+        xs, ys = self._rebin()
+        self.figure.canvas.draw_idle()
 
         if self._autoscale_enabled() and len(xs) > 0:
-            xs_min, ys_min = xs[0].min(), 0
-            xs_max, ys_max = xs[0].max(), 1
-
-            for x, y in zip(xs, ys):
-                xs_min = min(xs_min, x.min())
-                xs_max = max(xs_max, x.max())
-                ys_max = min(ys_max, y.max())
-
-            self.autoscale(xs_min, xs_max, 0, ys_max, margin=0.05)
+            self.autoscale(
+                min(x.min() for x in xs), max(x.max() for x in xs),
+                0, max(y.max() for y in ys), margin=0.05
+            )
 
         # Update the toolbar history so that clicking the home button resets the
         # plot limits properly.
         self._canvas.toolbar.update()
 
     def _make_cursors(self):
-        return [mplcursors.cursor(self._hist_objects, hover=True)]
+        return [mplcursors.cursor(
+            [o for o in self._hist_objects if o is not None], hover=True
+        )]
 
     def update(self):
         if self.summary_values:
-            x = self.main_window.table.numbers_for_plotting(self.xlabel)
+            x = self.main_window.table.numbers_for_plotting(self.xlabel)[0]
             self.update_canvas([x])
 
     def update_canvas(self, xs, legend=None):
@@ -269,44 +286,32 @@ class HistogramPlotWindow(PlotWindow):
         self._axis.grid(visible=True)
         self.data_x = xs
 
-        self._hist_kwargs = []
-        x_all, y_all = [], []
         for i, data, label in zip(
             range(len(xs)),
             xs,
             legend if legend is not None else len(xs) * [None],
         ):
-            color = cmap(i / len(xs))
-
-            plot_exists = len(self._hist_objects) == len(xs)
-
-            self._hist_kwargs.append({
-                "color": color,
-                "density": True,
-                "align": "mid",
-                "label": label,
-                "alpha": 0.5,
-            })
-
+            hist = SortedHistogram(data)
             # Don't try to histogram NaNs
-            if np.all(np.isnan(data)):
+            if len(hist) == 0:
                 self._nan_warning_label.show()
-                self._hist_objects.append([])
+                self._histograms.append(None)
+                self._hist_objects.append(None)
                 continue
 
-            y, x, patches = self._axis.hist(
-                data, bins=self.n_bins, **self._hist_kwargs[-1]
-            )
-            self._hist_objects.append(patches)
+            # A single artist per series, however many bins there are
+            self._histograms.append(hist)
+            self._hist_objects.append(self._axis.stairs(
+                [], [0], fill=True, color=cmap(i / len(xs)), alpha=0.5, label=label
+            ))
 
-            x_all.append(x)
-            y_all.append(y)
+        x_all, y_all = self._rebin()
 
         if len(xs) > 1:
             self._axis.legend()
         self.figure.canvas.draw()
 
-        if sum(a.size for a in x_all) and (self._autoscale_enabled() or not plot_exists):
+        if len(x_all) and (self._autoscale_enabled() or not plot_exists):
             x_all = np.concatenate(x_all)
             y_all = np.concatenate(y_all)
             self.autoscale(
@@ -321,6 +326,11 @@ class HistogramPlotWindow(PlotWindow):
 
 
 class ScatterPlotWindow(PlotWindow):
+    # With more points than this in total, series with sorted x values are
+    # drawn decimated to their min/max in each pixel column, and others as a
+    # density image.
+    lod_threshold = 100_000
+
     def __init__(
         self,
         parent,
@@ -338,6 +348,7 @@ class ScatterPlotWindow(PlotWindow):
 
         self._fmt = fmt
         self._lines = []
+        self._lod_series = []
 
         if not strongly_correlated:
             self._corr_warning_label.show()
@@ -347,6 +358,15 @@ class ScatterPlotWindow(PlotWindow):
     def _make_cursors(self):
         return [mplcursors.cursor(self._lines, hover=True)]
 
+    def _update_lod(self):
+        if not self._lod_series:
+            return
+        xlim, ylim = self._axis.get_xlim(), self._axis.get_ylim()
+        width, height = self._view_size_px()
+        for series in self._lod_series:
+            series.update(xlim, ylim, width, height)
+        self._canvas.draw_idle()
+
     def update(self):
         if self.summary_values:
             x, y = self.main_window.table.numbers_for_plotting(
@@ -370,7 +390,14 @@ class ScatterPlotWindow(PlotWindow):
 
         plot_exists = len(self._lines) == len(xs)
 
+        for line in self._lines:
+            line.remove()
+        for series in self._lod_series:
+            if isinstance(series, DensityImage):
+                series.remove()
         self._lines = []
+        self._lod_series = []
+        use_lod = sum(np.size(x) for x in xs) > self.lod_threshold
         for i, x, y, label in zip(
             range(len(xs)),
             xs,
@@ -380,11 +407,24 @@ class ScatterPlotWindow(PlotWindow):
             fmt = self._fmt if len(xs) == 1 else "o"
             color = cmap(i / len(xs))
 
-            self._lines.append(
-                self._axis.plot(
-                    x, y, fmt, color=color, label=label, alpha=0.5
-                )[0]
-            )
+            reduce = use_lod
+            if reduce:
+                try:
+                    x = np.asarray(x, dtype=np.float64)
+                    y = np.asarray(y, dtype=np.float64)
+                except (TypeError, ValueError):
+                    reduce = False  # e.g. strings, which can't be reduced
+
+            if not reduce:
+                line = self._axis.plot(x, y, fmt, color=color, label=label, alpha=0.5)[0]
+            elif is_sorted(x):
+                line = self._axis.plot([], [], fmt, color=color, label=label, alpha=0.5)[0]
+                self._lod_series.append(DecimatedLine(line, x, y))
+            else:
+                # The empty line gives a legend entry for the density image
+                line = self._axis.plot([], [], "o", color=color, label=label, alpha=0.5)[0]
+                self._lod_series.append(DensityImage(self._axis, x, y, color))
+            self._lines.append(line)
 
         if len(xs) > 1:
             self._axis.legend()
@@ -398,6 +438,8 @@ class ScatterPlotWindow(PlotWindow):
 
             self.autoscale(xs_min, xs_max, ys_min, ys_max, margin=0.05)
 
+        self._update_lod()
+
         self._setup_scroll_zoom()
 
         # Update the toolbar history so that clicking the home button resets the
@@ -429,6 +471,12 @@ class Xarray1DPlotWindow(PlotWindow):
 
 class ImagePlotWindow(PlotWindow):
     _image = None
+    _image_shape = None
+    _pyramid = None
+
+    # Images larger than this on either side are drawn from downsampled
+    # copies, depending on how far the view is zoomed in.
+    lod_image_size = 2048
 
     def __init__(self, parent, image, **kwargs):
         super().__init__(parent, **kwargs)
@@ -449,6 +497,17 @@ class ImagePlotWindow(PlotWindow):
 
         self.update_canvas(image)
 
+    def _update_lod(self):
+        if self._pyramid is None:
+            return
+        data, extent = self._pyramid.view(
+            self._axis.get_xlim(), self._axis.get_ylim(), *self._view_size_px()
+        )
+        self._image.set_data(data)
+        with no_autoscale(self._axis):
+            self._image.set_extent(extent)
+        self._canvas.draw_idle()
+
     def set_dynamic_aspect(self, is_dynamic):
         aspect = "auto" if is_dynamic else "equal"
         self._axis.set_aspect(aspect)
@@ -476,12 +535,35 @@ class ImagePlotWindow(PlotWindow):
 
             interpolation = "antialiased" if is_color_image else "nearest"
 
+            full_image = image
+            if max(image.shape[:2]) > self.lod_image_size:
+                self._pyramid = ImagePyramid(image)
+                # Start with the smallest copy, _update_lod picks the level
+                image = self._pyramid.levels[-1]
+                h, w = full_image.shape[:2]
+                extent = (-0.5, w - 0.5, h - 0.5, -0.5)
+            else:
+                self._pyramid = None
+                extent = None
+
             if self._image is None:
-                self._image = self._axis.imshow(image, interpolation=interpolation)
+                self._image = self._axis.imshow(
+                    image, interpolation=interpolation, extent=extent
+                )
                 if not is_color_image:
                     self.figure.colorbar(self._image, ax=self._axis)
             else:
                 self._image.set_array(image)
+                if extent is None:
+                    h, w = image.shape[:2]
+                    extent = (-0.5, w - 0.5, h - 0.5, -0.5)
+                with no_autoscale(self._axis):
+                    self._image.set_extent(extent)
+                if full_image.shape != self._image_shape:
+                    # e.g. a preview replaced by the full image, so show it all
+                    self._axis.set_xlim(extent[:2])
+                    self._axis.set_ylim(extent[2:])
+            self._image_shape = full_image.shape
 
             # Specific settings for color/noncolor images
             if is_color_image:
@@ -490,10 +572,12 @@ class ImagePlotWindow(PlotWindow):
                 self._axis.set_xlabel("")
                 self._axis.set_ylabel("")
             else:
-                vmin = np.nanquantile(image, 0.01, method='nearest')
-                vmax = np.nanquantile(image, 0.99, method='nearest')
+                vmin = np.nanquantile(full_image, 0.01, method='nearest')
+                vmax = np.nanquantile(full_image, 0.99, method='nearest')
                 self._image.set_clim(vmin, vmax)
 
+            self._update_lod()
+
         self._setup_scroll_zoom()
 
         # Update the toolbar history so that clicking the home button resets the
@@ -543,6 +627,141 @@ class SearchableComboBox(QtWidgets.QComboBox):
             super().focusInEvent(event)
 
 
+class RunDataCache:
+    """Thread-safe cache of variable data read for plotting run series
+
+    Keys include the modification time of the run's HDF5 file, so data is read
+    again after a run is reprocessed. Only arrays are cached, as other values
+    are small and may be edited in the database.
+    """
+    def __init__(self, max_bytes=512 * 2**20):
+        self._cache = LRUCache(max_bytes, sizeof=lambda value: value.nbytes)
+        self._lock = threading.Lock()
+
+    def read(self, variables: RunVariables, name):
+        var = variables[name]
+        try:
+            mtime = var.file.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        key = (variables.proposal, variables.run, var.name, mtime)
+
+        with self._lock:
+            data = self._cache.get(key)
+        if data is None:
+            data = var.read()
+            if isinstance(data, (np.ndarray, xr.DataArray)):
+                with self._lock:
+                    self._cache[key] = data
+        return data
+
+
+def load_run_series(db_dir, run, x_name, y_name=None, cache=None):
+    """Read x (& optionally y) data for one run, aligning them by train ID
+
+    Returns (strongly_correlated, x, y)
+    """
+    cache = cache or RunDataCache()
+    variables = RunVariables(db_dir, run)
+    x = cache.read(variables, x_name)
+
+    if y_name is None:
+        # Get 1 column for histogram
+        return True, x, None
+
+    y = cache.read(variables, y_name)
+
+    strongly_correlated = False
+    if isinstance(x, xr.DataArray) and "trainId" in x.coords and \
+       isinstance(y, xr.DataArray) and "trainId" in y.coords:
+        tids = np.intersect1d(x.trainId, y.trainId)
+        x = x.sel(trainId=tids)
+        y = y.sel(trainId=tids)
+        strongly_correlated = True
+
+    return strongly_correlated, x, y
+
+
+class RunSeriesSignals(QtCore.QObject):
+    loaded = QtCore.pyqtSignal(int, object)
+
+
+class RunSeriesLoader(QtCore.QRunnable):
+    """Load the data for one run in a QThreadPool"""
+    def __init__(self, ix, db_dir, run_number, x_name, y_name, cache, cancelled):
+        super().__init__()
+        self.ix = ix
+        self.db_dir = db_dir
+        self.run_number = run_number
+        self.x_name = x_name
+        self.y_name = y_name
+        self.cache = cache
+        self.cancelled = cancelled
+        # QRunnable isn't a QObject, so the signal lives on a separate object
+        self.signals = RunSeriesSignals()
+
+    def run(self):
+        if self.cancelled.is_set():
+            return
+        try:
+            result = load_run_series(
+                self.db_dir, self.run_number, self.x_name, self.y_name, self.cache
+            )
+        except Exception:
+            log.warning(f"Couldn't retrieve data for run {self.run_number} "
+                        f"({self.x_name}, {self.y_name})", exc_info=True)
+            result = None
+        self.signals.loaded.emit(self.ix, result)
+
+
+class RunSeriesLoading(QtCore.QObject):
+    """Load data for several runs in a thread pool, showing a progress dialog
+
+    finished is emitted with a list of (run, result) pairs in the order of the
+    runs given, where result is None if loading failed. It is not emitted if
+    loading is cancelled.
+    """
+    finished = QtCore.pyqtSignal(list)
+
+    def __init__(self, pool, db_dir, runs, x_name, y_name, cache, parent=None):
+        super().__init__(parent)
+        self.runs = runs
+        self._pool = pool
+        self._results = {}
+        self._cancelled = threading.Event()
+
+        self.progress = QtWidgets.QProgressDialog(
+            f"Loading data for {len(runs)} runs...", "Cancel", 0, len(runs), parent
+        )
+        self.progress.setWindowModality(Qt.WindowModal)
+        self.progress.setMinimumDuration(500)
+        self.progress.canceled.connect(self.cancel)
+
+        for ix, run in enumerate(runs):
+            loader = RunSeriesLoader(
+                ix, db_dir, run, x_name, y_name, cache, self._cancelled
+            )
+            loader.signals.loaded.connect(self._loaded)
+            pool.start(loader)
+
+    def cancel(self):
+        if not self._cancelled.is_set():
+            self._cancelled.set()
+            self._pool.clear()  # Drop loaders that haven't started yet
+            self.progress.close()
+
+    def _loaded(self, ix, result):
+        if self._cancelled.is_set():
+            return
+        self._results[ix] = result
+        self.progress.setValue(len(self._results))
+        if len(self._results) == len(self.runs):
+            self.progress.close()
+            self.finished.emit(
+                [(run, self._results[ix]) for ix, run in enumerate(self.runs)]
+            )
+
+
 class PlottingControls:
     def __init__(self, main_window) -> None:
         self._main_window = main_window
@@ -578,6 +797,21 @@ class PlottingControls:
 
         self._plot_windows = []
 
+        # Data for plotting selected runs is read in threads, and arrays are
+        # kept so plotting them again doesn't need to read the files.
+        self._run_data_cache = RunDataCache()
+        self._loader_pool = QtCore.QThreadPool(main_window)
+        self._loader_pool.setMaxThreadCount(4)
+        self._run_data_loading = None
+
+        # Redrawing plots is slow, so updates for changed columns are collected
+        # and plots showing those columns are redrawn together.
+        self._columns_to_update = set()
+        self._update_timer = QtCore.QTimer(main_window)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(500)
+        self._update_timer.timeout.connect(self._run_scheduled_update)
+
     def update_columns(self):
         keys = self.table.column_titles
 
@@ -639,24 +873,43 @@ class PlottingControls:
         else:
             ylabel = self._combo_box_y_axis.currentText()
 
+        x_name = self._main_window.col_title_to_name(xlabel)
+        y_name = None if ylabel is None else self._main_window.col_title_to_name(ylabel)
+
+        if self._run_data_loading is not None:
+            self._run_data_loading.cancel()
+        self._run_data_loading = loading = RunSeriesLoading(
+            self._loader_pool,
+            self._main_window._context_path.parent,
+            [r for (_, r) in props_runs],
+            x_name, y_name, self._run_data_cache,
+            parent=self._main_window,
+        )
+        loading.finished.connect(
+            lambda results: self._plot_run_data(results, xlabel, ylabel, histogram)
+        )
+
+    def wait_for_run_data(self, msecs=-1):
+        """Block until data for selected runs is loaded (mainly for testing)"""
+        self._loader_pool.waitForDone(msecs)
+        QtCore.QCoreApplication.sendPostedEvents()
+
+    def _plot_run_data(self, results, xlabel, ylabel, histogram):
+        self._run_data_loading = None
         runs = []
         xs, ys = [], []
         strongly_correlated = True
 
-        for p, r in props_runs:
-            try:
-                correlated, xi, yi = self.get_run_series_data(p, r, xlabel, ylabel)
+        for r, result in results:
+            if result is not None:
+                correlated, xi, yi = result
                 strongly_correlated = strongly_correlated and correlated
-            except Exception:
-                log.warning(f"Couldn't retrieve data for run {r} ({xlabel}, {ylabel})",
-                            exc_info=True)
-            else:
                 runs.append(r)
                 xs.append(xi)
                 ys.append(yi)
 
         if len(xs) == 0 or len(ys) == 0:
-            log.warning("Error getting data for plot", exc_info=True)
+            log.warning("Error getting data for plot")
             QMessageBox.warning(
                 self._main_window,
                 "Plotting failed",
@@ -708,7 +961,7 @@ class PlottingControls:
             log.info("New histogram for %r", xlabel)
 
             vals = self.table.numbers_for_plotting(xlabel)[0]
-            if not vals:
+            if len(vals) == 0:
                 QMessageBox.warning(
                     self._main_window,
                     "Plotting failed",
@@ -727,7 +980,7 @@ class PlottingControls:
             log.info("New plot for x=%r, y=%r", xlabel, ylabel)
 
             xvals, yvals = self.table.numbers_for_plotting(xlabel, ylabel)
-            if not xvals:
+            if len(xvals) == 0:
                 QMessageBox.warning(
                     self._main_window,
                     "Plotting failed",
@@ -748,32 +1001,18 @@ class PlottingControls:
 
         canvas.show()
 
-    def update(self):
+    def update(self, column_titles=None):
+        """Redraw summary plots, or only those showing any of column_titles"""
         for plot_window in self._plot_windows:
-            plot_window.update()
-
-    def get_run_series_data(self, proposal, run, xlabel, ylabel=None):
-        variables = RunVariables(self._main_window._context_path.parent, run)
-        # file_name, dataset = self._main_window.get_run_file(proposal, run)
-
-        x_quantity = self._main_window.col_title_to_name(xlabel)
-        x_variable = variables[x_quantity]
-        x = x_variable.read()
-
-        if ylabel is None:
-            # Get 1 column for histogram
-            return True, x, None
-
-        y_quantity = self._main_window.col_title_to_name(ylabel)
-        y_variable = variables[y_quantity]
-        y = y_variable.read()
-
-        strongly_correlated = False
-        if isinstance(x, xr.DataArray) and "trainId" in x.coords and \
-           isinstance(y, xr.DataArray) and "trainId" in y.coords:
-            tids = np.intersect1d(x.trainId, y.trainId)
-            x = x.sel(trainId=tids)
-            y = y.sel(trainId=tids)
-            strongly_correlated = True
-
-        return strongly_correlated, x, y
+            if (column_titles is None or
+                    {plot_window.xlabel, plot_window.ylabel} & column_titles):
+                plot_window.update()
+
+    def schedule_update(self, column_titles):
+        self._columns_to_update.update(column_titles)
+        if not self._update_timer.isActive():
+            self._update_timer.start()
+
+    def _run_scheduled_update(self):
+        column_titles, self._columns_to_update = self._columns_to_update, set()
+        self.update(column_titles)
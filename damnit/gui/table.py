@@ -1,16 +1,20 @@
 import json
 import logging
+import re
+import sqlite3
+import threading
 import time
 from base64 import b64encode
 from itertools import groupby
 
+import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QMessageBox
 
-from ..backend.db import BlobTypes, DamnitDB, ReducedData
+from ..backend.db import BlobTypes, DamnitDB, JobStatus, ReducedData
 from ..backend.user_variables import value_types_by_name
-from ..util import StatusbarStylesheet, delete_variable, timestamp2str
+from ..util import LRUCache, StatusbarStylesheet, delete_variable_files, timestamp2str
 
 log = logging.getLogger(__name__)
 
@@ -18,9 +22,33 @@ ROW_HEIGHT = 30
 THUMBNAIL_SIZE = 35
 COMMENT_ID_ROLE = Qt.ItemDataRole.UserRole + 1
 
+class VariableFilesCleanerSignals(QtCore.QObject):
+    progress = QtCore.pyqtSignal(str, int, int)  # name, files done, total
+    finished = QtCore.pyqtSignal(str, list)  # name, files not cleaned
+
+
+class VariableFilesCleaner(QtCore.QRunnable):
+    """Remove a deleted variable from the HDF5 files in a QThreadPool"""
+    def __init__(self, db_dir, name, stop: threading.Event):
+        super().__init__()
+        self.db_dir = db_dir
+        self.name = name
+        self.stop = stop
+        # QRunnable isn't a QObject, so the signals live on a separate object
+        self.signals = VariableFilesCleanerSignals()
+
+    def run(self):
+        not_cleaned = delete_variable_files(
+            self.db_dir, self.name, stop=self.stop,
+            progress=lambda done, total: self.signals.progress.emit(self.name, done, total),
+        )
+        self.signals.finished.emit(self.name, not_cleaned)
+
+
 class TableView(QtWidgets.QTableView):
     settings_changed = QtCore.pyqtSignal()
     log_view_requested = QtCore.pyqtSignal(int, int)  # proposal, run
+    status_message = QtCore.pyqtSignal(str, int, str)  # message, timeout, style
 
     def __init__(self) -> None:
         super().__init__()
@@ -63,6 +91,11 @@ class TableView(QtWidgets.QTableView):
         self.process_action = QtWidgets.QAction('Reprocess runs')
         self.context_menu.addAction(self.process_action)
 
+        # Deleted variables are removed from the HDF5 files one at a time
+        self._cleanup_pool = QtCore.QThreadPool(self)
+        self._cleanup_pool.setMaxThreadCount(1)
+        self._cleanup_stop = threading.Event()
+
     def setModel(self, model: 'DamnitTableModel'):
         """
         Overload of setModel() to make sure that we restyle the comment rows
@@ -74,22 +107,26 @@ class TableView(QtWidgets.QTableView):
             old_model.deleteLater()
 
         self.damnit_model = model
-        sfpm = QtCore.QSortFilterProxyModel(self)
-        sfpm.setSourceModel(model)
-        sfpm.setSortRole(Qt.ItemDataRole.UserRole)  # Numeric sort where relevant
-        super().setModel(sfpm)
+        proxy = RunTableProxyModel(self)
+        proxy.setSourceModel(model)
+        super().setModel(proxy)
         # When loading a new model, the saved column order is applied at the
         # model level (changing column logical indices). So we need to reset
         # any reordering from the view level, which maps logical indices to
         # different visual indices, to show the columns as in the model.
         self.setHorizontalHeader(QtWidgets.QHeaderView(Qt.Horizontal, self))
-        self.horizontalHeader().sortIndicatorChanged.connect(self.style_comment_rows)
         self.horizontalHeader().setSectionsClickable(True)
+        self.clearSpans()
+        self._comment_span_rows = set()
         if model is not None:
+            proxy.layoutChanged.connect(self.style_comment_rows)
+            proxy.modelReset.connect(self.restyle_comment_rows)
             self.model().rowsInserted.connect(self.style_comment_rows)
             self.model().rowsInserted.connect(self.resize_new_rows)
             self.model().columnsInserted.connect(self.on_columns_inserted)
-            self.model().columnsRemoved.connect(self.on_columns_removed)
+            # The proxy model removes columns before the source model updates
+            # its column lists, so listen to the source model for this.
+            model.columnsRemoved.connect(self.on_columns_removed)
             self.resizeRowsToContents()
 
     def selected_rows(self):
@@ -166,9 +203,44 @@ class TableView(QtWidgets.QTableView):
                                      QMessageBox.Yes | QMessageBox.No,
                                      defaultButton=QMessageBox.No)
         if button == QMessageBox.Yes:
+            # The database change is quick, and removes the column for
+            # anything reading it. Cleaning the files can take a while.
             model = self.damnit_model
-            delete_variable(model.db, name)
+            model.db.delete_variable(name)
             model.removeColumn(model.find_column(name, by_title=False))
+            self.clean_variable_files(model.db.path.parent, name)
+
+    def clean_variable_files(self, db_dir, name):
+        cleaner = VariableFilesCleaner(db_dir, name, self._cleanup_stop)
+        cleaner.signals.progress.connect(self._cleanup_progress)
+        cleaner.signals.finished.connect(self._cleanup_finished)
+        self._cleanup_pool.start(cleaner)
+
+    def _cleanup_progress(self, name, done, total):
+        self.status_message.emit(
+            f"Removing '{name}' from HDF5 files: {done}/{total}", 0, ""
+        )
+
+    def _cleanup_finished(self, name, not_cleaned):
+        if not_cleaned:
+            log.warning("Could not remove %r from %d files: %s",
+                        name, len(not_cleaned), not_cleaned)
+            self.status_message.emit(
+                f"Could not remove '{name}' from {len(not_cleaned)} HDF5 files, "
+                "see the terminal for details", 15_000, StatusbarStylesheet.ERROR.value
+            )
+        else:
+            self.status_message.emit(f"Removed '{name}' from HDF5 files", 5000, "")
+
+    def stop_cleanup(self):
+        """Stop cleaning up files for deleted variables, e.g. when closing"""
+        self._cleanup_stop.set()
+        self._cleanup_pool.waitForDone()
+
+    def wait_for_cleanup(self, msecs=-1):
+        """Block until deleted variables are removed from files (mainly for testing)"""
+        self._cleanup_pool.waitForDone(msecs)
+        QtCore.QCoreApplication.sendPostedEvents()
 
     def add_new_columns(self, columns, statuses, positions = None):
         if positions is None:
@@ -231,16 +303,29 @@ class TableView(QtWidgets.QTableView):
         return column_states
 
     def style_comment_rows(self, *_):
-        self.clearSpans()
+        """Span standalone comment rows across the table
+
+        Only rows where a comment row has appeared or disappeared since the
+        last call are changed.
+        """
         model : DamnitTableModel = self.damnit_model
         comment_col = model.find_column("Comment", by_title=True)
         timestamp_col = model.find_column("Timestamp", by_title=True)
 
-        proxy_mdl = self.model()
-        for row_ix in model.standalone_comment_rows():
-            ix = proxy_mdl.mapFromSource(self.damnit_model.createIndex(row_ix, 0))
-            self.setSpan(ix.row(), 0, 1, timestamp_col)
-            self.setSpan(ix.row(), comment_col, 1, 1000)
+        rows = set(self.model().proxy_rows(model.standalone_comment_rows()).tolist())
+        for row in self._comment_span_rows - rows:
+            # A 1x1 span removes the span
+            self.setSpan(row, 0, 1, 1)
+            self.setSpan(row, comment_col, 1, 1)
+        for row in rows - self._comment_span_rows:
+            self.setSpan(row, 0, 1, timestamp_col)
+            self.setSpan(row, comment_col, 1, 1000)
+        self._comment_span_rows = rows
+
+    def restyle_comment_rows(self):
+        self.clearSpans()
+        self._comment_span_rows = set()
+        self.style_comment_rows()
 
     def resize_new_rows(self, parent, first, last):
         for row in range(first, last + 1):
@@ -275,19 +360,477 @@ class TableView(QtWidgets.QTableView):
         self.log_view_requested.emit(prop, run)
 
 
-class DamnitTableModel(QtGui.QStandardItemModel):
+def decode_thumbnail(data: bytes) -> QtGui.QImage:
+    """Decode PNG data & shrink it to thumbnail size
+
+    This makes a QImage rather than a QPixmap so it can run in a worker thread.
+    """
+    image = QtGui.QImage.fromData(data, "PNG")
+    if max(image.height(), image.width()) > THUMBNAIL_SIZE:
+        image = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio)
+    return image
+
+
+class ThumbnailSignals(QtCore.QObject):
+    decoded = QtCore.pyqtSignal(object, QtGui.QImage)
+
+
+class ThumbnailDecoder(QtCore.QRunnable):
+    """Decode one thumbnail in a QThreadPool"""
+    def __init__(self, key, data: bytes):
+        super().__init__()
+        self.key = key
+        self.data = data
+        # QRunnable isn't a QObject, so the signal lives on a separate object
+        self.signals = ThumbnailSignals()
+
+    def run(self):
+        self.signals.decoded.emit(self.key, decode_thumbnail(self.data))
+
+
+def _grow(arr, size):
+    """Return arr or a copy with room for at least size elements"""
+    if size <= len(arr):
+        return arr
+    new = np.zeros(max(size, 2 * len(arr)), dtype=arr.dtype)
+    new[:len(arr)] = arr
+    return new
+
+
+class TableColumn:
+    """Values and formatting for one column of the table
+
+    Numbers are also kept in a NumPy array, with a mask of which rows hold
+    numbers, so they can be selected for plotting without a Python loop.
+    """
+    __slots__ = ('values', '_numbers', '_is_number', 'bold', 'background', 'version')
+
+    def __init__(self, n_rows):
+        self.version = 0  # Incremented when values change
+        self.values = [None] * n_rows
+        self._numbers = np.zeros(n_rows, dtype=np.float64)
+        self._is_number = np.zeros(n_rows, dtype=bool)
+        self.bold = set()  # Row numbers to show in bold
+        self.background = {}  # Row number: (r, g, b[, a])
+
+    @property
+    def numbers(self):
+        return self._numbers[:len(self.values)]
+
+    @property
+    def is_number(self):
+        return self._is_number[:len(self.values)]
+
+    def extend(self, n):
+        self.version += 1
+        self.values.extend([None] * n)
+        self._numbers = _grow(self._numbers, len(self.values))
+        self._is_number = _grow(self._is_number, len(self.values))
+
+    def set_value(self, row, value):
+        self.version += 1
+        self.values[row] = value
+        if isinstance(value, (int, float)):
+            self._numbers[row] = value
+            self._is_number[row] = True
+        else:
+            self._is_number[row] = False
+
+    def sort_order(self):
+        """Row numbers sorted by value: numbers, then strings, then the rest"""
+        n = len(self.values)
+        kind = np.full(n, 2, dtype=np.int8)
+        key = np.zeros(n, dtype=np.float64)
+        is_number = self.is_number
+        kind[is_number] = 0
+        key[is_number] = self.numbers[is_number]
+
+        str_rows = np.array(
+            [i for i, v in enumerate(self.values) if isinstance(v, str)], dtype=np.int64
+        )
+        if len(str_rows):
+            strings = np.array([self.values[i] for i in str_rows], dtype=object)
+            kind[str_rows] = 1
+            key[str_rows[np.argsort(strings, kind='stable')]] = np.arange(len(str_rows))
+
+        return np.lexsort((key, kind))
+
+    def sort_key(self, row):
+        """Key for one row, giving the same order as sort_order()
+
+        NaN sorts after other numbers, as in NumPy.
+        """
+        value = self.values[row]
+        if self._is_number[row]:
+            number = self._numbers[row]
+            return (0, bool(np.isnan(number)), 0. if np.isnan(number) else number)
+        elif isinstance(value, str):
+            return (1, False, value)
+        return (2, False, 0)
+
+    def set_format(self, row, bold=False, background=None):
+        if bold:
+            self.bold.add(row)
+        else:
+            self.bold.discard(row)
+        if background is not None:
+            self.background[row] = background
+        else:
+            self.background.pop(row, None)
+
+
+class NumberRangeFilter:
+    """Show rows with numbers between min & max (inclusive) in a column"""
+    def __init__(self, min=-np.inf, max=np.inf):
+        self.min = min
+        self.max = max
+
+    def mask(self, column: TableColumn):
+        numbers = column.numbers
+        return column.is_number & (numbers >= self.min) & (numbers <= self.max)
+
+
+class RegexFilter:
+    """Show rows with text matching a regular expression in a column"""
+    def __init__(self, pattern, flags=re.IGNORECASE):
+        self.regex = re.compile(pattern, flags)
+
+    def mask(self, column: TableColumn):
+        search = self.regex.search
+        return np.fromiter(
+            (isinstance(v, str) and search(v) is not None for v in column.values),
+            dtype=bool, count=len(column.values)
+        )
+
+
+class RunTableProxyModel(QtCore.QAbstractProxyModel):
+    """Sorts & filters rows of a DamnitTableModel
+
+    Sorting uses row orders computed & cached per column by the model, and
+    filters select rows with NumPy masks. This avoids comparing cells one pair
+    at a time, as QSortFilterProxyModel does. Columns are passed through
+    unchanged, and rows are only ever added to the source model.
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._sort_column = -1
+        self._sort_order = Qt.SortOrder.AscendingOrder
+        self._filters = {}  # Column ID: filter object
+        self._to_source = np.zeros(0, dtype=np.int64)
+        self._from_source = np.zeros(0, dtype=np.int64)
+
+    def setSourceModel(self, model: 'DamnitTableModel'):
+        self.beginResetModel()
+        super().setSourceModel(model)
+        if model is not None:
+            model.rowsInserted.connect(self._source_rows_inserted)
+            model.columnsAboutToBeInserted.connect(
+                lambda _, first, last: self.beginInsertColumns(QtCore.QModelIndex(), first, last)
+            )
+            model.columnsInserted.connect(self._source_columns_inserted)
+            model.columnsAboutToBeRemoved.connect(
+                lambda _, first, last: self.beginRemoveColumns(QtCore.QModelIndex(), first, last)
+            )
+            model.columnsRemoved.connect(self._source_columns_removed)
+            model.dataChanged.connect(self._source_data_changed)
+            model.headerDataChanged.connect(self._source_header_changed)
+            model.modelAboutToBeReset.connect(self.beginResetModel)
+            model.modelReset.connect(self._source_reset)
+        self._set_mapping(self._compute_order())
+        self.endResetModel()
+
+    # Mapping between proxy & source rows ------------------------------------
+
+    def _compute_order(self):
+        model = self.sourceModel()
+        if model is None:
+            return np.zeros(0, dtype=np.int64)
+        if 0 <= self._sort_column < model.columnCount():
+            order = model.sort_order(self._sort_column)
+            if self._sort_order == Qt.SortOrder.DescendingOrder:
+                order = order[::-1]
+        else:
+            order = np.arange(model.rowCount())
+
+        for column_id, column_filter in self._filters.items():
+            if model.has_column(column_id):
+                mask = model.filter_mask(column_id, column_filter)
+                order = order[mask[order]]
+        return order
+
+    def _set_mapping(self, order):
+        n_source = self.sourceModel().rowCount() if self.sourceModel() else 0
+        self._to_source = np.asarray(order, dtype=np.int64)
+        self._from_source = np.full(n_source, -1, dtype=np.int64)
+        self._from_source[self._to_source] = np.arange(len(self._to_source))
+
+    def _relayout(self):
+        """Re-apply sorting & filtering after the source data changed"""
+        order = self._compute_order()
+        if len(order) != len(self._to_source):
+            # Filtering shows different rows, so the row count changes
+            self.beginResetModel()
+            self._set_mapping(order)
+            self.endResetModel()
+        else:
+            self._change_layout(order)
+
+    def _change_layout(self, order):
+        """Show the same rows in a new order"""
+        if np.array_equal(order, self._to_source):
+            return
+        self.layoutAboutToBeChanged.emit([], self.VerticalSortHint)
+        persistent = self.persistentIndexList()
+        source_ixs = [self.mapToSource(ix) for ix in persistent]
+        self._set_mapping(order)
+        self.changePersistentIndexList(
+            persistent, [self.mapFromSource(ix) for ix in source_ixs]
+        )
+        self.layoutChanged.emit([], self.VerticalSortHint)
+
+    def _merge_rows(self, order, rows):
+        """Insert rows into a sorted order, by binary search on their sort keys
+
+        This avoids sorting all rows again when a few are added.
+        """
+        model = self.sourceModel()
+        col = self._sort_column
+        descending = self._sort_order == Qt.SortOrder.DescendingOrder
+        new = sorted(((model.sort_key(col, r), r) for r in rows), reverse=descending)
+
+        positions = []
+        for key, _ in new:
+            lo, hi = 0, len(order)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                mid_key = model.sort_key(col, int(order[mid]))
+                if (mid_key > key) if descending else (mid_key < key):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            positions.append(lo)
+
+        return np.insert(order, positions, [r for _, r in new])
+
+    def proxy_rows(self, source_rows):
+        """Map source row numbers to proxy rows, dropping filtered rows"""
+        rows = self._from_source[np.asarray(source_rows, dtype=np.int64)]
+        return rows[rows >= 0]
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid():
+            return QtCore.QModelIndex()
+        return self.sourceModel().index(
+            int(self._to_source[proxy_index.row()]), proxy_index.column()
+        )
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid():
+            return QtCore.QModelIndex()
+        row = self._from_source[source_index.row()]
+        if row < 0:
+            return QtCore.QModelIndex()
+        return self.index(int(row), source_index.column())
+
+    # Sorting & filtering -----------------------------------------------------
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+        self._relayout()
+
+    def set_column_filter(self, column_id, column_filter):
+        """Only show rows matching a filter in the given column
+
+        column_filter is e.g. a NumberRangeFilter or RegexFilter. Rows for
+        standalone comments stay visible unless the filter is on the comment
+        or timestamp columns.
+        """
+        self._filters[column_id] = column_filter
+        self._relayout()
+
+    def clear_column_filter(self, column_id=None):
+        """Remove the filter on one column, or all filters if column_id is None"""
+        if column_id is None:
+            self._filters.clear()
+        else:
+            self._filters.pop(column_id, None)
+        self._relayout()
+
+    # Model structure ---------------------------------------------------------
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self._to_source)):
+            return QtCore.QModelIndex()
+        if not (0 <= column < self.columnCount()):
+            return QtCore.QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, *args):
+        if not args:  # QObject.parent()
+            return super().parent()
+        return QtCore.QModelIndex()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._to_source)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        model = self.sourceModel()
+        return 0 if (parent.isValid() or model is None) else model.columnCount()
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Vertical:
+            if not (0 <= section < len(self._to_source)):
+                return None
+            section = int(self._to_source[section])
+        return self.sourceModel().headerData(section, orientation, role)
+
+    # Following changes in the source model -----------------------------------
+
+    def _source_rows_inserted(self, _parent, first, last):
+        # Add the new rows at the end, then move them into sorted position
+        n_before = len(self._to_source)
+        new_rows = np.arange(first, last + 1)
+        for column_id, column_filter in self._filters.items():
+            if self.sourceModel().has_column(column_id):
+                mask = self.sourceModel().filter_mask(column_id, column_filter)
+                new_rows = new_rows[mask[new_rows]]
+
+        self._from_source = np.concatenate(
+            [self._from_source, np.full(last + 1 - len(self._from_source), -1)]
+        )
+        if not len(new_rows):
+            return
+
+        old_order = self._to_source
+        self.beginInsertRows(QtCore.QModelIndex(), n_before, n_before + len(new_rows) - 1)
+        self._set_mapping(np.concatenate([old_order, new_rows]))
+        self.endInsertRows()
+        if 0 <= self._sort_column < self.sourceModel().columnCount():
+            self._change_layout(self._merge_rows(old_order, new_rows.tolist()))
+
+    def _source_columns_inserted(self, _parent, first, last):
+        if self._sort_column >= first:
+            self._sort_column += last - first + 1
+        self.endInsertColumns()
+
+    def _source_columns_removed(self, _parent, first, last):
+        if first <= self._sort_column <= last:
+            self._sort_column = -1
+        elif self._sort_column > last:
+            self._sort_column -= last - first + 1
+        self.endRemoveColumns()
+
+    def _source_data_changed(self, top_left, bottom_right, roles=()):
+        first_col, last_col = top_left.column(), bottom_right.column()
+        if not roles or Qt.ItemDataRole.DisplayRole in roles:
+            model = self.sourceModel()
+            affected = range(first_col, last_col + 1)
+            filtered_cols = {model.find_column(c) for c in self._filters
+                             if model.has_column(c)}
+            if self._sort_column in affected or filtered_cols.intersection(affected):
+                self._relayout()
+
+        rows = self.proxy_rows(np.arange(top_left.row(), bottom_right.row() + 1))
+        if len(rows):
+            self.dataChanged.emit(
+                self.index(int(rows.min()), first_col),
+                self.index(int(rows.max()), last_col),
+                roles
+            )
+
+    def _source_header_changed(self, orientation, first, last):
+        if orientation == Qt.Orientation.Horizontal:
+            self.headerDataChanged.emit(orientation, first, last)
+        elif len(self._to_source):
+            self.headerDataChanged.emit(orientation, 0, len(self._to_source) - 1)
+
+    def _source_reset(self):
+        self._set_mapping(self._compute_order())
+        self.endResetModel()
+
+
+def load_runs_page(conn, offset, limit):
+    """Read a page of runs from the database, newest first
+
+    Returns a list of (proposal, run, start_time, variables) tuples, where
+    variables is a list of (name, value, max_diff, attributes).
+    """
+    runs = conn.execute("""
+        SELECT proposal, run, start_time FROM run_info
+        ORDER BY proposal DESC, run DESC LIMIT ? OFFSET ?
+    """, (limit, offset)).fetchall()
+
+    variables = {(prop, run): [] for (prop, run, _) in runs}
+    for proposal, grp in groupby(runs, key=lambda r: r[0]):
+        run_nums = [r[1] for r in grp]
+        for prop, run, name, value, max_diff, attr_json in conn.execute("""
+            SELECT proposal, run, name, value, max_diff, attributes FROM run_variables
+            WHERE proposal=? AND run BETWEEN ? AND ?
+        """, (proposal, min(run_nums), max(run_nums))):
+            if (prop, run) in variables:
+                attrs = json.loads(attr_json) if attr_json else {}
+                variables[(prop, run)].append((name, value, max_diff, attrs))
+
+    return [(prop, run, ts, variables[(prop, run)]) for (prop, run, ts) in runs]
+
+
+class TableLoader(QtCore.QObject):
+    """Reads the remaining runs for the table in a background thread"""
+    runs_loaded = QtCore.pyqtSignal(list)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, db_path, offset, page_size):
+        super().__init__()
+        self.db_path = db_path
+        self.offset = offset
+        self.page_size = page_size
+        self.running = False
+
+    def load(self):
+        self.running = True
+        conn = sqlite3.connect(f"{self.db_path.as_uri()}?mode=ro", uri=True, timeout=30)
+        try:
+            while self.running:
+                page = load_runs_page(conn, self.offset, self.page_size)
+                if not page:
+                    break
+                self.offset += len(page)
+                self.runs_loaded.emit(page)
+        except Exception:
+            log.error("Error loading runs for the table", exc_info=True)
+        finally:
+            conn.close()
+            self.finished.emit()
+
+    def stop(self):
+        self.running = False
+
+
+class DamnitTableModel(QtCore.QAbstractTableModel):
     value_changed = QtCore.pyqtSignal(int, int, str, object)
     time_comment_changed = QtCore.pyqtSignal(int, str)
     run_visibility_changed = QtCore.pyqtSignal(int, bool)
-
-    def __init__(self, db: DamnitDB, column_settings: dict, parent):
+    load_progress = QtCore.pyqtSignal(int, int)  # runs loaded, total runs
+    load_finished = QtCore.pyqtSignal()
+    runs_updated = QtCore.pyqtSignal(set, bool)  # changed column IDs, new columns?
+
+    # Max. number of decoded thumbnails & image tooltips to keep in memory
+    thumbnail_cache_size = 1000
+    tooltip_cache_size = 20
+    # The newest runs are loaded before the table is shown, and the rest are
+    # read in pages by a background thread.
+    first_page_size = 200
+    page_size = 1000
+    # Time to collect updates from the backend before applying them (ms)
+    update_interval = 50
+    # Ignore pending/running job records older than this (seconds), in case
+    # the job died without updating them.
+    job_max_age = 6 * 3600
+
+    def __init__(self, db: DamnitDB, column_settings: dict, parent, load_in_background=True):
+        super().__init__(parent)
         self.column_ids, self.column_titles = self._load_columns(db, column_settings)
-        n_run_rows = db.conn.execute("SELECT count(*) FROM run_info").fetchone()[0]
-        n_cmnt_rows = db.conn.execute("SELECT count(*) FROM time_comments").fetchone()[0]
-        log.info(f"Table will have {n_run_rows} runs & {n_cmnt_rows} standalone comments")
-
-        super().__init__(n_run_rows + n_cmnt_rows, len(self.column_ids), parent)
-        self.setHorizontalHeaderLabels(self.column_titles)
         self._main_window = parent
         self.is_sorted_by = ""
         self.is_sorted_order = None
@@ -296,32 +839,64 @@ class DamnitTableModel(QtGui.QStandardItemModel):
         self.run_index = {}  # {(proposal, run): row}
         self.standalone_comment_index = {}
 
+        # The data is stored by column, and only converted to what Qt needs
+        # (text, fonts, pixmaps) in data(), i.e. for the cells being shown.
+        self._n_rows = 0
+        self._columns = {c: TableColumn(0) for c in self.column_ids}
+        self._sort_orders = {}  # Column ID: (column version, row order)
+        self._row_headers = []
+        self._comment_ids = []  # Standalone comment ID, or None for runs
+        self._visible = np.zeros(0, dtype=bool)  # Status checkbox (False for comments)
+        self._job_display = {}  # row: (text, tooltip, failed)
+        # Thumbnails are decoded in a thread pool when a cell is first shown.
+        # Both caches are keyed by (proposal, run, variable, hash of PNG data).
+        self._thumbnails = LRUCache(self.thumbnail_cache_size)
+        self._thumbnails_pending = set()
+        self._image_tooltips = LRUCache(self.tooltip_cache_size)
+        self._thumbnail_placeholder = QtGui.QPixmap(THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+        self._thumbnail_placeholder.fill(Qt.transparent)
+        self._decoder_pool = QtCore.QThreadPool(self)
+
         self._bold_font = QtGui.QFont()
         self._bold_font.setBold(True)
 
-        # Empty spaces are not editable by default
-        proto = QtGui.QStandardItem()
-        proto.setEditable(False)
-        self.setItemPrototype(proto)
-
         self.user_variables = db.get_user_variables()
         self.editable_columns = {"comment"} | {
             vv.name for vv in self.user_variables.values()
         }
-        for col_id in self.editable_columns:
-            col_ix = self.find_column(col_id)
-            for r in range(self.rowCount()):
-                # QStandardItem is editable by default
-                self.setItem(r, col_ix, QtGui.QStandardItem())
 
-        # Set up status column with checkboxes for runs
-        checkbox_proto = self.itemPrototype().clone()
-        checkbox_proto.setCheckable(True)
-        checkbox_proto.setCheckState(Qt.Checked)
-        for r in range(n_run_rows):
-            self.setItem(r, 0, checkbox_proto.clone())
-
-        self._load_from_db()
+        self._pending_updates = {}  # (proposal, run): (values, max_diffs, attrs)
+        self._update_timer = QtCore.QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(self.update_interval)
+        self._update_timer.timeout.connect(self.flush_updates)
+
+        self._loader = None
+        self._loader_thread = None
+        # Changes after this are applied by sync_changes(). Anything changed
+        # while loading may be applied again, which is harmless.
+        self.change_seq = db.last_change_seq()
+        self._n_runs_total = db.conn.execute("SELECT count(*) FROM run_info").fetchone()[0]
+        t0 = time.perf_counter()
+        self._load_comments()
+        self._add_loaded_runs(load_runs_page(
+            db.conn, 0, self.first_page_size if load_in_background else -1
+        ))
+        log.info(f"Loaded {len(self.run_index)} of {self._n_runs_total} runs & "
+                 f"{len(self.standalone_comment_index)} standalone comments "
+                 f"in {time.perf_counter() - t0:.3f} s")
+        if len(self.run_index) < self._n_runs_total:
+            self._start_loader()
+
+        # Show the state of extraction jobs in the status column. Jobs record
+        # their own progress in the database, so we just need to check it.
+        # The timer only runs while there are active jobs; a job_updated
+        # message restarts it.
+        self._job_states = {}
+        self._jobs_timer = QtCore.QTimer(self)
+        self._jobs_timer.setInterval(5000)
+        self._jobs_timer.timeout.connect(self.update_job_statuses)
+        self.update_job_statuses()
 
     @staticmethod
     def _load_columns(db: DamnitDB, col_settings):
@@ -364,97 +939,237 @@ class DamnitTableModel(QtGui.QStandardItemModel):
         log.info(f"Got columns in {t1 - t0:.3f} s")
         return sorted_cols, column_titles
 
-    def text_item(self, value, display=None):
-        if display is None:
-            if value is None:
-                display = ''
-            elif isinstance(value, float):
-                display = prettify_notation(value)
-            else:
-                display = str(value)
-        item = self.itemPrototype().clone()
-        # We will use UserRole data for sorting
-        item.setData(value, role=Qt.ItemDataRole.UserRole)
-        item.setData(display, role=Qt.ItemDataRole.DisplayRole)
-        return item
-
-    def image_item(self, png_data: bytes):
-        item = self.itemPrototype().clone()
-        item.setData(self.generateThumbnail(png_data), role=Qt.DecorationRole)
-        item.setToolTip(
-            f'<img src="data:image/png;base64,{b64encode(png_data).decode()}">'
-        )
-        return item
-
-    def comment_item(self, text, comment_id=None):
-        item = QtGui.QStandardItem(text)  # Editable by default
-        item.setToolTip(text)
-        if comment_id is not None:
-            # For standalone comments, integer ID
-            item.setData(comment_id, COMMENT_ID_ROLE)
-        return item
-
-    def new_item(self, value, column_id, max_diff, attrs):
-        if is_png_bytes(value):
-            return self.image_item(value)
-        elif column_id == 'comment':
-            return self.comment_item(value)
-        elif column_id == 'start_time':
-            return self.text_item(value, timestamp2str(value))
-        else:
-            item = self.text_item(value)
-            item.setEditable(column_id in self.editable_columns)
-            bold = attrs.get("bold")
-            if bold is None:
-                bold = (max_diff is not None) and max_diff > 1e-9
-            if bold:
-                item.setFont(self._bold_font)
-            if (bg := attrs.get('background')) is not None:
-                item.setBackground(QtGui.QBrush(QtGui.QColor(*bg)))
-            return item
-
-    def _load_from_db(self):
-        t0 = time.perf_counter()
-
-        row_headers = []
-        row_ix = -1
+    def _add_rows(self, n):
+        """Extend the storage by n empty rows, returning the first new index"""
+        first = self._n_rows
+        self._n_rows += n
+        for column in self._columns.values():
+            column.extend(n)
+        self._row_headers.extend([''] * n)
+        self._comment_ids.extend([None] * n)
+        self._visible = _grow(self._visible, self._n_rows)
+        return first
+
+    def _set_value(self, row, column_id, value, max_diff, attrs):
+        column = self._columns[column_id]
+        column.set_value(row, value)
+        if is_png_bytes(value) or column_id in ('comment', 'start_time'):
+            column.set_format(row)
+            return
 
-        for row_ix, (prop, run, ts) in enumerate(self.db.conn.execute("""
-            SELECT proposal, run, start_time FROM run_info ORDER BY proposal, run
-        """).fetchall()):
-            row_headers.append(str(run))
-            self.run_index[(prop, run)] = row_ix
-            self.setItem(row_ix, 1, self.text_item(prop))
-            self.setItem(row_ix, 2, self.text_item(run))
-            self.setItem(row_ix, 3, self.text_item(ts, timestamp2str(ts)))
+        column.set_format(row, bold=self._is_bold(max_diff, attrs),
+                          background=attrs.get('background'))
 
-        for (prop, run), grp in groupby(self.db.conn.execute("""
-            SELECT proposal, run, name, value, max_diff, attributes FROM run_variables
-            ORDER BY proposal, run
-        """).fetchall(), key=lambda r: r[:2]):  # Group by proposal & run
-            row_ix = self.run_index[(prop, run)]
-            for *_, name, value, max_diff, attr_json in grp:
-                col_ix = self.column_index[name]
-                if name in self.user_variables:
-                    value = self.user_variables[name].get_type_class().from_db_value(value)
-                attrs = json.loads(attr_json) if attr_json else {}
-                self.setItem(row_ix, col_ix, self.new_item(value, name, max_diff, attrs))
-
-        comments_start = row_ix + 1
-        comment_rows = self.db.conn.execute("""
+    @staticmethod
+    def _is_bold(max_diff, attrs):
+        bold = attrs.get("bold")
+        if bold is None:
+            bold = (max_diff is not None) and max_diff > 1e-9
+        return bold
+
+    def _load_comments(self):
+        rows = self.db.conn.execute("""
             SELECT rowid, timestamp, comment FROM time_comments
         """).fetchall()
-        for row_ix, (cid, ts, comment) in enumerate(comment_rows, start=comments_start):
-            self.setItem(row_ix, 3, self.text_item(ts, timestamp2str(ts)))
-            self.setItem(
-                row_ix, self.column_index["comment"], self.comment_item(comment, cid)
-            )
-            row_headers.append('')
+        first = self._add_rows(len(rows))
+        for row_ix, (cid, ts, comment) in enumerate(rows, start=first):
+            self._columns['start_time'].set_value(row_ix, ts)
+            self._columns['comment'].set_value(row_ix, comment)
+            self._comment_ids[row_ix] = cid
             self.standalone_comment_index[cid] = row_ix
 
-        self.setVerticalHeaderLabels(row_headers)
-        t1 = time.perf_counter()
-        log.info(f"Filled rows in {t1 - t0:.3f} s")
+    def _add_loaded_runs(self, runs):
+        """Add runs read by load_runs_page() to the table"""
+        new_runs = [r for r in runs if (r[0], r[1]) not in self.run_index]
+        # Runs we already have were added by live updates while loading, so
+        # their values may be newer than what we read. Only fill in blanks.
+        for prop, run, _, variables in runs:
+            if (row_ix := self.run_index.get((prop, run))) is not None:
+                self._fill_run_values(row_ix, variables)
+                self.dataChanged.emit(
+                    self.index(row_ix, 0), self.index(row_ix, self.columnCount() - 1)
+                )
+
+        if new_runs:
+            first = self._n_rows
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(new_runs) - 1)
+            self._add_rows(len(new_runs))
+            for row_ix, (prop, run, ts, variables) in enumerate(new_runs, start=first):
+                self._row_headers[row_ix] = str(run)
+                self._visible[row_ix] = True
+                self.run_index[(prop, run)] = row_ix
+                self._columns['proposal'].set_value(row_ix, prop)
+                self._columns['run'].set_value(row_ix, run)
+                self._columns['start_time'].set_value(row_ix, ts)
+                self._fill_run_values(row_ix, variables)
+            self.endInsertRows()
+
+        self.load_progress.emit(len(self.run_index), self._n_runs_total)
+
+    def _fill_run_values(self, row_ix, variables):
+        for name, value, max_diff, attrs in variables:
+            if name not in self._columns:
+                continue  # Variable added since the table was created
+            if self._columns[name].values[row_ix] is not None:
+                continue
+            if name in self.user_variables:
+                value = self.user_variables[name].get_type_class().from_db_value(value)
+            self._set_value(row_ix, name, value, max_diff, attrs)
+
+    def _start_loader(self):
+        self._loader = TableLoader(self.db.path, len(self.run_index), self.page_size)
+        self._loader_thread = QtCore.QThread()
+        self._loader.moveToThread(self._loader_thread)
+        self._loader_thread.started.connect(self._loader.load)
+        self._loader.runs_loaded.connect(self._add_loaded_runs)
+        self._loader.finished.connect(self._loader_finished)
+        self._loader_thread.start()
+
+    def _loader_finished(self):
+        self.stop_loading()
+        log.info("Finished loading %d runs", len(self.run_index))
+        self.load_finished.emit()
+
+    @property
+    def loading(self):
+        """True while runs are still being loaded in the background"""
+        return self._loader_thread is not None
+
+    def stop_loading(self):
+        if self._loader_thread is not None:
+            self._loader.stop()
+            self._loader_thread.quit()
+            self._loader_thread.wait()
+            self._loader_thread = self._loader = None
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self._n_rows
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.column_ids)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Horizontal:
+            return self.column_titles[section]
+        return self._row_headers[section]
+
+    def flags(self, index):
+        flags = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+        row, column_id = index.row(), self.column_ids[index.column()]
+        if self._comment_ids[row] is not None:
+            # Standalone comment row: only the comment itself can be changed
+            if column_id == 'comment':
+                flags |= Qt.ItemFlag.ItemIsEditable
+        elif column_id == 'Status':
+            flags |= Qt.ItemFlag.ItemIsUserCheckable
+        elif column_id in self.editable_columns:
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column_id = index.row(), self.column_ids[index.column()]
+
+        if column_id == 'Status':
+            return self._status_data(row, role)
+
+        column = self._columns[column_id]
+        value = column.values[row]
+
+        if role == Qt.ItemDataRole.DisplayRole or role == Qt.ItemDataRole.EditRole:
+            if value is None:
+                return ''
+            elif is_png_bytes(value):
+                return None
+            elif column_id == 'start_time':
+                return timestamp2str(value)
+            elif isinstance(value, float):
+                return prettify_notation(value)
+            return str(value)
+        elif role == Qt.ItemDataRole.UserRole:
+            # Used for sorting & getting values programmatically
+            return None if is_png_bytes(value) else value
+        elif role == Qt.ItemDataRole.DecorationRole:
+            if is_png_bytes(value):
+                return self.thumbnail(row, column_id, value)
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            if is_png_bytes(value):
+                return self.image_tooltip(row, column_id, value)
+            elif column_id == 'comment':
+                return value
+        elif role == Qt.ItemDataRole.FontRole:
+            if row in column.bold:
+                return self._bold_font
+        elif role == Qt.ItemDataRole.BackgroundRole:
+            if (bg := column.background.get(row)) is not None:
+                return QtGui.QBrush(QtGui.QColor(*bg))
+        elif role == COMMENT_ID_ROLE:
+            if column_id == 'comment':
+                return self._comment_ids[row]
+
+        return None
+
+    def _status_data(self, row, role):
+        if role == Qt.ItemDataRole.CheckStateRole:
+            if self._comment_ids[row] is None:
+                return Qt.Checked if self._visible[row] else Qt.Unchecked
+        elif (job := self._job_display.get(row)) is not None:
+            text, tooltip, failed = job
+            if role == Qt.ItemDataRole.DisplayRole:
+                return text
+            elif role == Qt.ItemDataRole.ToolTipRole:
+                return tooltip
+            elif role == Qt.ItemDataRole.ForegroundRole and failed:
+                return QtGui.QBrush(Qt.red)
+        return None
+
+    def _image_key(self, row, column_id, png_data):
+        proposal, run = self.row_to_proposal_run(row)
+        return proposal, run, column_id, hash(png_data)
+
+    def thumbnail(self, row, column_id, png_data: bytes) -> QtGui.QPixmap:
+        """Get the thumbnail for a cell
+
+        If it's not decoded yet, this starts decoding it in the background and
+        returns a blank placeholder. The cell is updated when it's ready.
+        """
+        key = self._image_key(row, column_id, png_data)
+        if (pixmap := self._thumbnails.get(key)) is not None:
+            return pixmap
+
+        if key not in self._thumbnails_pending:
+            self._thumbnails_pending.add(key)
+            decoder = ThumbnailDecoder(key, png_data)
+            decoder.signals.decoded.connect(self._thumbnail_decoded)
+            self._decoder_pool.start(decoder)
+        return self._thumbnail_placeholder
+
+    def _thumbnail_decoded(self, key, image):
+        self._thumbnails_pending.discard(key)
+        self._thumbnails[key] = QtGui.QPixmap.fromImage(image)
+
+        proposal, run, column_id, _ = key
+        row = self.run_index.get((proposal, run))
+        col = self.column_index.get(column_id)
+        if row is not None and col is not None:
+            ix = self.index(row, col)
+            self.dataChanged.emit(ix, ix, [Qt.ItemDataRole.DecorationRole])
+
+    def wait_for_thumbnails(self, msecs=-1):
+        """Block until queued thumbnails are decoded (mainly for testing)"""
+        self._decoder_pool.waitForDone(msecs)
+        QtCore.QCoreApplication.sendPostedEvents()
+
+    def image_tooltip(self, row, column_id, png_data: bytes) -> str:
+        """Get the HTML tooltip showing the full image for a cell"""
+        key = self._image_key(row, column_id, png_data)
+        if (html := self._image_tooltips.get(key)) is None:
+            html = f'<img src="data:image/png;base64,{b64encode(png_data).decode()}">'
+            self._image_tooltips[key] = html
+        return html
 
     def has_column(self, name, by_title=False):
         if by_title:
@@ -492,20 +1207,45 @@ class DamnitTableModel(QtGui.QStandardItemModel):
         return self.run_index[(proposal, run)]
 
     def row_to_proposal_run(self, row_ix):
-        prop_col, run_col = 1, 2
-        prop_it, run_it = self.item(row_ix, prop_col), self.item(row_ix, run_col)
-        if prop_it is None:
+        if self._comment_ids[row_ix] is not None:
             return None, None
-        return prop_it.data(Qt.UserRole), run_it.data(Qt.UserRole)
+        return (self._columns['proposal'].values[row_ix],
+                self._columns['run'].values[row_ix])
 
     def row_to_comment_id(self, row):
-        comment_col = 4
-        item = self.item(row, comment_col)
-        return item and item.data(COMMENT_ID_ROLE)
+        return self._comment_ids[row]
 
     def standalone_comment_rows(self):
         return sorted(self.standalone_comment_index.values())
 
+    def sort_order(self, col_ix):
+        """Row numbers ordered by the values in a column (ascending)
+
+        This is cached until values in the column change.
+        """
+        column_id = self.column_ids[col_ix]
+        column = self._columns[column_id]
+        version, order = self._sort_orders.get(column_id, (None, None))
+        if version != column.version:
+            order = column.sort_order()
+            self._sort_orders[column_id] = (column.version, order)
+        return order
+
+    def sort_key(self, col_ix, row):
+        """Key to place one row among those ordered by sort_order()
+
+        Ties are broken by row number, as in sort_order().
+        """
+        return (*self._columns[self.column_ids[col_ix]].sort_key(row), row)
+
+    def filter_mask(self, column_id, column_filter):
+        """Get a boolean array of rows matching a filter on one column"""
+        mask = column_filter.mask(self._columns[column_id])
+        if column_id not in ('comment', 'start_time'):
+            # Standalone comments have no other values, so don't hide them
+            mask |= np.array([c is not None for c in self._comment_ids], dtype=bool)
+        return mask
+
     def precreate_runs(self, n_runs: int):
         proposal = self.db.metameta["proposal"]
         start_run = max([r for (p, r) in self.run_index if p == proposal]) + 1
@@ -524,67 +1264,140 @@ class DamnitTableModel(QtGui.QStandardItemModel):
         else:
             assert len(column_ids) == len(titles)
 
+        self.beginInsertColumns(QtCore.QModelIndex(), before, before + len(column_ids) - 1)
         self.column_ids[before:before] = column_ids
         self.column_titles[before:before] = titles
         self.column_index = {c: i for (i, c) in enumerate(self.column_ids)}
+        for column_id in column_ids:
+            self._columns[column_id] = TableColumn(self._n_rows)
         if editable:
             self.editable_columns.update(column_ids)
-
-        self.insertColumns(before, len(column_ids))
-
-        for i, title in enumerate(titles, start=before):
-            self.setHorizontalHeaderItem(before, QtGui.QStandardItem(title))
+        self.endInsertColumns()
 
     def removeColumn(self, column: int, parent=QtCore.QModelIndex()):
-        del self.column_ids[column]
+        self.beginRemoveColumns(parent, column, column)
+        column_id = self.column_ids.pop(column)
         del self.column_titles[column]
+        del self._columns[column_id]
+        # A new column with the same ID mustn't reuse the cached order
+        self._sort_orders.pop(column_id, None)
+        self.editable_columns.discard(column_id)
         self.column_index = {c: i for (i, c) in enumerate(self.column_ids)}
-        super().removeColumn(column, parent)
+        self.endRemoveColumns()
+        return True
 
     def insert_run_row(self, proposal, run, contents: dict, max_diffs: dict, attrs: dict):
-        status_item = self.itemPrototype().clone()
-        status_item.setCheckable(True)
-        status_item.setCheckState(Qt.Checked)
-        row = [status_item, self.text_item(proposal), self.text_item(run)]
-
+        # We add new rows at the end, the RunTableProxyModel shows them in
+        # the correct position given the current sort.
+        row_ix = self._n_rows
+        self.beginInsertRows(QtCore.QModelIndex(), row_ix, row_ix)
+        self._add_rows(1)
+        self._row_headers[row_ix] = str(run)
+        self._visible[row_ix] = True
+        self._columns['proposal'].set_value(row_ix, proposal)
+        self._columns['run'].set_value(row_ix, run)
         for column_id in self.column_ids[3:]:
             if (value := contents.get(column_id, None)) is not None:
-                item = self.new_item(
-                    value, column_id, max_diffs.get(column_id) or 0, attrs.get(column_id) or {}
+                self._set_value(
+                    row_ix, column_id, value,
+                    max_diffs.get(column_id) or 0, attrs.get(column_id) or {}
                 )
-            elif column_id in self.editable_columns:
-                item = QtGui.QStandardItem()  # Editable by default
-            else:
-                item = None
-            row.append(item)
-        # We add new rows at the end, a QSortFilterProxyModel shows them in
-        # the correct position given the current sort.
-        self.run_index[(proposal, run)] = row_ix = self.rowCount()
-        self.appendRow(row)
-        self.setVerticalHeaderItem(row_ix, QtGui.QStandardItem(str(run)))
+        self.run_index[(proposal, run)] = row_ix
+        self.endInsertRows()
 
     def insert_comment_row(self, comment_id: int, comment: str, timestamp: float):
-        blank = self.itemPrototype().clone()
-        ts_item = self.text_item(timestamp, display=timestamp2str(timestamp))
-        row = [blank, blank, blank, ts_item, self.comment_item(comment, comment_id)]
-        self.standalone_comment_index[comment_id] = row_ix = self.rowCount()
-        self.appendRow(row)
-        self.setVerticalHeaderItem(row_ix, QtGui.QStandardItem(''))
-
-    def handle_run_values_changed(self, proposal, run, values: dict):
-        known_col_ids = set(self.column_ids)
-        new_col_ids = [c for c in values if c not in known_col_ids]
+        row_ix = self._n_rows
+        self.beginInsertRows(QtCore.QModelIndex(), row_ix, row_ix)
+        self._add_rows(1)
+        self._columns['start_time'].set_value(row_ix, timestamp)
+        self._columns['comment'].set_value(row_ix, comment)
+        self._comment_ids[row_ix] = comment_id
+        self.standalone_comment_index[comment_id] = row_ix
+        self.endInsertRows()
+
+    def handle_run_values_changed(self, proposal, run, values: dict,
+                                  max_diffs=None, attrs=None):
+        """Queue new values for a run to be shown in the table
+
+        Updates are collected for update_interval ms and then applied together,
+        so a burst of messages doesn't redraw the table for each one.
+        """
+        if max_diffs is None or attrs is None:
+            # Messages from older backends don't include these
+            max_diffs, attrs = self._formatting_from_db(proposal, run)
 
-        if new_col_ids:
-            log.info("New columns for table: %s", new_col_ids)
-            # TODO: retrieve titles for new columns
-            self.insert_columns(self.columnCount(), new_col_ids)
+        pending = self._pending_updates.setdefault((proposal, run), ({}, {}, {}))
+        for dest, src in zip(pending, (values, max_diffs, attrs)):
+            dest.update(src)
+        if not self._update_timer.isActive():
+            self._update_timer.start()
 
-        try:
-            row_ix = self.find_row(proposal, run)
-        except KeyError:
-            row_ix = None
+    def sync_changes(self):
+        """Apply changes recorded in the database since the last sync
+
+        This catches up on anything the live updates missed, e.g. while the
+        GUI was disconnected. Returns the number of changes found.
+        """
+        changes = self.db.changes_since(self.change_seq)
+        if not changes:
+            return 0
+        self.change_seq = changes[-1]['seq']
+
+        deleted_at = {c['name']: c['seq'] for c in changes if c['run'] is None}
+        for name in deleted_at:
+            if name in self.column_index:
+                self.removeColumn(self.column_index[name])
+
+        changed = {}  # (proposal, run): [names]
+        for c in changes:
+            if c['run'] is not None and c['seq'] > deleted_at.get(c['name'], 0):
+                changed.setdefault((c['proposal'], c['run']), []).append(c['name'])
+
+        for (proposal, run), names in changed.items():
+            row_ix = self.run_index.get((proposal, run))
+            values, max_diffs, attrs = {}, {}, {}
+            for name, value, max_diff, attr_json in self.db.conn.execute(f"""
+                SELECT name, value, max_diff, attributes FROM run_variables
+                WHERE proposal=? AND run=? AND name IN ({', '.join('?' * len(names))})
+            """, (proposal, run, *names)):
+                if name in self.user_variables:
+                    value = self.user_variables[name].get_type_class().from_db_value(value)
+                attr_d = json.loads(attr_json) if attr_json else {}
+                # Skip values the live updates have already delivered
+                if row_ix is not None and self._cell_matches(row_ix, name, value, max_diff, attr_d):
+                    continue
+                values[name] = value
+                max_diffs[name] = max_diff
+                attrs[name] = attr_d
+
+            if values and row_ix is None:
+                # A new run: fill in its start time, which isn't a variable
+                row = self.db.conn.execute(
+                    "SELECT start_time FROM run_info WHERE proposal=? AND run=?",
+                    (proposal, run)
+                ).fetchone()
+                if row is not None and row[0] is not None:
+                    values.setdefault('start_time', row[0])
+            if values:
+                self.handle_run_values_changed(proposal, run, values, max_diffs, attrs)
+
+        log.debug("Synced %d changes from the database", len(changes))
+        return len(changes)
+
+    def _cell_matches(self, row, column_id, value, max_diff, attrs):
+        """Check if a cell already shows a value, with the same formatting"""
+        if (column := self._columns.get(column_id)) is None:
+            return False
+        current = column.values[row]
+        if type(current) is not type(value) or current != value:
+            return False
+        if is_png_bytes(value) or column_id in ('comment', 'start_time'):
+            return True
+
+        return (self._is_bold(max_diff, attrs) == (row in column.bold)
+                and np.array_equal(column.background.get(row), attrs.get('background')))
 
+    def _formatting_from_db(self, proposal, run):
         max_diffs = {}
         attrs = {}
         for name, max_diff, attr_json in self.db.conn.execute("""
@@ -592,18 +1405,83 @@ class DamnitTableModel(QtGui.QStandardItemModel):
         """, (proposal, run)):
             max_diffs[name] = max_diff
             attrs[name] = json.loads(attr_json) if attr_json else {}
+        return max_diffs, attrs
+
+    def _titles_from_db(self, column_ids):
+        """Look up titles for column IDs, using the ID if there's no title"""
+        placeholders = ", ".join("?" * len(column_ids))
+        titles = dict(self.db.conn.execute(f"""
+            SELECT name, title FROM variables
+            WHERE name IN ({placeholders}) AND title NOT NULL
+        """, column_ids))
+        return [titles.get(c, c) for c in column_ids]
+
+    def flush_updates(self):
+        """Apply queued updates to the table now"""
+        self._update_timer.stop()
+        updates, self._pending_updates = self._pending_updates, {}
+        if not updates:
+            return
 
-        col_id_to_ix = {c: i for (i, c) in enumerate(self.column_ids)}
+        known_col_ids = set(self.column_ids)
+        new_col_ids = list(dict.fromkeys(
+            c for (values, _, _) in updates.values() for c in values
+            if c not in known_col_ids
+        ))
+        if new_col_ids:
+            log.info("New columns for table: %s", new_col_ids)
+            self.insert_columns(self.columnCount(),
+                                self._titles_from_db(new_col_ids), new_col_ids)
+
+        changed_cols = set()
+        changed_rows = []
+        for (proposal, run), (values, max_diffs, attrs) in updates.items():
+            changed_cols.update(values)
+            row_ix = self.run_index.get((proposal, run))
+            if row_ix is None:
+                self.insert_run_row(proposal, run, values, max_diffs, attrs)
+                continue
 
-        if row_ix is not None:
             log.debug("Update existing row %s for run %s", row_ix, run)
             for column_id, value in values.items():
-                col_ix = col_id_to_ix[column_id]
-                self.setItem(row_ix, col_ix, self.new_item(
-                    value, column_id, max_diffs.get(column_id) or 0, attrs.get(column_id) or {}
-                ))
+                self._set_value(
+                    row_ix, column_id, value,
+                    max_diffs.get(column_id) or 0, attrs.get(column_id) or {}
+                )
+            changed_rows.append(row_ix)
+
+        if changed_rows:
+            self.dataChanged.emit(
+                self.index(min(changed_rows), 0),
+                self.index(max(changed_rows), self.columnCount() - 1)
+            )
+        self.runs_updated.emit(changed_cols, bool(new_col_ids))
+
+    def update_job_statuses(self):
+        for job in self.db.latest_jobs():
+            key = (job["proposal"], job["run"])
+            state = (job["job_id"], job["status"], job["runtime"])
+            if key not in self.run_index or self._job_states.get(key) == state:
+                continue
+            self._job_states[key] = state
+
+            tooltip = f"Slurm job {job['job_id']} ({job['cluster']}): {job['status']}"
+            if job["runtime"] is not None:
+                tooltip += f"\nRuntime: {job['runtime']:.0f} s"
+            if job["peak_mem"] is not None:
+                tooltip += f"\nPeak memory: {job['peak_mem'] / 1e9:.2f} GB"
+            row = self.run_index[key]
+            self._job_display[row] = (
+                job["status"], tooltip, job["status"] == JobStatus.failed.value
+            )
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 0))
+
+        # Keep checking only while some jobs may still change
+        if self.db.runs_with_active_jobs(self.job_max_age):
+            if not self._jobs_timer.isActive():
+                self._jobs_timer.start()
         else:
-            self.insert_run_row(proposal, run, values, max_diffs, attrs)
+            self._jobs_timer.stop()
 
     def handle_variable_set(self, var_info: dict):
         col_id = var_info['name']
@@ -625,7 +1503,7 @@ class DamnitTableModel(QtGui.QStandardItemModel):
             old_title = self.column_title(col_ix)
             if title != old_title:
                 self.column_titles[col_ix] = title
-                self.setHorizontalHeaderItem(col_ix, QtGui.QStandardItem(title))
+                self.headerDataChanged.emit(Qt.Orientation.Horizontal, col_ix, col_ix)
 
     def add_editable_column(self, name):
         if name == "Status":
@@ -637,52 +1515,39 @@ class DamnitTableModel(QtGui.QStandardItemModel):
             return
         self.editable_columns.remove(name)
 
-    @staticmethod
-    def generateThumbnail(data: bytes) -> QtGui.QPixmap:
-        """
-        Helper function to generate a thumbnail from PNG data.
-        """
-        pixmap = QtGui.QPixmap()
-        pixmap.loadFromData(data, "PNG")
-        if max(pixmap.height(), pixmap.width()) > THUMBNAIL_SIZE:
-            pixmap = pixmap.scaled(
-                THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio
-            )
-        return pixmap
-
     def numbers_for_plotting(self, *cols, by_title=True):
-        col_ixs = [self.find_column(c, by_title) for c in cols]
-        res = [[]  for _ in cols]
-        for r in range(self.rowCount()):
-            status_item = self.item(r, 0)
-            if status_item is None or status_item.checkState() != Qt.Checked:
-                continue
-
-            vals = [self.get_value_at_rc(r, ci) for ci in col_ixs]
-            if all(isinstance(val, (int, float)) for val in vals):
-                for res_list, val in zip(res, vals):
-                    res_list.append(val)
+        """Get numbers from the given columns as float arrays
 
-        return res
+        Only runs which are checked in the status column and have numbers in
+        all the requested columns are included.
+        """
+        columns = [self._columns[self.column_id(self.find_column(c, by_title))]
+                   for c in cols]
+        mask = self._visible[:self._n_rows].copy()
+        for column in columns:
+            mask &= column.is_number
+        return [column.numbers[mask] for column in columns]
 
     def get_value_at(self, index):
         """Get the value for programmatic use, not for display"""
-        return self.itemFromIndex(index).data(Qt.UserRole)
+        return self.get_value_at_rc(index.row(), index.column())
 
     def get_value_at_rc(self, row, col):
-        item = self.item(row, col)
-        return item.data(Qt.UserRole) if item is not None else None
+        column_id = self.column_ids[col]
+        if column_id == 'Status':
+            return None
+        value = self._columns[column_id].values[row]
+        return None if is_png_bytes(value) else value
 
     def setData(self, index, value, role=None) -> bool:
         if not index.isValid():
             return False
 
+        row = index.row()
         if role == Qt.ItemDataRole.DisplayRole or role == Qt.ItemDataRole.EditRole:
             # A cell was edited in the table
             changed_column = self.column_id(index.column())
             if changed_column == "comment":
-                if not super().setData(index, value, role):
-                    return False
                 parsed = value
             else:
                 variable_type_class = self.user_variables[changed_column].get_type_class()
@@ -696,39 +1561,30 @@ class DamnitTableModel(QtGui.QStandardItemModel):
                         stylesheet=StatusbarStylesheet.ERROR
                     )
                     return False
-                else:
-                    if not super().setData(index, parsed, Qt.ItemDataRole.UserRole):
-                        return False
-
-                    if parsed is None:
-                        display = ''
-                    elif isinstance(parsed, float):
-                        display = prettify_notation(value)
-                    else:
-                        display = str(parsed)
-                    if not super().setData(index, display, role):
-                        return False
+
+            self._columns[changed_column].set_value(row, parsed)
+            self.dataChanged.emit(index, index)
 
             # Send appropriate signals if we edited a standalone comment or an
             # editable column.
-            if comment_id := self.row_to_comment_id(index.row()):
+            if comment_id := self.row_to_comment_id(row):
                 self.time_comment_changed.emit(comment_id, value)
             else:
-                prop, run = self.row_to_proposal_run(index.row())
+                prop, run = self.row_to_proposal_run(row)
                 self.value_changed.emit(int(prop), int(run), changed_column, parsed)
 
             return True
 
         elif role == Qt.ItemDataRole.CheckStateRole:
-            if not super().setData(index, value, role):
+            if self._comment_ids[row] is not None:
                 return False
-            # CHeckboxes are only on the status column
-            self.run_visibility_changed.emit(
-                index.row(), (value == Qt.CheckState.Checked)
-            )
+            # Checkboxes are only on the status column
+            visible = self._visible[row] = (value == Qt.CheckState.Checked)
+            self.dataChanged.emit(index, index)
+            self.run_visibility_changed.emit(row, visible)
             return True
 
-        return super().setData(index, value, role)
+        return False
 
     def dataframe_for_export(self, column_titles, rows=None, drop_image_cols=False):
         """Create a cleaned-up dataframe to be saved as a spreadsheet"""
@@ -739,16 +1595,17 @@ class DamnitTableModel(QtGui.QStandardItemModel):
         if rows is None:
             rows = range(self.rowCount())
 
+        def raw_values(col_ix):
+            column_id = self.column_ids[col_ix]
+            if column_id == 'Status':
+                return [None] * self._n_rows
+            return self._columns[column_id].values
+
         if drop_image_cols:
-            filtered_ixs = []
-            for col_ix in column_ixs:
-                for row_ix in range(self.rowCount()):
-                    item = self.item(row_ix, col_ix)
-                    if item and is_png_bytes(item.data(Qt.UserRole)):
-                        break
-                else:
-                    filtered_ixs.append(col_ix)
-            column_ixs = filtered_ixs
+            column_ixs = [
+                col_ix for col_ix in column_ixs
+                if not any(is_png_bytes(v) for v in raw_values(col_ix))
+            ]
 
         # Put the dtype options in an order so we can promote columns to more
         # general types based on their values.
@@ -763,17 +1620,16 @@ class DamnitTableModel(QtGui.QStandardItemModel):
 
         cols_dict = {}
         for col_ix in column_ixs:
+            col_values = raw_values(col_ix)
             values = []
             col_type_ix = 0
             for row_ix in rows:
-                item = self.item(row_ix, col_ix)
+                val = col_values[row_ix]
                 if self.column_ids[col_ix] == 'start_time':
                     # Include timestamp as string
-                    val = item and item.data(Qt.DisplayRole)
-                else:
-                    val = item and item.data(Qt.UserRole)
-                    if val is None and item and item.data(Qt.DecorationRole):
-                        val = "<image>"
+                    val = timestamp2str(val)
+                elif is_png_bytes(val):
+                    val = "<image>"
 
                 values.append(val)
                 for i, pytype in enumerate(value_types):
@@ -1,15 +1,137 @@
-from collections import defaultdict
+import pickle
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from functools import partial
+from pathlib import Path
 
 import h5py
 import numpy as np
 import xarray as xr
 
-from .backend.db import DamnitDB, DB_NAME
-from .backend.extract_data import add_to_db, ReducedData
+from .backend.db import BlobTypes, DamnitDB, DB_NAME
+from .backend.extract_data import ReducedData
 from .ctxsupport.ctxrunner import generate_thumbnail, add_to_h5_file, DataType
 
+JOURNAL_NAME = "migration_journal.sqlite"
 
-def migrate_images(new_db, db_dir, dry_run):
+
+class MigrationJournal:
+    """Records which files each step of a migration has finished
+
+    The result from each file is saved too, so if a migration is interrupted,
+    running it again skips the files already done but can still use their
+    results. The journal is deleted when the migration is complete.
+    """
+    def __init__(self, db_dir):
+        self.path = Path(db_dir, JOURNAL_NAME)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS done(step, file, result, PRIMARY KEY (step, file))"
+        )
+
+    def completed(self, step) -> dict:
+        """Get {file name: result} for the files done in one step"""
+        return {file: pickle.loads(result) for file, result in self.conn.execute(
+            "SELECT file, result FROM done WHERE step=?", (step,)
+        )}
+
+    def record(self, step, file_name, result):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO done VALUES (?, ?, ?)",
+                              (step, file_name, pickle.dumps(result)))
+
+    def finish(self):
+        self.conn.close()
+        self.path.unlink()
+
+
+def _map_files(func, paths, workers):
+    """Yield (path, func(path)) for each file as it's done, in any order"""
+    if workers == 1:
+        for path in paths:
+            yield path, func(path)
+        return
+
+    pool = ProcessPoolExecutor(workers)
+    try:
+        futures = {pool.submit(func, path): path for path in paths}
+        for fut in as_completed(futures):
+            yield futures[fut], fut.result()
+    finally:
+        # If a file failed, don't start on the rest
+        pool.shutdown(cancel_futures=True)
+
+
+def run_file_step(step, func, files, journal=None, workers=None):
+    """Call func(path) for each HDF5 file in a pool of processes
+
+    Files which the journal has recorded as done for this step are skipped.
+    *workers* is the number of processes (default: number of CPUs), or 1 to
+    process files one by one in this process.
+
+    Returns {path: result} for all the files, including the skipped ones.
+    """
+    files = sorted(files)
+    done = journal.completed(step) if journal is not None else {}
+    results = {p: done[p.name] for p in files if p.name in done}
+    todo = [p for p in files if p.name not in done]
+    if results:
+        print(f"{step}: resuming, {len(results)} of {len(files)} files were already done")
+
+    t0 = time.perf_counter()
+    n_bytes = 0
+    for i, (path, result) in enumerate(_map_files(func, todo, workers), start=1):
+        results[path] = result
+        if journal is not None:
+            journal.record(step, path.name, result)
+
+        n_bytes += path.stat().st_size
+        if i % 100 == 0 or i == len(todo):
+            elapsed = max(time.perf_counter() - t0, 1e-6)
+            print(f"{step}: {i}/{len(todo)} files in {elapsed:.1f} s "
+                  f"({i / elapsed:.1f} files/s, {n_bytes / elapsed / 1e6:.1f} MB/s)")
+
+    return results
+
+
+def _run_from_path(h5_path):
+    return int(h5_path.stem.split("_")[1][1:])
+
+
+def _thumbnails_in_file(h5_path, dry_run):
+    """Convert the image summaries in one file to PNG thumbnails
+
+    Returns {name: PNG data}. Summaries which are already PNGs are included,
+    in case a migration was interrupted after changing the file.
+    """
+    thumbnails = {}
+    with add_to_h5_file(h5_path) as f:
+        if ".reduced" not in f:
+            return thumbnails
+
+        reduced = f[".reduced"]
+        for ds_name, dset in list(reduced.items()):
+            if dset.ndim == 2 or (dset.ndim == 3 and dset.shape[2] == 4):
+                # Generate a new thumbnail
+                png_data = generate_thumbnail(dset[()]).data
+                thumbnails[ds_name] = png_data
+
+                if not dry_run:
+                    # Overwrite the dataset
+                    del reduced[ds_name]
+                    reduced.create_dataset(
+                        ds_name, data=np.frombuffer(png_data, dtype=np.uint8)
+                    )
+            elif dset.ndim == 1 and dset.dtype == np.uint8 and \
+                    BlobTypes.identify(dset[:8].tobytes()) is BlobTypes.png:
+                thumbnails[ds_name] = dset[()].tobytes()
+
+    return thumbnails
+
+
+def migrate_images(new_db, db_dir, dry_run, journal=None, workers=None):
     """
     Image thumbnails were previously generated by the GUI, now they're generated
     by the backend. This function will convert old image summaries (2D arrays) into
@@ -22,41 +144,43 @@ def migrate_images(new_db, db_dir, dry_run):
     if proposal is None:
         raise RuntimeError("Database must have a proposal configured for it to be migrated.")
 
-    reduced_data = defaultdict(dict)
     files = list((db_dir / "extracted_data").glob("*.h5"))
     n_files = len(files)
-    files_modified = set()
     suffix = "s" if n_files > 1 or n_files == 0 else ""
 
     print(f"Looking through {n_files} HDF5 file{suffix}...")
 
     # First we modify all of the image summaries in the HDF5 files
-    for h5_path in files:
-        with add_to_h5_file(h5_path) as f:
-            if ".reduced" in f:
-                reduced = f[".reduced"]
-                run = int(h5_path.stem.split("_")[1][1:])
-
-                for ds_name, dset in reduced.items():
-                    if dset.ndim == 2 or (dset.ndim == 3 and dset.shape[2] == 4):
-                        # Generate a new thumbnail
-                        image = reduced[ds_name][()]
-                        image = generate_thumbnail(image)
-                        reduced_data[run][ds_name] = ReducedData(image.data)
-                        files_modified.add(h5_path)
-
-                        if not dry_run:
-                            # Overwrite the dataset
-                            del reduced[ds_name]
-                            dset = reduced.create_dataset(
-                                ds_name, data=np.frombuffer(image.data, dtype=np.uint8)
-                            )
-
-    # And then update the summaries in the database
-    for run, run_reduced_data in reduced_data.items():
-        add_to_db(run_reduced_data, new_db, proposal, run)
-
-    info = f"updated {len(reduced_data)} variables in {len(files_modified)} files"
+    results = run_file_step(
+        "images", partial(_thumbnails_in_file, dry_run=dry_run), files, journal, workers
+    )
+
+    # And then update the summaries in the database. Summaries which were
+    # already PNGs are skipped if the database has the same thumbnail.
+    existing = {(run, name): value for run, name, value in new_db.conn.execute(
+        "SELECT run, name, value FROM run_variables WHERE proposal=?", (proposal,)
+    )}
+    results = {
+        p: {name: png_data for name, png_data in thumbnails.items()
+            if existing.get((_run_from_path(p), name)) != png_data}
+        for p, thumbnails in results.items()
+    }
+    added_at = datetime.now(tz=timezone.utc).timestamp()
+    runs = [_run_from_path(p) for p, thumbnails in results.items() if thumbnails]
+    with new_db.conn:
+        new_db.conn.executemany("""
+            INSERT INTO run_info (proposal, run, added_at) VALUES (?, ?, ?)
+            ON CONFLICT (proposal, run) DO NOTHING
+        """, [(proposal, run, added_at) for run in runs])
+    # No run_manifest rows are written: these runs predate the manifest, so
+    # readers list the variables from the files.
+    new_db.set_variables(
+        (proposal, _run_from_path(p), name, ReducedData(png_data))
+        for p, thumbnails in results.items() for name, png_data in thumbnails.items()
+    )
+
+    n_variables = sum(len(t) for t in results.values())
+    info = f"updated {n_variables} variables in {len(runs)} files"
     if dry_run:
         print(f"Dry run: would have {info}.")
     else:
@@ -84,49 +208,58 @@ def dataarray_from_group(group):
                                  if dim in coords } | scalar_coords)
 
 
-def migrate_dataarrays(db, db_dir, dry_run):
-    files = list((db_dir / "extracted_data").glob("*.h5"))
-    n_files = len(files)
-    suffix = "s" if n_files > 1 or n_files == 0 else ""
+def _dataarrays_in_file(h5_path, db_dir, dry_run):
+    """Convert the v0 arrays with coordinates in one file to DataArrays
 
+    Returns the number of groups converted.
+    """
     would = "(would) " if dry_run else ""
 
-    print(f"Looking through {n_files} HDF5 file{suffix}...")
+    groups_to_replace = []
+    with h5py.File(h5_path, "a") as f:
+        for name, grp in f.items():
+            if name == '.reduced':
+                continue
+
+            if isinstance(grp, h5py.Group) and 'data' in grp and len(grp) > 1:
+                dataarray = dataarray_from_group(grp)
+                if dataarray is None:
+                    raise RuntimeError(
+                        f"Error: could not convert v0 array for '{name}' to a DataArray automatically"
+                    )
+                groups_to_replace.append((name, dataarray))
+
+        for name, _ in groups_to_replace:
+            print(f"{would}Delete {name} in {h5_path.relative_to(db_dir)}")
+            if not dry_run:
+                f[name].clear()
+                f[name].attrs.clear()
+                f[name].attrs['_damnit_objtype'] = DataType.DataArray.value
 
-    files_modified = set()
-    total_groups = 0
-    for h5_path in files:
-        groups_to_replace = []
-        with h5py.File(h5_path, "a") as f:
-            for name, grp in f.items():
-                if name == '.reduced':
-                    continue
-
-                if isinstance(grp, h5py.Group) and 'data' in grp and len(grp) > 1:
-                    dataarray = dataarray_from_group(grp)
-                    if dataarray is None:
-                        raise RuntimeError(
-                            f"Error: could not convert v0 array for '{name}' to a DataArray automatically"
-                        )
-                    groups_to_replace.append((name, dataarray))
-
-            for name, _ in groups_to_replace:
-                print(f"{would}Delete {name} in {h5_path.relative_to(db_dir)}")
-                if not dry_run:
-                    f[name].clear()
-                    f[name].attrs.clear()
-                    f[name].attrs['_damnit_objtype'] = DataType.DataArray.value
+    for name, arr in groups_to_replace:
+        print(f"{would}Save {name} in {h5_path.relative_to(db_dir)}")
+        if not dry_run:
+            arr.to_netcdf(h5_path, mode="a", format="NETCDF4", group=name, engine="h5netcdf")
+
+    return len(groups_to_replace)
 
-        for name, arr in groups_to_replace:
-            print(f"{would}Save {name} in {h5_path.relative_to(db_dir)}")
-            if not dry_run:
-                arr.to_netcdf(h5_path, mode="a", format="NETCDF4", group=name, engine="h5netcdf")
 
-            files_modified.add(h5_path)
-            total_groups += 1
+def migrate_dataarrays(db, db_dir, dry_run, journal=None, workers=None):
+    files = list((db_dir / "extracted_data").glob("*.h5"))
+    n_files = len(files)
+    suffix = "s" if n_files > 1 or n_files == 0 else ""
+
+    print(f"Looking through {n_files} HDF5 file{suffix}...")
+
+    results = run_file_step(
+        "dataarrays", partial(_dataarrays_in_file, db_dir=db_dir, dry_run=dry_run),
+        files, journal, workers
+    )
+    total_groups = sum(results.values())
+    files_modified = sum(1 for n in results.values() if n)
 
     print(("(would have) " if dry_run else "") +
-          f"Modified {total_groups} groups in {len(files_modified)} files")
+          f"Modified {total_groups} groups in {files_modified} files")
     if dry_run:
         print("Dry run - no files were changed")
 
@@ -155,14 +288,47 @@ def copy_table(table, old_db, new_db):
     VALUES ({placeholder})
     """, rows)
 
-def migrate_v0_to_v1(db, db_dir, dry_run):
+def _max_diffs_in_file(h5_path, variable_names):
+    """Get the mtime & {name: max_diff} for the 1D arrays in one file
+
+    max_diff is also saved as an attribute on the datasets which lacked it.
+    """
+    mtime = h5_path.stat().st_mtime
+    max_diffs = {}
+    with h5py.File(h5_path, "a") as f:
+        for name in variable_names:
+            if name not in f:
+                continue
+
+            if (ds := main_dataset(f[name])) is None:
+                print(f"Couldn't identify main dataset for {name} in "
+                      f"{h5_path}, skipping max_diff")
+                continue
+
+            if 'max_diff' in ds.attrs:
+                max_diffs[name] = ds.attrs['max_diff'].item()
+            elif ds.ndim == 1 and ds.size > 0 and np.issubdtype(ds.dtype, np.number):
+                data = ds[()]
+                max_diff = abs(np.nanmax(data) - np.nanmin(data)).item()
+                max_diffs[name] = max_diff
+                ds.attrs['max_diff'] = max_diff
+
+    return mtime, max_diffs
+
+
+def migrate_v0_to_v1(db, db_dir, dry_run, workers=None):
     """
     For reference, see the V0_SCHEMA variable in db.py.
     In the v1 schema, the runs table was deleted and replaced with a view of
     the new run_variables table. The run_info table also needs to be created,
     but that can be done by executing the v1 schema.
+
+    The HDF5 files are processed in parallel by *workers* processes. Unless
+    this is a dry run, progress is saved in a journal, so running the
+    migration again after it's interrupted skips the files already done.
     """
-    migrate_dataarrays(db, db_dir, dry_run)
+    journal = None if dry_run else MigrationJournal(db_dir)
+    migrate_dataarrays(db, db_dir, dry_run, journal, workers)
 
     # Get all column and variable names
     column_names = [rec[0] for rec in
@@ -179,8 +345,7 @@ def migrate_v0_to_v1(db, db_dir, dry_run):
     print()
 
     # Scan HDF5 files to get timestamps (from mtime) & max diff for 1D arrays
-    timestamps = {}  # keys (proposal, run)
-    max_diffs = {}  # keys (proposal, run, variable)
+    h5_paths = {}  # keys (proposal, run)
     for record in runs:
         proposal = record["proposal"]
         run_no = record["runnr"]
@@ -189,26 +354,18 @@ def migrate_v0_to_v1(db, db_dir, dry_run):
         if not h5_path.exists():
             print(f"Skipping variables for run {run_no} because {h5_path} does not exist")
             continue
+        h5_paths[(proposal, run_no)] = h5_path
 
-        timestamps[(proposal, run_no)] = h5_path.stat().st_mtime
-
-        with h5py.File(h5_path, "a") as f:
-            for name in variable_names:
-                if name not in f:
-                    continue
-
-                if (ds := main_dataset(f[name])) is None:
-                    print(f"Couldn't identify main dataset for {name} in "
-                          f"{h5_path}, skipping max_diff")
-                    continue
-
-                if 'max_diff' in ds.attrs:
-                    max_diffs[(proposal, run_no, name)] = ds.attrs['max_diff'].item()
-                elif ds.ndim == 1 and ds.size > 0 and np.issubdtype(ds.dtype, np.number):
-                    data = ds[()]
-                    max_diff = abs(np.nanmax(data) - np.nanmin(data)).item()
-                    max_diffs[(proposal, run_no, name)] = max_diff
-                    ds.attrs['max_diff'] = max_diff
+    results = run_file_step(
+        "max_diff", partial(_max_diffs_in_file, variable_names=variable_names),
+        h5_paths.values(), journal, workers
+    )
+    timestamps = {}  # keys (proposal, run)
+    max_diffs = {}  # keys (proposal, run, variable)
+    for key, h5_path in h5_paths.items():
+        timestamps[key], file_max_diffs = results[h5_path]
+        for name, max_diff in file_max_diffs.items():
+            max_diffs[key + (name,)] = max_diff
 
     print(f"Found max difference for {len(max_diffs)} variables")
 
@@ -226,47 +383,42 @@ def migrate_v0_to_v1(db, db_dir, dry_run):
         copy_table(table, db, new_db)
 
     # Load the data into the new database
-    total_vars = 0
+    run_rows = [dict(zip(column_names, record)) for record in runs]
+    variable_rows = []
+    for record in runs:
+        proposal = record["proposal"]
+        run_no = record["runnr"]
+        for name in variable_names:
+            value = record[name]
+            if value is None:
+                continue
+
+            variable_rows.append({
+                "proposal": proposal,
+                "run": run_no,
+                "name": name,
+                "version": 1,
+                "value": value,
+                "timestamp": timestamps.get((proposal, run_no)),
+                "max_diff": max_diffs.get((proposal, run_no, name)),
+            })
+
     with new_db.conn:
-        for record in runs:
-            run = dict(zip(column_names, record))
-            proposal = run["proposal"]
-            run_no = run["runnr"]
-
-            # Add the run info to the `run_info` table
-            new_db.conn.execute("""
-                INSERT INTO run_info
-                VALUES (:proposal, :runnr, :start_time, :added_at)
-                """, run)
-
-            for name in variable_names:
-                value = record[name]
-                if value is None:
-                    continue
-
-                max_diff = max_diffs.get((proposal, run_no, name))
-                timestamp = timestamps.get((proposal, run_no))
-
-                variable = {
-                    "proposal": proposal,
-                    "run": run_no,
-                    "name": name,
-                    "version": 1,
-                    "value": value,
-                    "timestamp": timestamp,
-                    "max_diff": max_diff
-                }
-                new_db.conn.execute("""
-                    INSERT INTO run_variables (proposal, run, name, version, value, timestamp, max_diff)
-                    VALUES (:proposal, :run, :name, :version, :value, :timestamp, :max_diff)
-                    """, variable)
-                total_vars += 1
+        # Add the run info to the `run_info` table
+        new_db.conn.executemany("""
+            INSERT INTO run_info
+            VALUES (:proposal, :runnr, :start_time, :added_at)
+            """, run_rows)
+        new_db.conn.executemany("""
+            INSERT INTO run_variables (proposal, run, name, version, value, timestamp, max_diff)
+            VALUES (:proposal, :run, :name, :version, :value, :timestamp, :max_diff)
+            """, variable_rows)
 
         # And now that we're done, we need to recreate the `runs` view
         new_db.update_views()
 
     # Last step: migrate the images from the old format to the new format
-    migrate_images(new_db, db_dir, dry_run)
+    migrate_images(new_db, db_dir, dry_run, journal, workers)
 
     new_db.close()
     db.close()
@@ -279,10 +431,36 @@ def migrate_v0_to_v1(db, db_dir, dry_run):
         backup_path = db_dir / "runs.v0-backup.sqlite"
         db_path.rename(backup_path)
         new_db_path.rename(db_path)
+        journal.finish()
         print(f"New format DB created and moved to {db_path.name}")
         print(f"Old database backed up as {backup_path.name}")
 
-def migrate_intermediate_v1(db, db_dir, dry_run):
+def _convert_stored_types(h5_path, dry_run):
+    """Move `stored_type` attributes in one file to `_damnit_objtype`
+
+    Returns the number of datasets which had a `stored_type`.
+    """
+    n_converted = 0
+    with add_to_h5_file(h5_path) as f:
+        reduced = f[".reduced"]
+        for ds_name, dset in reduced.items():
+            if "stored_type" in dset.attrs:
+                stored_type = dset.attrs["stored_type"]
+                n_converted += 1
+
+                obj_type = None
+                if stored_type in ["DataArray", "Dataset", "image", "timestamp"]:
+                    obj_type = stored_type.lower()
+
+                if not dry_run:
+                    if obj_type is not None:
+                        f[ds_name].attrs["_damnit_objtype"] = obj_type
+                    del dset.attrs["stored_type"]
+
+    return n_converted
+
+
+def migrate_intermediate_v1(db, db_dir, dry_run, workers=None):
     """Migrate intermediate v1 (v0.5) databases.
 
     Before v1 rose over the world, resplendent and glorious, there was a humble
@@ -305,7 +483,12 @@ def migrate_intermediate_v1(db, db_dir, dry_run):
     - Re-do image migration to convert the thumbnails to PNGs
     - Move the `stored_type` attribute on `.reduced/<var>` datasets to a
       `_damnit_objtype` attribute on the `<var>` group.
+
+    Like migrate_v0_to_v1(), the HDF5 files are processed in parallel and the
+    migration can be resumed if it's interrupted.
     """
+    journal = None if dry_run else MigrationJournal(db_dir)
+
     # Create a new database, overwriting any previous attempts
     new_db_path = db_dir / "runs.v1.sqlite"
     new_db_path.unlink(missing_ok=True)
@@ -324,38 +507,25 @@ def migrate_intermediate_v1(db, db_dir, dry_run):
         SELECT proposal, run, name, version, value, timestamp, max_diff, provenance
         FROM run_variables
     """).fetchall()
-    for row in run_variables:
-        new_db.conn.execute("""
+    with new_db.conn:
+        new_db.conn.executemany("""
         INSERT INTO run_variables (proposal, run, name, version, value, timestamp, max_diff, provenance)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, row)
+        """, run_variables)
 
     new_db.update_views()
 
     # Convert the old `stored_type` attribute into `_damnit_objtype`
     runs = db.conn.execute("SELECT proposal, run FROM runs").fetchall()
-    for proposal, run_no in runs:
-        h5_path = db_dir / "extracted_data" / f"p{proposal}_r{run_no}.h5"
-        if not h5_path.is_file():
-            continue
-
-        with add_to_h5_file(h5_path) as f:
-            reduced = f[".reduced"]
-            for ds_name, dset in reduced.items():
-                if "stored_type" in dset.attrs:
-                    stored_type = dset.attrs["stored_type"]
-
-                    obj_type = None
-                    if stored_type in ["DataArray", "Dataset", "image", "timestamp"]:
-                        obj_type = stored_type.lower()
-
-                    if not dry_run:
-                        if obj_type is not None:
-                            f[ds_name].attrs["_damnit_objtype"] = obj_type
-                        del dset.attrs["stored_type"]
+    h5_paths = [db_dir / "extracted_data" / f"p{proposal}_r{run_no}.h5"
+                for proposal, run_no in runs]
+    run_file_step(
+        "stored_type", partial(_convert_stored_types, dry_run=dry_run),
+        [p for p in h5_paths if p.is_file()], journal, workers
+    )
 
     # Migrate images to use PNGs for thumbnails
-    migrate_images(new_db, db_dir, dry_run)
+    migrate_images(new_db, db_dir, dry_run, journal, workers)
 
     new_db.close()
     db.close()
@@ -368,5 +538,6 @@ def migrate_intermediate_v1(db, db_dir, dry_run):
         backup_path = db_dir / "runs.intermediate-v1-backup.sqlite"
         db_path.rename(backup_path)
         new_db_path.rename(db_path)
+        journal.finish()
         print(f"New format DB created and moved to {db_path.name}")
         print(f"Old database backed up as {backup_path.name}")
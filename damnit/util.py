@@ -1,19 +1,53 @@
 import glob
 import time
+from collections import OrderedDict
 from datetime import datetime, timezone
 from enum import Enum
 from pathlib import Path
 
+import h5py
 import numpy as np
 import pandas as pd
 from pandas.api.types import infer_dtype
-from .context import add_to_h5_file
 
 class StatusbarStylesheet(Enum):
     NORMAL = "QStatusBar {}"
     ERROR = "QStatusBar {background: red; color: white; font-weight: bold;}"
 
 
+class LRUCache:
+    """A mapping which drops the least recently used items past maxsize
+
+    Each item counts as 1 towards maxsize, unless a sizeof function is given
+    to measure items, e.g. in bytes.
+    """
+    def __init__(self, maxsize, sizeof=None):
+        self.maxsize = maxsize
+        self._sizeof = sizeof or (lambda _: 1)
+        self._data = OrderedDict()  # key: (value, size)
+        self.size = 0
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key][0]
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            self.size -= self._data.pop(key)[1]
+        size = self._sizeof(value)
+        self._data[key] = (value, size)
+        self.size += size
+        while self.size > self.maxsize:
+            _, (_, size) = self._data.popitem(last=False)
+            self.size -= size
+
+    def __len__(self):
+        return len(self._data)
+
+
 def timestamp2str(timestamp):
     if timestamp is None or pd.isna(timestamp):
         return None
@@ -46,12 +80,65 @@ def fix_data_for_plotting(data):
     return bool_to_numeric(make_finite(data))
 
 def delete_variable(db, name):
-    # Remove from the database
+    """Delete a variable from the database and the HDF5 files
+
+    The GUI deletes it from the database first and cleans up the files in
+    the background, using delete_variable_files().
+    """
     db.delete_variable(name)
+    locked = delete_variable_files(db.path.parent, name)
+    if locked:
+        raise BlockingIOError(f"Could not remove {name!r} from locked files: {locked}")
+
+
+def delete_variable_files(db_dir, name, progress=None, stop=None, max_rounds=6):
+    """Remove a variable from the HDF5 files in extracted_data/
+
+    Files which are locked, e.g. because a job is writing to them, are skipped
+    and tried again after the others, waiting 1, 2, 4... seconds between
+    rounds. progress(done, total) is called after each file is cleaned, and
+    setting the stop event (a threading.Event) ends it early.
+
+    Returns the paths of any files which could not be cleaned.
+    """
+    # The consolidated file, if there is one, can just be deleted
+    Path(db_dir, "extracted_data", "by_variable", f"{name}.h5").unlink(missing_ok=True)
+
+    paths = sorted(glob.glob(f"{db_dir}/extracted_data/*.h5"))
+    total = len(paths)
+    done = 0
+    for i in range(max_rounds):
+        if i > 0 and _wait(stop, 2 ** (i - 1)):
+            break
+
+        locked = []
+        for j, path in enumerate(paths):
+            if stop is not None and stop.is_set():
+                return locked + paths[j:]
+            try:
+                f = h5py.File(path, 'a')
+            except BlockingIOError:
+                locked.append(path)
+                continue
+            with f:
+                if name in f:
+                    del f[name]
+                if f".reduced/{name}" in f:
+                    del f[f".reduced/{name}"]
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+        paths = locked
+        if not paths:
+            break
+
+    return paths
+
 
-    # And the HDF5 files
-    for h5_path in glob.glob(f"{db.path.parent}/extracted_data/*.h5"):
-        with add_to_h5_file(h5_path) as f:
-            if name in f:
-                del f[f".reduced/{name}"]
-                del f[name]
+def _wait(stop, timeout):
+    """Sleep for timeout seconds, returning True early if stop is set"""
+    if stop is None:
+        time.sleep(timeout)
+        return False
+    return stop.wait(timeout)
@@ -27,12 +27,12 @@ def amore_proto(args):
     It is the callers responsibility to make sure the PWD is a database
     directory.
     """
-    with patch("damnit.backend.extract_data.KafkaProducer"):
+    with patch("damnit.backend.updates.KafkaProducer"):
         main(args)
 
 def extract_mock_run(run_num: int, match=()):
     """Run the context file in the CWD on the specified run"""
-    with patch("damnit.backend.extract_data.KafkaProducer"):
+    with patch("damnit.backend.updates.KafkaProducer"):
         extr = Extractor()
         prop = extr.db.metameta['proposal']
         extr.update_db_vars()
@@ -1,7 +1,9 @@
 import subprocess
 from pathlib import Path
 from textwrap import dedent
+from unittest.mock import patch
 
+import h5py
 import numpy as np
 import plotly.express as px
 import pytest
@@ -9,6 +11,7 @@ import xarray as xr
 from plotly.graph_objects import Figure as PlotlyFigure
 
 from damnit import Damnit, RunVariables
+from damnit.api import DataType
 from damnit.context import ContextFile
 from .helpers import extract_mock_run
 
@@ -41,6 +44,23 @@ def test_damnit(mock_db_with_data):
     df = damnit.table(with_titles=True)
     assert "Scalar1" in df.columns
 
+    # Test jobs()
+    assert len(damnit.jobs()) == 0
+    db.add_job("9876", "maxwell", db.metameta["proposal"], 1, "all")
+    db.job_started("9876", "maxwell")
+    db.job_finished("9876", "maxwell", exit_code=0, peak_mem=2**30)
+    jobs = damnit.jobs()
+    assert len(jobs) == 1
+    assert jobs.status[0] == "finished"
+    assert jobs.runtime[0] >= 0
+    assert jobs.peak_mem[0] == 2**30
+
+    # Test changes_since()
+    changes = damnit.changes_since(0)
+    assert "scalar1" in set(changes.name)
+    assert (changes.run == 1).all()
+    assert len(damnit.changes_since(changes.seq.max())) == 0
+
 def test_run_variables(mock_db_with_data, monkeypatch):
     db_dir, db = mock_db_with_data
     damnit = Damnit(db_dir)
@@ -58,6 +78,26 @@ def test_run_variables(mock_db_with_data, monkeypatch):
     ctx = ContextFile.from_py_file(db_dir / "context.py")
     assert set(rv.keys()) == set(ctx.vars.keys()) | set(["start_time"])
 
+    # The keys come from the manifest in the database, without opening the file
+    manifest = db.run_manifest(db.metameta["proposal"], 1)
+    assert set(manifest) == set(rv.keys())
+    assert manifest["meta_array"] == "dataarray"
+    assert manifest["scalar1"] is None
+    with patch("h5py.File", side_effect=AssertionError("file opened")):
+        assert rv["meta_array"].type_hint() is DataType.DataArray
+
+    # Runs processed before the manifest existed fall back to the HDF5 file
+    with db.conn:
+        db.conn.execute("DELETE FROM run_manifest WHERE run=1")
+    assert set(rv.keys()) == set(ctx.vars.keys()) | set(["start_time"])
+
+    # A partial manifest (e.g. from an older migration) is completed from the
+    # file when some variables for the run are processed again.
+    db.add_to_manifest(db.metameta["proposal"], 1, {"scalar2": None})
+    assert rv.keys() == ["scalar2"]
+    extract_mock_run(1, match=["scalar1"])
+    assert set(rv.keys()) == set(ctx.vars.keys()) | set(["start_time"])
+
     # Reprocess a single variable for another run
     extract_mock_run(100, match=['scalar1'])
     assert damnit.runs() == [1, 100]
@@ -133,6 +173,65 @@ def test_variable_data(mock_db_with_data, monkeypatch):
     json_str = rv["plotly_mc_plotface"].read(deserialize_plotly=False)
     assert isinstance(json_str, str)
 
+    # Test lazy reading
+    with rv["array"].read(lazy=True) as lazy_array:
+        assert isinstance(lazy_array, h5py.Dataset)
+        np.testing.assert_array_equal(lazy_array[:1], array[:1])
+    # Closing it releases the file, so it can be opened for writing
+    assert not lazy_array.id.valid
+    h5py.File(rv["array"]._h5_path, "a").close()
+    with rv["meta_array"].read(lazy=True) as lazy_meta_array:
+        assert isinstance(lazy_meta_array, xr.DataArray)
+        assert lazy_meta_array.attrs == {}
+        np.testing.assert_array_equal(lazy_meta_array, meta_array)
+    with rv["dataset"].read(lazy=True) as lazy_dataset:
+        assert isinstance(lazy_dataset, xr.Dataset)
+    # Non-array types are read as normal
+    assert rv["scalar1"].read(lazy=True) == 42
+
+    # Test slicing
+    np.testing.assert_array_equal(rv["array"][1:], array[1:])
+    sliced = rv["meta_array"][:1]
+    assert isinstance(sliced, xr.DataArray)
+    np.testing.assert_array_equal(sliced, meta_array[:1])
+    for name in ["scalar1", "empty_string", "dataset", "plotly_mc_plotface"]:
+        with pytest.raises(TypeError):
+            rv[name][0]
+
+def test_stack(mock_db_with_data, monkeypatch):
+    db_dir, db = mock_db_with_data
+    monkeypatch.chdir(db_dir)
+    damnit = Damnit(db_dir)
+
+    # Without consolidated files, each run's file is read
+    stacked = damnit.stack("meta_array")
+    assert stacked.dims == ("run", "dim_0")
+    np.testing.assert_array_equal(stacked.run, [1])
+
+    db.metameta["consolidate_arrays"] = 1
+    extract_mock_run(1)
+    extract_mock_run(2)
+    # Reprocessing a run shouldn't duplicate it
+    extract_mock_run(2)
+
+    store_dir = db_dir / "extracted_data" / "by_variable"
+    assert {p.name for p in store_dir.iterdir()} == {"array.h5", "meta_array.h5"}
+    with h5py.File(store_dir / "meta_array.h5") as f:
+        assert f["data"].shape == (2, 2)
+
+    stacked = damnit.stack("meta_array")
+    np.testing.assert_array_equal(stacked.run, [1, 2])
+    np.testing.assert_array_equal(stacked, [[1, 1234], [2, 1234]])
+
+    # Titles work too, and runs can be selected
+    stacked = damnit.stack("Array", runs=[2])
+    assert stacked.name == "array"
+    np.testing.assert_allclose(stacked, [[42, 3.14]])
+
+    # Runs missing from the consolidated file are read from the run files
+    (store_dir / "meta_array.h5").unlink()
+    np.testing.assert_array_equal(damnit.stack("meta_array"), [[1, 1234], [2, 1234]])
+
 def test_api_dependencies(venv):
     package_path = Path(__file__).parent.parent
     venv.install(package_path)
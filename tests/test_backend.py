@@ -4,10 +4,14 @@ import io
 import json
 import logging
 import os
+import pickle
 import signal
 import stat
 import subprocess
+import sys
 import textwrap
+import threading
+import time
 from unittest.mock import MagicMock, patch
 
 import extra_data as ed
@@ -21,10 +25,14 @@ import yaml
 from PIL import Image
 from testpath import MockCommand
 
-from damnit.backend import backend_is_running, initialize_and_start_backend
-from damnit.backend.db import DamnitDB
-from damnit.backend.extract_data import Extractor, add_to_db
+from damnit.backend import backend_is_running, initialize_and_start_backend, wire_format
+from damnit.backend.db import DamnitDB, JobStatus, MsgKind, ReducedData, msg_dict
+from damnit.backend.extract_data import (ContextValidator, Extractor, add_to_db,
+                                        run_values_msg)
+from damnit.backend.extract_data import main as extract_data_main
+from damnit.backend.listener import EventProcessor
 from damnit.backend.supervisord import wait_until, write_supervisord_conf
+from damnit.backend.updates import LocalTransport, open_update_transport
 from damnit.context import (ContextFile, ContextFileErrors, PNGData, Results,
                             RunData, get_proposal_path)
 from damnit.ctxsupport.ctxrunner import THUMBNAIL_SIZE
@@ -431,6 +439,67 @@ def test_results(mock_ctx, mock_run, caplog, tmp_path):
     assert results.cells["run_type"].data == "alchemy"
 
 
+def test_save_consolidated(tmp_path, caplog):
+    from damnit_ctx import Cell
+
+    def save(run, **data):
+        cells = {name: Cell(d) for name, d in data.items()}
+        Results(cells, None).save_consolidated(tmp_path, 1234, run)
+
+    def stored_runs(name):
+        with h5py.File(tmp_path / f"{name}.h5") as f:
+            return sorted(f["runs"][:, 1].tolist())
+
+    for run in (1, 2, 3):
+        save(run, a=np.full(3, run), b=np.full(3, run), c=np.zeros(2))
+    assert stored_runs("a") == [1, 2, 3]
+
+    # Reprocessing with a different shape, a scalar or None removes the old
+    # entry, so stale data isn't read.
+    save(2, a=np.zeros(4), b=7, c=None)
+    assert stored_runs("a") == stored_runs("b") == [1, 3]
+    assert stored_runs("c") == [1, 3]
+    with h5py.File(tmp_path / "b.h5") as f:
+        ix = f["runs"][:, 1].tolist().index(3)
+        np.testing.assert_array_equal(f["data"][ix], [3, 3, 3])
+
+    # Errors writing the files are logged, not raised
+    with patch("ctxrunner.add_to_h5_file", side_effect=BlockingIOError), \
+         caplog.at_level(logging.WARNING):
+        save(4, a=np.zeros(3))
+    assert "Could not update consolidated file for a" in caplog.text
+    assert stored_runs("a") == [1, 3]
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Reads /proc")
+def test_variable_peak_rss(mock_run):
+    code = """
+    import mmap
+    import time
+    import numpy as np
+    from damnit_ctx import Variable
+
+    def use_memory(nbytes):
+        # Map fresh pages, so we don't reuse memory freed by earlier tests
+        with mmap.mmap(-1, nbytes) as m:
+            np.frombuffer(m, dtype=np.uint8)[:] = 1
+            time.sleep(0.1)
+        return nbytes
+
+    @Variable()
+    def big(run):
+        return use_memory(40_000_000)
+
+    @Variable()
+    def smaller(run, big: "var#big"):
+        return use_memory(20_000_000)
+    """
+    results = mkcontext(code).execute(mock_run, 1000, 123, {})
+
+    # Memory used by each variable is measured separately, even when a later
+    # one uses less than the process has used before.
+    assert results.timings["big"]["peak_rss_delta"] > 30e6
+    assert 15e6 < results.timings["smaller"]["peak_rss_delta"] < 30e6
+
 def test_return_bool(mock_run, tmp_path):
     code = """
     from damnit_ctx import Variable
@@ -569,6 +638,9 @@ def test_add_to_db(mock_db):
 
     reduced_objs = reduced_data_from_dict(reduced_data)
     reduced_objs["float"].attributes = {"background": [255, 0, 0]}
+    reduced_objs["scalar"].timing = {
+        "wall_time": 1.5, "cpu_time": 1.2, "peak_rss_delta": 1024, "output_size": 8
+    }
 
     add_to_db(reduced_objs, db, 1234, 42)
 
@@ -585,6 +657,12 @@ def test_add_to_db(mock_db):
     ).fetchone()
     assert json.loads(row["attributes"]) == {"background": [255, 0, 0]}
 
+    # Only variables with timing information should be recorded
+    rows = db.conn.execute("SELECT * FROM variable_timings").fetchall()
+    assert len(rows) == 1
+    assert rows[0]["name"] == "scalar"
+    assert rows[0]["wall_time"] == 1.5
+
 def test_extractor(mock_ctx, mock_db, mock_run, monkeypatch):
     # Change to the DB directory
     db_dir, db = mock_db
@@ -612,7 +690,7 @@ def test_extractor(mock_ctx, mock_db, mock_run, monkeypatch):
     out_path.parent.mkdir(exist_ok=True)
 
     # Create Extractor with a mocked KafkaProducer
-    with patch(f"{pkg}.KafkaProducer") as _:
+    with patch("damnit.backend.updates.KafkaProducer") as _:
         extractor = Extractor()
 
     # Test regular variables and slurm variables are executed
@@ -622,7 +700,7 @@ def test_extractor(mock_ctx, mock_db, mock_run, monkeypatch):
         extractor.extract_and_ingest(1234, 42, cluster=False,
                                      run_data=RunData.ALL)
         extract_in_subprocess.assert_called_once()
-        extractor.kafka_prd.send.assert_called()
+        extractor.updates.producer.send.assert_called()
         sbatch.assert_called()
 
     # This works because we loaded damnit.context above
@@ -639,6 +717,16 @@ def test_extractor(mock_ctx, mock_db, mock_run, monkeypatch):
         assert f[".reduced"]["array"].asstr()[()] == "float64: (2, 2, 2, 2)"
         assert f["array"]["data"].shape == (2, 2, 2, 2)
 
+        # Check the resources used were recorded
+        attrs = f[".reduced/array"].attrs
+        assert attrs["wall_time"] >= 0
+        assert attrs["output_size"] == 2**4 * 8
+
+    # Test saving profiles of each variable
+    with patch("ctxrunner.extra_data.open_run", return_value=mock_run):
+        main(['exec', '1234', '42', 'raw', '--profile-dir', str(db_dir / "profiles")])
+    assert (db_dir / "profiles" / "array.prof").is_file()
+
     # Helper function to raise an exception when proc data isn't available, like
     # open_run(data="proc") would.
     def mock_open_run(*_, data=None):
@@ -677,6 +765,117 @@ def test_extractor(mock_ctx, mock_db, mock_run, monkeypatch):
 
         open_run.assert_called_with(1234, 42, data="all")
 
+def test_listener_coalescing(mock_db, monkeypatch):
+    db_dir, db = mock_db
+    db.metameta["proposal"] = 1234
+    monkeypatch.chdir(db_dir)
+
+    with patch("damnit.backend.listener.KafkaConsumer"):
+        processor = EventProcessor(db_dir)
+    record = MagicMock(timestamp=1_700_000_000_000)
+    msg = {"proposal": 1234, "run": 42}
+
+    # Raw & proc events for the same run should be merged into one job
+    with MockCommand.fixed_output("sbatch", "9876; maxwell") as sbatch:
+        processor.handle_migration_complete(record, msg)
+        processor.handle_run_corrections_complete(record, msg)
+        processor.handle_migration_complete(record, msg | {"run": 43})
+
+        # Nothing is submitted until the coalescing window has passed
+        processor.submit_pending()
+        assert sbatch.get_calls() == []
+
+        processor.submit_pending(force=True)
+        calls = sbatch.get_calls()
+        assert len(calls) == 2
+        assert "1234 42 all" in calls[0]["argv"][-1]
+        assert "1234 43 raw" in calls[1]["argv"][-1]
+
+    row = db.conn.execute("SELECT * FROM jobs WHERE run=42").fetchone()
+    assert row["job_id"] == "9876"
+    assert row["status"] == JobStatus.pending.value
+
+    # A replayed event shouldn't launch a duplicate while the job is pending
+    with MockCommand.fixed_output("sbatch", "9877; maxwell") as sbatch:
+        processor.handle_migration_complete(record, msg)
+        processor.handle_run_corrections_complete(record, msg)
+        processor.submit_pending(force=True)
+        assert sbatch.get_calls() == []
+
+        # The job for all data also covers raw data
+        processor.handle_migration_complete(record, msg)
+        processor.submit_pending(force=True)
+        assert sbatch.get_calls() == []
+
+    # Once the job is running, it may have missed new data, so an event
+    # launches another job.
+    db.job_started("9876", "maxwell")
+    with MockCommand.fixed_output("sbatch", "9879; maxwell") as sbatch:
+        processor.handle_run_corrections_complete(record, msg)
+        processor.submit_pending(force=True)
+        assert "1234 42 proc" in sbatch.get_calls()[0]["argv"][-1]
+    db.job_finished("9879", "maxwell", exit_code=0)
+
+    # Runs which fail to submit are kept to try again
+    with patch.object(processor.submitter, "submit", side_effect=RuntimeError):
+        processor.handle_migration_complete(record, msg | {"run": 44})
+        processor.submit_pending(force=True)
+    assert (1234, 44) in processor.pending
+    with MockCommand.fixed_output("sbatch", "9878; maxwell") as sbatch:
+        processor.submit_pending(force=True)
+        assert "1234 44 raw" in sbatch.get_calls()[0]["argv"][-1]
+    assert processor.pending == {}
+
+    # But once the job is done it should be processed again
+    db.job_finished("9876", "maxwell", exit_code=0)
+    with MockCommand.fixed_output("sbatch", "9877; maxwell") as sbatch:
+        processor.handle_migration_complete(record, msg)
+        processor.submit_pending(force=True)
+        assert len(sbatch.get_calls()) == 1
+
+def test_job_tracking(mock_db, monkeypatch):
+    db_dir, db = mock_db
+    monkeypatch.chdir(db_dir)
+    monkeypatch.setenv("SLURM_JOB_ID", "9876")
+    monkeypatch.setenv("SLURM_CLUSTER_NAME", "solaris")
+    pkg = "damnit.backend.extract_data"
+    db.metameta["update_transport"] = "local"
+    receiver = open_update_transport(db)
+    receiver.subscribe()
+
+    def job_row():
+        return db.conn.execute("SELECT * FROM jobs WHERE job_id='9876'").fetchone()
+
+    db.add_job("9876", "solaris", 1234, 42, "all")
+    assert job_row()["status"] == JobStatus.pending.value
+
+    # The job should record its own progress, and tell GUIs to check it
+    with patch(f"{pkg}.Extractor"):
+        extract_data_main(["1234", "42", "all"])
+    row = job_row()
+    assert row["status"] == JobStatus.finished.value
+    assert row["exit_code"] == 0
+    assert row["runtime"] >= 0
+    assert row["peak_mem"] > 0
+    job_msg = msg_dict(MsgKind.job_updated, {"job_id": "9876", "proposal": 1234, "run": 42})
+    assert receiver.poll(timeout=1) == [job_msg, job_msg]
+    receiver.close()
+
+    # Including when it fails
+    error = subprocess.CalledProcessError(3, ["python"])
+    with patch(f"{pkg}.Extractor", side_effect=error), \
+         pytest.raises(subprocess.CalledProcessError):
+        extract_data_main(["1234", "42", "all"])
+    row = job_row()
+    assert row["status"] == JobStatus.failed.value
+    assert row["exit_code"] == 3
+
+    # If the start wasn't recorded, the runtime is counted from submission
+    db.add_job("9877", "solaris", 1234, 43, "all")
+    db.job_finished("9877", "solaris", exit_code=1)
+    row = db.conn.execute("SELECT * FROM jobs WHERE job_id='9877'").fetchone()
+    assert row["runtime"] >= 0
+
 def test_custom_environment(mock_db, venv, monkeypatch, qtbot):
     db_dir, db = mock_db
     monkeypatch.chdir(db_dir)
@@ -706,7 +905,7 @@ def test_custom_environment(mock_db, venv, monkeypatch, qtbot):
     """
     (db_dir / "context.py").write_text(textwrap.dedent(new_env_code))
 
-    pkg = "damnit.backend.extract_data"
+    pkg = "damnit.backend.updates"
 
     with patch(f"{pkg}.KafkaProducer"), pytest.raises(ImportError):
         Extractor()
@@ -724,6 +923,47 @@ def test_custom_environment(mock_db, venv, monkeypatch, qtbot):
     # upon opening a database directory).
     win = MainWindow(db_dir, False)
 
+def test_context_validator(tmp_path):
+    # Modules next to the context file can be imported
+    (tmp_path / "ctx_helpers.py").write_text("VALUE = 42")
+    validator = ContextValidator(sys.executable, tmp_path)
+    try:
+        code = textwrap.dedent(f"""
+        from pathlib import Path
+        from damnit_ctx import Variable
+        from ctx_helpers import VALUE
+
+        assert Path.cwd() == Path({str(tmp_path)!r})
+
+        @Variable(title="Foo")
+        def foo(run):
+            return VALUE
+        """)
+        assert validator.check(code) is None
+        pid = validator._proc.pid
+
+        # Errors are reported with their line numbers, from the same process
+        stacktrace, lineno, offset = validator.check("x = 1\n1 / 0")
+        assert "ZeroDivisionError" in stacktrace
+        assert lineno == 2
+        assert validator.check("123 = 456")[1] == 1
+        assert validator._proc.pid == pid
+
+        # Printing from the context file doesn't interfere with replies
+        assert validator.check("print('hello')") is None
+
+        # If the process dies, a new one is started
+        validator._proc.kill()
+        validator._proc.wait()
+        assert validator.check("x = 1") is None
+        assert validator._proc.pid != pid
+    finally:
+        validator.close()
+
+    assert validator._proc is None
+    with pytest.raises(RuntimeError):
+        validator.check("x = 1")
+
 def test_initialize_and_start_backend(tmp_path, bound_port, request):
     db_dir = tmp_path / "foo"
     supervisord_config_path = db_dir / "supervisord.conf"
@@ -857,3 +1097,137 @@ def test_initialize_and_start_backend(tmp_path, bound_port, request):
         assert initialize_and_start_backend(db_dir)
 
     assert backend_is_running(db_dir)
+
+
+def test_wire_format():
+    msg = run_values_msg(1234, 5, {
+        "f": ReducedData(np.float32(1.5), max_diff=0.5),
+        "i": ReducedData(np.int64(7)),
+        "c": ReducedData(1 + 2j),
+        "png": ReducedData(b"\x89PNG\r\n", attributes={"shape": (2, 3)}),
+        "s": ReducedData("text"),
+        "none": ReducedData(None),
+    })
+    data = wire_format.encode(msg)
+    assert data.startswith(wire_format.HEADER)
+
+    decoded = wire_format.decode(data)
+    values = decoded["data"]["values"]
+    # NumPy scalars keep their types
+    assert type(values["f"]) is np.float32 and values["f"] == 1.5
+    assert type(values["i"]) is np.int64 and values["i"] == 7
+    assert values["c"] == 1 + 2j
+    assert values["png"] == b"\x89PNG\r\n"
+    assert values["s"] == "text" and values["none"] is None
+    assert decoded["data"]["attributes"]["png"] == {"shape": [2, 3]}
+    np.testing.assert_array_equal(
+        wire_format.decode(wire_format.encode({"a": np.eye(2)}))["a"], np.eye(2)
+    )
+
+    # Pickled messages & newer versions are rejected, not unpickled
+    with pytest.raises(ValueError):
+        wire_format.decode(pickle.dumps(msg))
+    newer = wire_format.MAGIC + bytes([wire_format.FORMAT_VERSION + 1]) + data[len(wire_format.HEADER):]
+    with pytest.raises(ValueError, match="newer"):
+        wire_format.decode(newer)
+    assert wire_format.decode_batch([pickle.dumps(msg), data]) == [decoded]
+
+def test_local_update_transport(mock_db, monkeypatch):
+    db_dir, db = mock_db
+    db.metameta["update_transport"] = "local"
+    monkeypatch.setattr(LocalTransport, "check_interval", 0.01)
+
+    sender = open_update_transport(db)
+    receiver = open_update_transport(db)
+    assert isinstance(receiver, LocalTransport)
+    sender.send({"before": "subscribing"})
+    receiver.subscribe()
+    assert receiver.poll(timeout=0) == []
+
+    msgs = [run_values_msg(1234, run, {"n": ReducedData(run)}) for run in range(3)]
+    for msg in msgs:
+        sender.send(msg)
+    sender.flush()
+    # Messages come in order, and only once
+    assert receiver.poll(timeout=1) == msgs
+    assert receiver.poll(timeout=0.05) == []
+
+    # Old messages are deleted when sending new ones
+    monkeypatch.setattr(LocalTransport, "max_age", -1)
+    sender.send(msgs[0])
+    assert db.conn.execute("SELECT count(*) FROM update_messages").fetchone()[0] == 1
+    assert receiver.poll(timeout=1) == [msgs[0]]
+
+    # Closing the transport from another thread stops poll() waiting
+    receiver.check_interval = 10
+    t0 = time.monotonic()
+    threading.Timer(0.1, receiver.close).start()
+    assert receiver.poll(timeout=20) == []
+    assert time.monotonic() - t0 < 5
+    sender.close()
+
+def test_compact(mock_db):
+    db_dir, db = mock_db
+    extracted = db_dir / "extracted_data"
+    extracted.mkdir()
+
+    # Rewriting data in append mode, like reprocessing does, leaves unused
+    # space in the files.
+    for run in (1, 2):
+        path = extracted / f"p1234_r{run}.h5"
+        with h5py.File(path, "w") as f:
+            f.create_dataset(".reduced/image", data=np.zeros(4))
+            f[".reduced/image"].attrs["_damnit_objtype"] = "image"
+            f.create_group("image").attrs["_damnit_objtype"] = "image"
+        # Writing a variable, then another one after it (e.g. from proc
+        # data) and reprocessing the first with a smaller result leaves
+        # unused space in the middle of the file.
+        for name, shape in [("image", (1024, 1024)), ("proc", (16, 1024)),
+                            ("image", (128, 1024))]:
+            with h5py.File(path, "a") as f:
+                if f"{name}/data" in f:
+                    del f[f"{name}/data"]
+                f.create_dataset(f"{name}/data", data=np.full(shape, run, dtype=np.float64))
+
+    # Arrays with coordinates are saved with netCDF dimension scales, which
+    # refer to each other.
+    xarr = xr.DataArray(np.random.rand(5, 3), dims=["x", "y"],
+                        coords={"x": np.arange(5), "y": [1., 2., 3.]})
+    xarr.to_netcdf(extracted / "p1234_r1.h5", mode="a", format="NETCDF4",
+                   group="xarr", engine="h5netcdf")
+
+    # A small file isn't worth compacting
+    with h5py.File(extracted / "p1234_r3.h5", "w") as f:
+        f["small"] = np.arange(10)
+
+    sizes_before = {p.name: p.stat().st_size for p in extracted.glob("*.h5")}
+
+    # Run 2 is being processed, so it's left alone
+    db.add_job("1", "local", 1234, 2, "raw")
+    db.job_started("1", "local")
+
+    from damnit.backend.compact import compact, find_fragmented
+    fragmented = find_fragmented(db_dir, workers=1)
+    assert sorted(u.path.name for u in fragmented) == ["p1234_r1.h5", "p1234_r2.h5"]
+    assert all(u.unused_ratio > 0.5 for u in fragmented)
+
+    assert compact(db, workers=1, dry_run=True) == (0, 0)
+    n_files, saved = compact(db, workers=1)
+    assert n_files == 1
+
+    r1 = extracted / "p1234_r1.h5"
+    assert r1.stat().st_size < sizes_before["p1234_r1.h5"] / 2
+    assert saved == sizes_before["p1234_r1.h5"] - r1.stat().st_size
+    assert (extracted / "p1234_r2.h5").stat().st_size == sizes_before["p1234_r2.h5"]
+    assert (extracted / "p1234_r3.h5").stat().st_size == sizes_before["p1234_r3.h5"]
+    assert sorted(p.name for p in extracted.iterdir()) == [
+        "p1234_r1.h5", "p1234_r2.h5", "p1234_r3.h5"
+    ]
+
+    with h5py.File(r1) as f:
+        assert f[".reduced/image"].attrs["_damnit_objtype"] == "image"
+        assert f["image"].attrs["_damnit_objtype"] == "image"
+        np.testing.assert_array_equal(f["image/data"][:], np.full((128, 1024), 1))
+    xr.testing.assert_identical(
+        xr.load_dataarray(r1, group="xarr", engine="h5netcdf"), xarr
+    )
@@ -147,3 +147,25 @@ def test_reprocess(mock_db_with_data, monkeypatch):
         main(["reprocess", "10"])
 
     assert sbatch.get_calls() == []
+
+def test_profile(mock_db, monkeypatch, capsys):
+    db_dir, db = mock_db
+    monkeypatch.chdir(db_dir)
+
+    main(["profile"])
+    assert "No variable timings" in capsys.readouterr().out
+
+    for run in range(1, 11):
+        db.set_variable_timings(1234, run, {
+            "fast": {"wall_time": 0.1, "cpu_time": 0.1, "peak_rss_delta": 0, "output_size": 8},
+            "slow": {"wall_time": run, "cpu_time": run / 2, "peak_rss_delta": 2e9, "output_size": -1},
+        })
+
+    main(["profile"])
+    out = capsys.readouterr().out
+    # The slowest variable should come first
+    assert out.index("slow") < out.index("fast")
+    assert "9.55" in out  # p95 for 'slow'
+
+    main(["profile", "--limit", "1"])
+    assert "fast" not in capsys.readouterr().out
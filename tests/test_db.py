@@ -1,3 +1,5 @@
+from damnit.backend.db import ReducedData
+
 
 def test_metameta(mock_db):
     _, db = mock_db
@@ -38,3 +40,27 @@ def test_standalone_comment(mock_db):
     db.change_standalone_comment(cid, 'Revised comment')
     res = [tuple(r) for r in db.conn.execute("SELECT * FROM time_comments")]
     assert res == [(ts, 'Revised comment')]
+
+
+def test_change_log(mock_db):
+    _, db = mock_db
+    assert db.changes_since(0) == [] and db.last_change_seq() == 0
+
+    db.set_variable(1234, 5, 'a', ReducedData(1))
+    db.set_variable(1234, 5, 'b', ReducedData(2))
+    seq = db.last_change_seq()
+    db.set_variable(1234, 6, 'a', ReducedData(3))
+    db.set_variable(1234, 5, 'a', ReducedData(4))
+
+    changes = [(r['proposal'], r['run'], r['name']) for r in db.changes_since(seq)]
+    assert changes == [(1234, 6, 'a'), (1234, 5, 'a')]
+    # Only the latest change to each variable & run is kept
+    assert len(db.changes_since(0)) == 3
+    assert db.changes_since(db.last_change_seq()) == []
+
+    # Deleting a variable leaves one change without a run
+    seq = db.last_change_seq()
+    db.delete_variable('a')
+    changes = [(r['proposal'], r['run'], r['name']) for r in db.changes_since(0)]
+    assert changes == [(1234, 5, 'b'), (None, None, 'a')]
+    assert db.changes_since(seq)[0]['seq'] > seq
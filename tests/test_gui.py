@@ -1,6 +1,8 @@
 import re
 import os
 import textwrap
+import threading
+import time
 from contextlib import contextmanager
 from pathlib import Path
 from unittest.mock import patch
@@ -17,12 +19,17 @@ from PyQt5.QtWidgets import QMessageBox, QFileDialog, QDialog, QInputDialog, \
 
 import damnit
 from damnit.ctxsupport.ctxrunner import ContextFile, Results
-from damnit.backend.db import DamnitDB, ReducedData
+from damnit.backend.db import DamnitDB, MsgKind, ReducedData, msg_dict
 from damnit.backend.extract_data import add_to_db
+from damnit.backend import wire_format
+from damnit.backend.updates import KafkaTransport, LocalTransport, open_update_transport
 from damnit.gui.editor import ContextTestResult
-from damnit.gui.main_window import MainWindow, AddUserVariableDialog
+from damnit.gui.kafka import UpdateAgent
+from damnit.gui.main_window import MainWindow, AddUserVariableDialog, VariableReader
 from damnit.gui.open_dialog import OpenDBDialog
-from damnit.gui.plot import ScatterPlotWindow, HistogramPlotWindow
+from damnit.gui.lod import ImagePyramid, SortedHistogram, minmax_indices
+from damnit.gui.plot import ScatterPlotWindow, HistogramPlotWindow, ImagePlotWindow
+from damnit.gui.table import DamnitTableModel, NumberRangeFilter, RegexFilter
 from damnit.gui.zulip_messenger import ZulipConfig
 
 from .helpers import reduced_data_from_dict, mkcontext, extract_mock_run
@@ -38,7 +45,7 @@ def pid_dead(pid):
 
 def test_connect_to_kafka(mock_db, qtbot):
     db_dir, db = mock_db
-    pkg = "damnit.gui.kafka"
+    pkg = "damnit.backend.updates"
 
     with patch(f"{pkg}.KafkaConsumer") as kafka_cns, \
          patch(f"{pkg}.KafkaProducer") as kafka_prd:
@@ -52,6 +59,95 @@ def test_connect_to_kafka(mock_db, qtbot):
         kafka_cns.assert_called_once()
         kafka_prd.assert_called_once()
 
+def test_update_agent(mock_db, qtbot, monkeypatch):
+    db_dir, db = mock_db
+    db.metameta["update_transport"] = "local"
+    monkeypatch.setattr(LocalTransport, "check_interval", 0.01)
+    sender = open_update_transport(db)
+
+    update_msgs = [msg_dict(MsgKind.variable_set, {"name": f"var{i}"})
+                   for i in range(3)]
+    agent = UpdateAgent(open_update_transport(db))
+    for msg in update_msgs:
+        sender.send(msg)
+
+    received = []
+    agent.messages.connect(received.append, Qt.DirectConnection)
+    thread = threading.Thread(target=agent.listen_loop)
+    thread.start()
+
+    # All messages from one poll come in one signal
+    qtbot.waitUntil(lambda: len(received) > 0)
+    assert received == [update_msgs]
+
+    # stop() interrupts the blocking poll
+    t0 = time.monotonic()
+    agent.stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert time.monotonic() - t0 < 1
+
+    # The GUI gets updates through the database without a Kafka broker
+    win = MainWindow(db_dir, True)
+    qtbot.addWidget(win)
+    sender.send(msg_dict(MsgKind.run_values_updated, {
+        "proposal": 1234, "run": 1, "values": {"scalar1": 42},
+        "max_diffs": {}, "attributes": {},
+    }))
+    qtbot.waitUntil(lambda: win.table.rowCount() == 1)
+    win.close()
+    sender.close()
+
+def test_update_agent_kafka(qtbot, monkeypatch):
+    update_msgs = [msg_dict(MsgKind.variable_set, {"name": f"var{i}"})
+                   for i in range(3)]
+
+    class FakeConsumer:
+        """Returns one batch of records, then waits until each poll times out"""
+        def __init__(self, *args, **kwargs):
+            self.records = [SimpleNamespace(value=wire_format.encode(m))
+                            for m in update_msgs]
+            self.poll_timeouts = []
+            self.closed_by = None
+
+        def poll(self, timeout_ms):
+            assert self.closed_by is None
+            self.poll_timeouts.append(timeout_ms)
+            if self.records:
+                records, self.records = self.records, []
+                return {"topic": records}
+            time.sleep(timeout_ms / 1000)
+            return {}
+
+        def close(self):
+            self.closed_by = threading.current_thread()
+
+    pkg = "damnit.backend.updates"
+    monkeypatch.setattr(f"{pkg}.POLL_SLICE_MS", 200)
+    with patch(f"{pkg}.KafkaConsumer", FakeConsumer), patch(f"{pkg}.KafkaProducer"):
+        transport = KafkaTransport("topic")
+        agent = UpdateAgent(transport)
+    consumer = transport.consumer
+
+    received = []
+    agent.messages.connect(received.append, Qt.DirectConnection)
+    thread = threading.Thread(target=agent.listen_loop)
+    thread.start()
+
+    qtbot.waitUntil(lambda: len(received) > 0)
+    assert received == [update_msgs]
+
+    # stop() doesn't wait for the poll, and the polling thread closes the
+    # consumer when its slice ends.
+    t0 = time.monotonic()
+    agent.stop()
+    assert time.monotonic() - t0 < 0.1
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert time.monotonic() - t0 < 1
+    assert consumer.closed_by is thread
+    assert max(consumer.poll_timeouts) <= 200
+
 def test_editor(mock_db, mock_ctx, qtbot):
     db_dir, db = mock_db
     ctx_path = db_dir / "context.py"
@@ -242,6 +338,7 @@ def test_settings(mock_db_with_data, mock_ctx, tmp_path, monkeypatch, qtbot):
     }
     db.set_variable(msg["Proposal"], msg["Run"], "new_var", ReducedData(msg["new_var"]))
     win.handle_update(msg)
+    win.table.flush_updates()
 
     # The new column should be at the end
     headers = visible_headers()
@@ -298,6 +395,7 @@ def test_handle_update(mock_db, qtbot):
 
     assert win.table.rowCount() == 0
     win.handle_update(msg)
+    win.table.flush_updates()
     assert win.table.rowCount() == 1
 
     # Columns should be added for the new variables
@@ -308,14 +406,38 @@ def test_handle_update(mock_db, qtbot):
     # Send an update for an existing row
     msg["scalar1"] = 43
     win.handle_update(msg)
+    win.table.flush_updates()
     assert model().data(model().index(0, headers.index("Scalar1"))) == str(msg["scalar1"])
 
     # Add a new column to an existing row
     msg["unexpected_var"] = 7
     win.handle_update(msg)
+    win.table.flush_updates()
     assert len(headers) + 1 == len(get_headers())
     assert "unexpected_var" in get_headers()
 
+    # New columns use the titles in the database
+    db.update_computed_variables({"new_var": {
+        "title": "New variable", "description": None, "attributes": None
+    }})
+    msg["new_var"] = 8
+    win.handle_update(msg)
+    win.table.flush_updates()
+    assert "New variable" in get_headers()
+
+    # Updates including formatting are batched together and don't need the DB
+    for value in [44, 45]:
+        win.handle_update(msg_dict(MsgKind.run_values_updated, {
+            "proposal": 1234, "run": 1, "values": {"scalar1": value},
+            "max_diffs": {"scalar1": 1.0}, "attributes": {"scalar1": {}},
+        }))
+    with qtbot.waitSignal(win.table.runs_updated) as blocker:
+        pass
+    assert blocker.args == [{"scalar1"}, False]
+    assert model().data(model().index(0, headers.index("Scalar1"))) == "45"
+    scalar1_ix = win.table.index(0, win.table.find_column("scalar1"))
+    assert win.table.data(scalar1_ix, Qt.FontRole).bold()
+
 def test_handle_update_plots(mock_db_with_data, monkeypatch, qtbot):
     db_dir, db = mock_db_with_data
     monkeypatch.chdir(db_dir)
@@ -343,6 +465,7 @@ def test_handle_update_plots(mock_db_with_data, monkeypatch, qtbot):
         "string": "foo"
     }
     win.handle_update(msg)
+    win.table.flush_updates()
 
 def test_autoconfigure(tmp_path, bound_port, request, qtbot):
     db_dir = tmp_path / "usr/Shared/amore"
@@ -441,6 +564,19 @@ def test_user_vars(mock_ctx_user, mock_user_vars, mock_db, qtbot):
     # Loads the context file to do the other tests
     win.autoconfigure(db_dir)
 
+    # Variables only stored in the database can be read in another thread
+    db.metameta["proposal"] = proposal
+    reader = VariableReader(1, db_dir, run_number, "user_number", None)
+    read, failed = [], []
+    reader.signals.data_read.connect(lambda *args: read.append(args))
+    reader.signals.failed.connect(lambda *args: failed.append(args))
+    thread = threading.Thread(target=reader.run)
+    thread.start()
+    thread.join()
+    qtbot.waitUntil(lambda: bool(read or failed))
+    assert failed == []
+    assert read == [(1, 10.2, False)]
+
     # After loading a context file the menu should be enabled
     assert create_user_menu.isEnabled()
 
@@ -723,14 +859,25 @@ def test_table_and_plotting(mock_db_with_data, mock_ctx, mock_run, monkeypatch,
     array_index = get_index("Array")
     with patch.object(QMessageBox, "warning") as warning:
         win.inspect_data(array_index)
+        win.wait_for_inspect_data()
         warning.assert_not_called()
 
     # And correlate two array variables
     array_sorted_idx = win.table_view.model().mapFromSource(array_index)
     win.table_view.setCurrentIndex(array_sorted_idx)
+    n_windows = len(win.plot._plot_windows)
     with patch.object(QMessageBox, "warning") as warning:
         win.plot._plot_run_data_clicked()
+        win.plot.wait_for_run_data()
         warning.assert_not_called()
+    assert len(win.plot._plot_windows) == n_windows + 1
+
+    # Plotting again reuses the arrays already read
+    with patch("damnit.api.VariableData.read") as read:
+        win.plot._plot_run_data_clicked()
+        win.plot.wait_for_run_data()
+        read.assert_not_called()
+    assert len(win.plot._plot_windows) == n_windows + 2
 
     # Check that the text for the array that changes is bold
     assert win.table.data(array_index, role=Qt.FontRole).bold()
@@ -756,15 +903,39 @@ def test_table_and_plotting(mock_db_with_data, mock_ctx, mock_run, monkeypatch,
     # Check that 2D arrays are treated as images
     image_index = get_index("Image")
     assert isinstance(win.table.data(image_index, role=Qt.DecorationRole), QPixmap)
+    # Thumbnails are decoded in the background when needed, and then cached
+    win.table.wait_for_thumbnails()
+    thumbnail = win.table.data(image_index, role=Qt.DecorationRole)
+    assert thumbnail.width() <= 35 and not thumbnail.toImage().isNull()
+    assert win.table.data(image_index, role=Qt.DecorationRole) is thumbnail
+    assert win.table.data(image_index, role=Qt.ToolTipRole).startswith("<img")
     with patch.object(QMessageBox, "warning") as warning:
         win.inspect_data(image_index)
+        win.wait_for_inspect_data()
         warning.assert_not_called()
+    assert isinstance(win._canvas_inspect[-1], ImagePlotWindow)
+
+    # Large images are shown from a strided preview, then the full data
+    n_canvases = len(win._canvas_inspect)
+    with patch("damnit.gui.main_window.VariableReader.preview_size", 100):
+        with patch.object(ImagePlotWindow, "update_canvas", autospec=True,
+                          side_effect=ImagePlotWindow.update_canvas) as update_canvas:
+            win.inspect_data(image_index)
+            win.wait_for_inspect_data()
+    assert len(win._canvas_inspect) == n_canvases + 1
+    assert update_canvas.call_count == 2
+    assert update_canvas.call_args_list[0].args[1].shape == (86, 86)
+    canvas = win._canvas_inspect[-1]
+    assert canvas._image.get_array().shape == (512, 512)
+    assert "preview" not in canvas.windowTitle()
+    assert not win._status_bar_inspect_cancel.isVisibleTo(win)
 
     # And that 3D image arrays are also treated as images
     color_image_index = get_index("Color image")
     assert isinstance(win.table.data(color_image_index, role=Qt.DecorationRole), QPixmap)
     with patch.object(QMessageBox, "warning") as warning:
         win.inspect_data(color_image_index)
+        win.wait_for_inspect_data()
         warning.assert_not_called()
 
     # Check that 2D arrays with summary are inspectable
@@ -773,6 +944,7 @@ def test_table_and_plotting(mock_db_with_data, mock_ctx, mock_run, monkeypatch,
     assert isinstance(win.table.data(mean_2d_index, role=Qt.DisplayRole), str)
     with patch.object(QMessageBox, "warning") as warning:
         win.inspect_data(mean_2d_index)
+        win.wait_for_inspect_data()
         warning.assert_not_called()
 
 
@@ -891,6 +1063,43 @@ def test_exporting(mock_db_with_data, qtbot, monkeypatch, extension):
     df = pd.read_excel(export_path) if extension == ".xlsx" else pd.read_csv(export_path)
     assert df["Image"][0] == "<image>"
 
+def test_sync_changes(mock_db_with_data, qtbot, monkeypatch):
+    db_dir, db = mock_db_with_data
+    monkeypatch.chdir(db_dir)
+    win = MainWindow(db_dir, connect_to_kafka=False)
+    qtbot.addWidget(win)
+    tbl = win.table
+    assert tbl.sync_changes() == 0
+
+    # Changes made without sending updates, e.g. while the GUI was disconnected
+    db.set_variable(1234, 1, "scalar1", ReducedData(99, max_diff=0))
+    db.set_variable(1234, 2, "scalar1", ReducedData(7))
+    db.delete_variable("array")
+    assert tbl.sync_changes() == 3
+    tbl.flush_updates()
+
+    assert "array" not in tbl.column_ids
+    scalar1_ix = tbl.find_column("scalar1")
+    assert tbl.index(tbl.run_index[(1234, 1)], scalar1_ix).data() == "99"
+    assert tbl.index(tbl.run_index[(1234, 2)], scalar1_ix).data() == "7"
+    assert tbl.sync_changes() == 0
+
+    # Values which were already delivered by live updates aren't applied again
+    tbl.handle_run_values_changed(1234, 1, {"scalar1": 5}, {"scalar1": None}, {"scalar1": {}})
+    tbl.flush_updates()
+    db.set_variable(1234, 1, "scalar1", ReducedData(5))
+    assert tbl.sync_changes() == 1
+    assert tbl._pending_updates == {}
+
+    # New runs get their start time from run_info
+    db.ensure_run(1234, 3, start_time=1700000000.)
+    db.set_variable(1234, 3, "scalar1", ReducedData(3))
+    assert tbl.sync_changes() == 1
+    tbl.flush_updates()
+    row_ix = tbl.run_index[(1234, 3)]
+    assert tbl.index(row_ix, scalar1_ix).data() == "3"
+    assert tbl._columns["start_time"].values[row_ix] == 1700000000.
+
 def test_delete_variable(mock_db_with_data, qtbot, monkeypatch):
     db_dir, db = mock_db_with_data
     monkeypatch.chdir(db_dir)
@@ -915,11 +1124,25 @@ def test_delete_variable(mock_db_with_data, qtbot, monkeypatch):
     assert tbl.column_titles == column_titles_before
     assert win.table_view.get_column_states() == col_visibility_before
 
-    # Otherwise it should be deleted from the database and HDF5 files
-    with patch.object(QMessageBox, "warning", return_value=QMessageBox.Yes) as warning:
+    # Otherwise it should be deleted from the database, and then from the HDF5
+    # files in the background. Files which are locked are tried again later.
+    h5_open = h5py.File
+    locked = set()
+    def open_locked_once(path, mode):
+        if path not in locked:
+            locked.add(path)
+            raise BlockingIOError
+        return h5_open(path, mode)
+
+    with patch.object(QMessageBox, "warning", return_value=QMessageBox.Yes) as warning, \
+         patch("h5py.File", side_effect=open_locked_once):
         win.table_view.confirm_delete_variable("array")
         warning.assert_called_once()
+        assert "array" not in db.variable_names()
+        win.table_view.wait_for_cleanup()
 
+    assert len(locked) > 0
+    assert win._status_bar.currentMessage() == "Removed 'array' from HDF5 files"
     assert "array" not in db.variable_names()
     assert tbl.columnCount() == len(column_ids_before) - 1
     assert "array" not in [tbl.column_id(i) for i in range(tbl.columnCount())]
@@ -951,3 +1174,196 @@ def test_precreate_runs(mock_db_with_data, qtbot, monkeypatch):
         win.precreate_runs_dialog()
         dialog.assert_called_once()
         assert get_n_runs() == n_runs + 1
+
+def test_job_status(mock_db_with_data, qtbot, monkeypatch):
+    db_dir, db = mock_db_with_data
+    monkeypatch.chdir(db_dir)
+    proposal = db.metameta["proposal"]
+
+    win = MainWindow(db_dir, connect_to_kafka=False)
+    qtbot.addWidget(win)
+    status_index = win.table.index(win.table.find_row(proposal, 1), 0)
+    status = lambda role=Qt.DisplayRole: win.table.data(status_index, role)
+    assert status() is None
+    # With no active jobs, the table doesn't check for changes
+    jobs_timer = win.table._jobs_timer
+    assert not jobs_timer.isActive()
+
+    # Until a message says a job has changed
+    db.add_job("9876", "maxwell", proposal, 1, "all")
+    db.job_started("9876", "maxwell")
+    win.handle_update(msg_dict(MsgKind.job_updated, {
+        "job_id": "9876", "proposal": proposal, "run": 1
+    }))
+    assert status() == "running"
+    assert jobs_timer.isActive()
+
+    db.job_finished("9876", "maxwell", exit_code=1, peak_mem=2**30)
+    win.table.update_job_statuses()
+    assert status() == "failed"
+    assert "Peak memory" in status(Qt.ToolTipRole)
+    assert not jobs_timer.isActive()
+
+def test_background_table_loading(mock_db_with_data, qtbot, monkeypatch):
+    db_dir, db = mock_db_with_data
+    monkeypatch.chdir(db_dir)
+    proposal = db.metameta["proposal"]
+    for run in range(2, 6):
+        db.ensure_run(proposal, run)
+        db.set_variable(proposal, run, "scalar1", ReducedData(run * 10))
+
+    # Load one run up front, and the rest a page at a time in a thread
+    monkeypatch.setattr(DamnitTableModel, "first_page_size", 1)
+    monkeypatch.setattr(DamnitTableModel, "page_size", 2)
+    win = MainWindow(db_dir, connect_to_kafka=False)
+    qtbot.addWidget(win)
+    assert list(win.table.run_index) == [(proposal, 5)]
+    assert win.table.loading
+
+    with qtbot.waitSignal(win.table.load_finished):
+        pass
+    assert not win.table.loading
+    assert len(win.table.run_index) == 5
+    col = win.table.find_column("scalar1")
+    row = win.table.find_row(proposal, 3)
+    assert win.table.get_value_at_rc(row, col) == 30
+
+    # Numbers for plotting skip runs which are unchecked in the status column
+    xs, ys = win.table.numbers_for_plotting("run", "scalar1", by_title=False)
+    assert dict(zip(xs, ys))[3] == 30
+    win.table.setData(win.table.index(row, 0), Qt.Unchecked, Qt.CheckStateRole)
+    xs, _ = win.table.numbers_for_plotting("run", "scalar1", by_title=False)
+    assert 3 not in xs and len(xs) == 4
+
+
+def test_sort_filter_proxy(mock_db_with_data, qtbot, monkeypatch):
+    db_dir, db = mock_db_with_data
+    monkeypatch.chdir(db_dir)
+    proposal = db.metameta["proposal"]
+    for run, value in [(2, 5), (3, "text"), (4, 30), (5, -1)]:
+        db.ensure_run(proposal, run)
+        db.set_variable(proposal, run, "scalar1", ReducedData(value))
+
+    win = MainWindow(db_dir, connect_to_kafka=False)
+    qtbot.addWidget(win)
+    qtbot.waitUntil(lambda: not win.table.loading)
+    proxy = win.table_view.model()
+    col = win.table.find_column("scalar1")
+    run_col = win.table.find_column("run", by_title=False)
+
+    def runs():
+        return [proxy.index(r, run_col).data(Qt.UserRole) for r in range(proxy.rowCount())]
+
+    def scalars():
+        return [proxy.index(r, col).data(Qt.UserRole) for r in range(proxy.rowCount())]
+
+    # Numbers sort before strings, and empty cells go last
+    proxy.sort(col, Qt.AscendingOrder)
+    assert scalars()[:5] == [-1, 5, 30, 42, "text"]
+    proxy.sort(col, Qt.DescendingOrder)
+    assert scalars() == ["text", 42, 30, 5, -1]
+
+    # Changed values move rows to their new position
+    proxy.sort(col, Qt.AscendingOrder)
+    win.handle_update(msg_dict(MsgKind.run_values_updated, {
+        "proposal": proposal, "run": 5, "values": {"scalar1": 100}
+    }))
+    win.table.flush_updates()
+    assert scalars()[:5] == [5, 30, 42, 100, "text"]
+
+    proxy.set_column_filter("scalar1", NumberRangeFilter(10, 50))
+    assert sorted(runs()) == [1, 4]
+    proxy.set_column_filter("scalar1", RegexFilter("^te"))
+    assert runs() == [3]
+    proxy.clear_column_filter()
+    assert proxy.rowCount() == win.table.rowCount()
+
+    # New runs are put into position without sorting all rows again
+    for order, first_run in [(Qt.AscendingOrder, 10), (Qt.DescendingOrder, 20)]:
+        proxy.sort(col, order)
+        with patch.object(win.table, "sort_order") as sort_order:
+            for i, value in enumerate([7, "abc", float("nan"), 7]):
+                win.handle_update(msg_dict(MsgKind.run_values_updated, {
+                    "proposal": proposal, "run": first_run + i, "values": {"scalar1": value}
+                }))
+            win.table.flush_updates()
+            sort_order.assert_not_called()
+        np.testing.assert_array_equal(proxy._to_source, proxy._compute_order())
+
+    # A column removed & added again doesn't keep its sort order or editability
+    win.table.add_editable_column("scalar1")
+    win.table.removeColumn(col)
+    assert "scalar1" not in win.table._sort_orders
+    assert "scalar1" not in win.table.editable_columns
+    win.table.insert_columns(col, ["Scalar1"], ["scalar1"])
+    for run in [1, 2, 3]:
+        win.handle_update(msg_dict(MsgKind.run_values_updated, {
+            "proposal": proposal, "run": run, "values": {"scalar1": -run}
+        }))
+    win.table.flush_updates()
+    proxy.sort(col, Qt.AscendingOrder)
+    assert scalars()[:3] == [-3, -2, -1]
+    assert all(s is None for s in scalars()[3:])
+    assert not win.table.flags(win.table.index(0, col)) & Qt.ItemIsEditable
+
+
+def test_level_of_detail(qtbot):
+    # Min/max decimation keeps the extremes in each bin
+    x = np.arange(10_000, dtype=np.float64)
+    y = np.sin(x / 100)
+    y[5_000] = 10
+    ix = minmax_indices(x, y, (0, 9_999), 100)
+    assert len(ix) <= 3 * 100 + 2
+    assert 5_000 in ix and np.argmin(y) in ix
+
+    # Zooming in picks a less downsampled level, cropped to the view
+    pyramid = ImagePyramid(np.ones((4096, 4096)))
+    data, extent = pyramid.view((-0.5, 4095.5), (4095.5, -0.5), 500, 500)
+    assert data.shape == (512, 512)
+    assert extent == (-0.5, 4095.5, 4095.5, -0.5)
+    data, extent = pyramid.view((999.5, 1099.5), (1099.5, 999.5), 500, 500)
+    assert data.shape == (100, 100)
+    assert extent == (999.5, 1099.5, 1099.5, 999.5)
+
+    # Large plots draw reduced data, and follow changes to the view
+    n = ScatterPlotWindow.lod_threshold + 1
+    win = ScatterPlotWindow(None, x=[np.arange(n)], y=[np.random.rand(n)])
+    qtbot.addWidget(win)
+    line = win._lines[0]
+    assert 0 < len(line.get_xdata()) < n / 10
+    win._axis.set_xlim(0, 1000)
+    win._update_lod()
+    assert line.get_xdata().max() <= 1001
+
+    win = ScatterPlotWindow(None, x=[np.random.rand(n)], y=[np.random.rand(n)])
+    qtbot.addWidget(win)
+    assert len(win._axis.images) == 1
+    assert win._axis.images[0].get_array().sum() > 0
+
+    win = ImagePlotWindow(None, image=np.random.rand(3000, 3000))
+    qtbot.addWidget(win)
+    assert max(win._image.get_array().shape) < 3000
+    win._axis.set_xlim(-0.5, 99.5)
+    win._axis.set_ylim(99.5, -0.5)
+    win._update_lod()
+    assert win._image.get_array().shape == (100, 100)
+
+
+def test_histogram_rebinning(qtbot):
+    data = np.random.default_rng(1).normal(size=10_000)
+    data[:10] = np.nan
+    hist = SortedHistogram(data)
+    values, edges = hist.density(50)
+    expected, expected_edges = np.histogram(data[10:], 50, density=True)
+    np.testing.assert_allclose(edges, expected_edges)
+    np.testing.assert_allclose(values, expected)
+
+    win = HistogramPlotWindow(None, [data, np.full(5, np.nan)], legend=[1, 2])
+    qtbot.addWidget(win)
+    assert win._nan_warning_label.isVisibleTo(win)
+    stairs = win._hist_objects[0]
+
+    # Changing the number of bins updates the same artist
+    win._probability_density_bins.setValue(50)
+    assert win._hist_objects[0] is stairs
+    np.testing.assert_allclose(stairs.get_data().values, expected)
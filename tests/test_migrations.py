@@ -3,7 +3,8 @@ import pickle
 import h5py
 import numpy as np
 
-from damnit.migrations import migrate_images
+from damnit.api import RunVariables
+from damnit.migrations import JOURNAL_NAME, MigrationJournal, migrate_images
 from damnit.backend.extract_data import add_to_db
 from damnit.backend.db import BlobTypes, ReducedData
 
@@ -28,6 +29,8 @@ def test_migrate_images(mock_db, monkeypatch):
     with h5py.File(mock_h5_path, "w") as f:
         f.create_dataset(".reduced/foo", data=foo)
         f.create_dataset(".reduced/bar", data=np.array(bar))
+        f.create_dataset("foo/data", data=foo)
+        f.create_dataset("bar/data", data=np.array(bar))
     db.set_variable(proposal, run, "bar", ReducedData(bar))
     db.set_variable(proposal, run, "foo", ReducedData(pickle.dumps(foo)))
 
@@ -46,3 +49,35 @@ def test_migrate_images(mock_db, monkeypatch):
     assert isinstance(thumbnail, bytes)
     assert BlobTypes.identify(thumbnail) is BlobTypes.png
     assert row["bar"] == bar
+
+    # All the variables in the file are still listed, not just the images
+    assert RunVariables(db_dir, run).keys() == ["bar", "foo"]
+
+
+def test_resume_migration(mock_db, monkeypatch):
+    db_dir, db = mock_db
+    monkeypatch.chdir(db_dir)
+    db.metameta["proposal"] = 1234
+
+    extracted_data_dir = db_dir / "extracted_data"
+    extracted_data_dir.mkdir()
+    for run in (1, 2):
+        with h5py.File(extracted_data_dir / f"p1234_r{run}.h5", "w") as f:
+            f.create_dataset(".reduced/foo", data=np.random.rand(100, 100))
+        db.set_variable(1234, run, "foo", ReducedData(b"old"))
+
+    # Pretend that an earlier attempt converted run 1 and was interrupted
+    # before it was recorded in the journal, and then converted run 2.
+    migrate_images(db, db_dir, dry_run=False)
+    db.set_variable(1234, 1, "foo", ReducedData(b"old"))
+    journal = MigrationJournal(db_dir)
+    journal.record("images", "p1234_r2.h5", {"foo": b"from journal"})
+    migrate_images(db, db_dir, dry_run=False, journal=journal, workers=1)
+    assert journal.completed("images").keys() == {"p1234_r1.h5", "p1234_r2.h5"}
+    journal.finish()
+    assert not (db_dir / JOURNAL_NAME).exists()
+
+    # Run 1's thumbnail is found in the file, and run 2's comes from the journal
+    foo = dict(db.conn.execute("SELECT run, foo FROM runs").fetchall())
+    assert BlobTypes.identify(foo[1]) is BlobTypes.png
+    assert foo[2] == b"from journal"